@@ -44,10 +44,18 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # First on the way out, so it compresses the final response
+    'lib.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    # Routes the reads of @replica actions, pins clients after their writes
+    'lib.dbrouter.ReplicaMiddleware',
     'django.middleware.common.CommonMiddleware',
     # 'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Per endpoint/action latency, error and query counters, see /api/metrics
+    'lib.metrics.MetricsMiddleware',
+    # Server-Timing breakdown of /api/ calls, after auth for the staff check
+    'lib.timing.ServerTimingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -76,15 +84,62 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# Connections come from a per-process pool (lib/dbpool) instead of being
+# opened for every request. Sized per environment: CIMP_DB_POOL_SIZE should be
+# at least the number of request threads of a worker
+DB_POOL = {
+    'MAX_SIZE': int(os.environ.get('CIMP_DB_POOL_SIZE', 10)),
+    'TIMEOUT': float(os.environ.get('CIMP_DB_POOL_TIMEOUT', 5)),
+    'MAX_IDLE': float(os.environ.get('CIMP_DB_POOL_MAX_IDLE', 300)),
+    'PRE_PING': os.environ.get('CIMP_DB_POOL_PRE_PING', '1') != '0',
+}
+# CIMP_DB_POOL=0: one connection per request, as Django does by default
+DB_POOLED = os.environ.get('CIMP_DB_POOL', '1') != '0'
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'lib.dbpool.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'POOL': DB_POOL if DB_POOLED else None,
+        # Atomic blocks take the write lock up front, see lib/sqliteprofile.py
+        'TRANSACTION_MODE': 'IMMEDIATE',
     }
 }
 
+# PRAGMAs of every SQLite connection, see lib/sqliteprofile.py
+SQLITE_PROFILE = {
+    'journal_mode': 'WAL',
+    'busy_timeout': 5000,
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+}
+
+# Read replicas, see lib/dbrouter.py: every other alias of DATABASES serves the
+# reads of @replica actions. A copy of the SQLite file works as a local
+# replica: cp db.sqlite3 db-replica.sqlite3 and set CIMP_SQLITE_REPLICA to it
+if os.environ.get('CIMP_SQLITE_REPLICA'):
+    DATABASES['replica'] = {
+        'ENGINE': DATABASES['default']['ENGINE'],
+        'NAME': os.environ['CIMP_SQLITE_REPLICA'],
+        'POOL': DATABASES['default']['POOL'],
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_REPLICAS = [one for one in DATABASES if one != 'default']
+DATABASE_ROUTERS = ['lib.dbrouter.ReplicaRouter']
+# Seconds a client reads from the primary after one of its own writes
+DATABASE_REPLICA_PIN = 5
+# Expected replication lag: replica reads of a table changed more recently
+# than this are not cached
+DATABASE_REPLICA_LAG = 1
+
 AUTH_USER_MODEL = 'main.User'
 
+# Full-text search backend for the 'keywords' parameter, see lib/fulltext.py
+# None picks one by database vendor: FTS5 shadow tables on SQLite, FULLTEXT on MySQL
+# e.g. 'lib.fulltext.LikeBackend' to fall back to plain LIKE
+FULLTEXT_BACKEND = None
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -105,6 +160,83 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# LocMemCache is per process: with several workers use a shared backend
+# (Redis/Memcached), or a write in one worker will not invalidate the others
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'cimp',
+    }
+}
+
+# Seconds a worker serves cached Config values before checking their version again
+CONFIG_CACHE_TTL = 1
+
+# Versioned read cache of getone / first list pages, see lib/readcache.py.
+# Its versions also give the ETags of lib/httpcache.py. Both are off with a
+# per-process cache (LocMemCache) unless READCACHE_LOCAL says there is a
+# single worker process (CIMP_SINGLE_PROCESS=1, e.g. runserver)
+READCACHE_ALIAS = 'default'
+READCACHE_LOCAL = os.environ.get('CIMP_SINGLE_PROCESS', '0') != '0'
+READCACHE_TIMEOUT = 300
+READCACHE_PAGES = 3
+
+# gzip/deflate of /api/ responses, see lib/compression.py
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+COMPRESS_CACHE_ALIAS = 'default'
+COMPRESS_CACHE_TIMEOUT = 300
+
+# Thumb-up counts: buffer count deltas per paper in each worker and write them
+# in batches instead of updating the paper row on every toggle
+THUMBUP_WRITE_BEHIND = False
+THUMBUP_FLUSH_SIZE = 100
+THUMBUP_FLUSH_INTERVAL = 5
+# withliked list flags from a cached set of each user's thumbed up papers
+# instead of one IN lookup per page
+THUMBUP_LIKED_CACHE = False
+
+# Trending papers: seconds for a thumb-up's weight to halve, and how many half
+# lives back refreshtrending reads thumb-ups
+TRENDING_HALF_LIFE = 3 * 86400
+TRENDING_HORIZON = 20
+
+# Distinct reader sketches of notices/news: merge the reads buffered in a
+# worker after this many reads or seconds, see main/models/readers.py
+READERS_FLUSH_SIZE = 1000
+READERS_FLUSH_INTERVAL = 30
+
+# Route notice/news/paper/config/profile requests to the handlers' async entry
+# points (ahandle), whose read actions use the async ORM. Meant for ASGI
+# (config/asgi.py); under WSGI each async view runs in its own event loop, so
+# leave it off there
+ASYNC_READS = False
+
+# Encoder of the JSON responses, see lib/jsonenc.py: 'auto' (orjson when it is
+# installed), 'orjson' or 'stdlib'
+JSON_BACKEND = 'auto'
+
+# Server-Timing header on every /api/ response (lib/timing.py). When off, staff
+# users still get it by sending 'X-Server-Timing: 1' or a 'cimp_timing=1' cookie
+SERVER_TIMING = False
+
+# Latency histograms, error and query counts of /api/ calls (lib/metrics.py).
+# Each worker writes its counters to a file in METRICS_DIR (a directory shared
+# by the workers of one deployment on a host, and by no other deployment) every
+# METRICS_FLUSH_INTERVAL seconds; /api/metrics adds them up. Keep it out of
+# z_dist, which is served as is, so the files are only read through the
+# staff-only view
+METRICS = True
+METRICS_DIR = os.path.join(BASE_DIR, 'var/metrics')
+METRICS_FLUSH_INTERVAL = 10
+
+# Rows fetched per database round trip by the streaming export, see lib/export.py
+EXPORT_CHUNK_SIZE = 2000
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.0/topics/i18n/
 
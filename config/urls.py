@@ -22,6 +22,13 @@ from main import views
 
 from django.conf.urls.static import static
 
+# Handlers with async read actions (ahandle) serve them without a thread per
+# request when the project runs under ASGI
+def entry(handler):
+    if getattr(settings, 'ASYNC_READS', False):
+        return handler.ahandle
+    return handler.handle
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     
@@ -31,18 +38,20 @@ urlpatterns = [
     
     path('api/upload', views.UploadHandler().handle),
     
-    path('api/notice', views.NoticeHandler().handle),
+    path('api/notice', entry(views.NoticeHandler())),
     
-    path('api/news', views.NewsHandler().handle),
+    path('api/news', entry(views.NewsHandler())),
     
-    path('api/paper', views.PaperHandler().handle),
+    path('api/paper', entry(views.PaperHandler())),
     
-    path('api/config', views.ConfigHandler().handle),
+    path('api/config', entry(views.ConfigHandler())),
     
-    path('api/etc', views.ProfileHandler().handle),
+    path('api/etc', entry(views.ProfileHandler())),
     
     path('api/wf_graduatedesign', views.GraduateDesignHandler().handle),
     
+    path('api/metrics', views.MetricsHandler().handle),
+    
 ] 
 
 # + static("/", document_root="./z_dist")
@@ -0,0 +1,133 @@
+import gzip
+import hashlib
+import zlib
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import patch_vary_headers
+
+# gzip/deflate compression of /api/ responses.
+#
+# Responses that carry an ETag (the read actions, see lib/httpcache.py) have
+# the same body for as long as the ETag holds, so their compressed bytes are
+# cached under the ETag: a hot list page is compressed once, later hits only
+# look the bytes up.
+
+CODINGS = ('gzip', 'deflate')
+
+# 'compressed': bodies compressed, 'cached': compressed bodies served from
+# the cache, 'skipped': too small / not accepted, per process
+_stats = {'compressed': 0, 'cached': 0, 'skipped': 0}
+
+
+def compress(data, coding, level):
+    if coding == 'gzip':
+        # mtime=0 keeps the output identical for identical input
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    # HTTP "deflate" is the zlib format
+    return zlib.compress(data, level)
+
+
+def negotiate(header):
+    """
+    Preferred coding accepted by an Accept-Encoding header, or None.
+    q-values are honoured, a tie goes to the order of CODINGS
+    """
+    accepted = {}
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding] = q
+
+    best, bestq = None, 0.0
+    for coding in CODINGS:
+        q = accepted.get(coding, accepted.get('*', 0.0))
+        if q > bestq:
+            best, bestq = coding, q
+    return best
+
+
+def stats():
+    return dict(_stats)
+
+
+class CompressionMiddleware:
+    # Under ASGI the async handlers' responses pass through without a thread
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        self.prefix = getattr(settings, 'COMPRESS_PREFIX', '/api/')
+        self.minsize = getattr(settings, 'COMPRESS_MIN_SIZE', 1024)
+        self.level = getattr(settings, 'COMPRESS_LEVEL', 6)
+        self.cachealias = getattr(settings, 'COMPRESS_CACHE_ALIAS', 'default')
+        self.timeout = getattr(settings, 'COMPRESS_CACHE_TIMEOUT', 300)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        coding = self.coding(request, response)
+        return response if coding is None else self.compressed(request, response, coding)
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        coding = self.coding(request, response)
+        if coding is None:
+            return response
+        # The cache lookups and compression of a large body would block the
+        # event loop, they run in a thread
+        return await sync_to_async(self.compressed)(request, response, coding)
+
+    def coding(self, request, response):
+        """
+        Coding to compress the response with, None to send it as it is
+        """
+        if not request.path.startswith(self.prefix):
+            return None
+        if response.streaming or response.status_code != 200 or response.has_header('Content-Encoding'):
+            return None
+
+        # The representation depends on Accept-Encoding even when it is not compressed
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        coding = negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if coding is None or len(response.content) < self.minsize:
+            _stats['skipped'] += 1
+            return None
+        return coding
+
+    def compressed(self, request, response, coding):
+        etag = response.get('ETag')
+        if etag:
+            cache = caches[self.cachealias]
+            key = f'cimp:gz:{coding}:{self.level}:' + hashlib.md5(f'{request.path}|{etag}'.encode('utf-8')).hexdigest()
+            body = cache.get(key)
+            if body is None:
+                body = compress(response.content, coding, self.level)
+                cache.set(key, body, self.timeout)
+                _stats['compressed'] += 1
+            else:
+                _stats['cached'] += 1
+        else:
+            body = compress(response.content, coding, self.level)
+            _stats['compressed'] += 1
+
+        if len(body) >= len(response.content):
+            return response
+
+        response.content = body
+        response['Content-Length'] = str(len(body))
+        response['Content-Encoding'] = coding
+        return response
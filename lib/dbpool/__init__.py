@@ -0,0 +1,224 @@
+import threading
+import time
+from collections import deque
+
+from django.db.utils import OperationalError
+
+# Database connection pool for Django 4.2, which has none.
+#
+# The backends in this package (ENGINE 'lib.dbpool.sqlite3' / 'lib.dbpool.mysql')
+# are the Django ones, except that opening a connection takes one from a pool
+# and closing it (at the end of every request while CONN_MAX_AGE is 0) hands
+# it back. Pool options come from the 'POOL' entry of the database settings,
+# no entry (or None) means no pool:
+#
+#   MAX_SIZE  connections open at most, in use or idle (default 10)
+#   TIMEOUT   seconds to wait for one when all are in use (default 5)
+#   MAX_IDLE  seconds an idle connection is kept before it is closed (default 300)
+#   PRE_PING  check an idle connection before handing it out (default True)
+#
+# The pool is per process and thread safe, so it serves the request threads
+# of a WSGI worker and the sync_to_async threads of an ASGI one alike.
+
+DEFAULTS = {'MAX_SIZE': 10, 'TIMEOUT': 5, 'MAX_IDLE': 300, 'PRE_PING': True}
+
+# (alias, database, host, port, user) -> Pool
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+class Pool:
+    def __init__(self, alias, options):
+        self.alias = alias
+        options = dict(DEFAULTS, **options)
+        self.maxsize = options['MAX_SIZE']
+        self.timeout = options['TIMEOUT']
+        self.maxidle = options['MAX_IDLE']
+        self.preping = options['PRE_PING']
+        # (connection, monotonic time it was returned), most recent last
+        self.idle = deque()
+        # Connections open, idle or in use
+        self.size = 0
+        self.cond = threading.Condition()
+        self.stats = {'checkouts': 0, 'waits': 0, 'timeouts': 0, 'created': 0, 'reaped': 0, 'discarded': 0}
+
+    def _reap(self, now):
+        # Oldest first: close the connections idle for longer than MAX_IDLE
+        while self.idle and now - self.idle[0][1] > self.maxidle:
+            conn, _ = self.idle.popleft()
+            self.size -= 1
+            self.stats['reaped'] += 1
+            _quietclose(conn)
+
+    def checkout(self, connect, ping):
+        """
+        An idle connection that answers ping(connection), or a new one from
+        connect() while the pool has room. Waits up to TIMEOUT otherwise
+        """
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        while True:
+            with self.cond:
+                while True:
+                    now = time.monotonic()
+                    self._reap(now)
+                    if self.idle:
+                        # The most recently used one, so the others can go idle and be reaped
+                        conn, _ = self.idle.pop()
+                        break
+                    if self.size < self.maxsize:
+                        self.size += 1
+                        conn = None
+                        break
+                    if not waited:
+                        self.stats['waits'] += 1
+                        waited = True
+                    if now >= deadline:
+                        self.stats['timeouts'] += 1
+                        raise PoolTimeout(f'No database connection free in the {self.alias} pool '
+                                          f'after {self.timeout}s ({self.maxsize} in use)')
+                    self.cond.wait(deadline - now)
+
+            if conn is None:
+                try:
+                    conn = connect()
+                except:
+                    self.release()
+                    raise
+                with self.cond:
+                    self.stats['created'] += 1
+                    self.stats['checkouts'] += 1
+                return conn
+
+            if self.preping and not ping(conn):
+                self.discard(conn)
+                continue
+            with self.cond:
+                self.stats['checkouts'] += 1
+            return conn
+
+    def checkin(self, conn):
+        try:
+            # Nothing left over from the previous user
+            conn.rollback()
+        except Exception:
+            self.discard(conn)
+            return
+        with self.cond:
+            now = time.monotonic()
+            self.idle.append((conn, now))
+            self._reap(now)
+            self.cond.notify()
+
+    def release(self):
+        # A slot given up without a connection to return
+        with self.cond:
+            self.size -= 1
+            self.cond.notify()
+
+    def discard(self, conn):
+        _quietclose(conn)
+        with self.cond:
+            self.stats['discarded'] += 1
+        self.release()
+
+    def snapshot(self):
+        with self.cond:
+            return dict(self.stats, size=self.size, idle=len(self.idle), maxsize=self.maxsize)
+
+
+def _quietclose(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def pool(wrapper):
+    """
+    The pool of a DatabaseWrapper's database
+    """
+    s = wrapper.settings_dict
+    # The test runner points an alias at another database, which must not get
+    # the connections of the first one
+    key = (wrapper.alias, str(s['NAME']), s['HOST'], s['PORT'], s['USER'])
+    found = _pools.get(key)
+    if found is None:
+        with _pools_lock:
+            found = _pools.get(key)
+            if found is None:
+                found = _pools[key] = Pool(wrapper.alias, s.get('POOL') or {})
+    return found
+
+
+def stats():
+    """
+    alias -> pool counters of this process
+    """
+    ret = {}
+    for (alias, name, *_), one in list(_pools.items()):
+        ret[alias if alias not in ret else f'{alias}:{name}'] = one.snapshot()
+    return ret
+
+
+def reset():
+    """
+    Close the idle connections of every pool and forget the pools, e.g.
+    before forking processes that must not share connections
+    """
+    with _pools_lock:
+        for one in _pools.values():
+            with one.cond:
+                while one.idle:
+                    _quietclose(one.idle.pop()[0])
+        _pools.clear()
+
+
+class PooledDatabaseWrapperMixin:
+    """
+    Mixed in before a backend's DatabaseWrapper. Without a 'POOL' entry in the
+    database settings it connects and closes as usual
+    """
+    # Whether the current connection was handed out again by the pool, and
+    # so has already been set up by connection_created receivers
+    reused = False
+
+    def get_new_connection(self, conn_params):
+        if not self.settings_dict.get('POOL'):
+            self.reused = False
+            return super().get_new_connection(conn_params)
+
+        def connect():
+            self.reused = False
+            return super(PooledDatabaseWrapperMixin, self).get_new_connection(conn_params)
+
+        self.reused = True
+        return pool(self).checkout(connect, self.ping)
+
+    def ping(self, conn):
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('SELECT 1')
+                cursor.fetchall()
+            finally:
+                cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _close(self):
+        if not self.settings_dict.get('POOL'):
+            return super()._close()
+        if self.connection is None:
+            return
+        if self.in_atomic_block:
+            # Closed halfway through a transaction (after an error), the
+            # connection is not reused
+            pool(self).discard(self.connection)
+            return
+        pool(self).checkin(self.connection)
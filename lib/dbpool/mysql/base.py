@@ -0,0 +1,13 @@
+from django.db.backends.mysql import base
+
+from lib.dbpool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    def ping(self, conn):
+        # A round trip without a statement; reconnecting is left to the pool
+        try:
+            conn.ping()
+            return True
+        except Exception:
+            return False
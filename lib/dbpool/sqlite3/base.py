@@ -0,0 +1,27 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+from lib.dbpool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    def get_new_connection(self, conn_params):
+        # An in-memory database (tests) lives as long as its connections,
+        # which Django never closes, so they are kept out of the pool
+        if self.is_in_memory_db():
+            self.reused = False
+            return base.DatabaseWrapper.get_new_connection(self, conn_params)
+        return super().get_new_connection(conn_params)
+
+    def _start_transaction_under_autocommit(self):
+        # 'TRANSACTION_MODE': 'IMMEDIATE' takes the write lock when an atomic
+        # block starts. With the default deferred BEGIN, a transaction that
+        # read first and then writes can fail with "database is locked" at
+        # once instead of waiting busy_timeout, when another writer got in between
+        mode = self.settings_dict.get('TRANSACTION_MODE')
+        if mode and mode not in ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE'):
+            raise ImproperlyConfigured(f'Unknown SQLite TRANSACTION_MODE {mode!r}')
+        if mode:
+            self.cursor().execute(f'BEGIN {mode}')
+        else:
+            super()._start_transaction_under_autocommit()
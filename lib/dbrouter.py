@@ -0,0 +1,134 @@
+import contextvars
+import functools
+import inspect
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Read replica routing.
+#
+# Handler read actions are marked with @replica. While one runs, ORM reads go
+# to one of the DATABASE_REPLICAS aliases; everything else (writes, reads of
+# unmarked actions, reads inside a transaction, management commands) goes to
+# the primary 'default' database.
+#
+# Read-your-writes: a request that wrote gets a short-lived cookie, and the
+# requests of that client carrying it read from the primary until it expires
+# (DATABASE_REPLICA_PIN seconds), so users see their own changes at once
+# whatever the replication lag.
+
+PIN_COOKIE = 'cimp_primary'
+
+# Routing state of the current request: {'read': in a @replica action,
+# 'pinned': client wrote recently, 'wrote': this request wrote}
+_state = contextvars.ContextVar('cimp_dbroute', default=None)
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def onreplica():
+    """
+    Whether ORM reads made now go to a replica
+    """
+    state = _state.get()
+    return bool(state and state['read'] and not state['pinned'] and replicas()
+                and not connections[DEFAULT_DB_ALIAS].in_atomic_block)
+
+
+def replica(method):
+    """
+    Decorator for handler read actions (sync or async) whose reads may be
+    served by a replica. Put it above @conditional, which checks the routing
+    """
+    def enter():
+        state = _state.get()
+        if state is None:
+            return None, None
+        previous = state['read']
+        state['read'] = True
+        return state, previous
+
+    if inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def awrapper(self, request):
+            state, previous = enter()
+            try:
+                return await method(self, request)
+            finally:
+                if state is not None:
+                    state['read'] = previous
+        return awrapper
+
+    @functools.wraps(method)
+    def wrapper(self, request):
+        state, previous = enter()
+        try:
+            return method(self, request)
+        finally:
+            if state is not None:
+                state['read'] = previous
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if onreplica():
+            return random.choice(replicas())
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        # Writes made on the side of a read (buffer flushes, ...) do not pin
+        if state is not None and not state['read']:
+            state['wrote'] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas are copies of the primary, never migrated on their own
+        return db not in replicas()
+
+
+class ReplicaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token, state = self.enter(request)
+        try:
+            return self.leave(state, self.get_response(request))
+        finally:
+            _state.reset(token)
+
+    async def __acall__(self, request):
+        token, state = self.enter(request)
+        try:
+            return self.leave(state, await self.get_response(request))
+        finally:
+            _state.reset(token)
+
+    def enter(self, request):
+        # A dict, so that changes made in sync_to_async threads are seen here
+        state = {'read': False, 'pinned': PIN_COOKIE in request.COOKIES, 'wrote': False}
+        return _state.set(state), state
+
+    def leave(self, state, response):
+        if state['wrote'] and replicas():
+            pin = getattr(settings, 'DATABASE_REPLICA_PIN', 5)
+            response.set_cookie(PIN_COOKIE, str(int(time.time()) + pin), max_age=pin, httponly=True, samesite='Lax')
+        return response
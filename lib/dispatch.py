@@ -0,0 +1,201 @@
+import inspect
+import json
+import time
+
+from asgiref.sync import sync_to_async
+
+from lib import timing
+from lib.share import JR, auser
+
+# Request pipeline shared by the API handlers.
+#
+# The parameters of a request are parsed once, the query string for GET and
+# the JSON body otherwise, into the plain dict request.pd. Handler methods are
+# registered as actions with @action; the registry (action name -> method and
+# parameter schema) is built when the handler class is created, so a request
+# costs one dict lookup to find its action whatever the number of actions, and
+# the declared parameters are coerced and checked before the action runs:
+# actions read typed values from request.pd.
+
+
+def integer(value):
+    # True/False are ints to Python, not ids or sizes to the API
+    if isinstance(value, bool):
+        raise ValueError(value)
+    return int(value)
+
+
+def positive(value):
+    value = integer(value)
+    if value < 1:
+        raise ValueError(value)
+    return value
+
+
+def flag(value):
+    # "false", "0", "no" and "" from a query string are false
+    if isinstance(value, str):
+        return value.lower() not in ('false', '0', 'no', '')
+    return bool(value)
+
+
+# Parameter name -> converter, the same meaning for every handler
+FIELDS = {
+    'pagenum': positive,
+    'pagesize': positive,
+    'id': integer,
+    'withoutcontent': flag,
+    'withliked': flag,
+}
+
+
+def schema(params):
+    """
+    Parameter declarations of an action, like ('pagesize', 'pagenum?'), as a
+    tuple of (name, converter, required). A trailing '?' marks an optional
+    parameter
+    """
+    compiled = []
+    for one in params:
+        name = one.rstrip('?')
+        compiled.append((name, FIELDS[name], not one.endswith('?')))
+    return tuple(compiled)
+
+
+def coerce(pd, compiled):
+    """
+    Convert the declared parameters of pd in place. Empty optional parameters
+    are removed. Raises ValueError on a missing or malformed one
+    """
+    for name, convert, required in compiled:
+        value = pd.get(name)
+        if value is None or value == '':
+            if required:
+                raise ValueError(name)
+            pd.pop(name, None)
+            continue
+        pd[name] = convert(value)
+
+
+def parse(request):
+    """
+    request.pd, parsed on first use. Raises ValueError when the body is not a
+    JSON object
+    """
+    pd = getattr(request, 'pd', None)
+    if pd is None:
+        if request.method == 'GET':
+            pd = request.GET.dict()
+        else:
+            record = timing.current()
+            start = time.perf_counter()
+            pd = json.loads(request.body) if request.body else {}
+            if record is not None:
+                record['parse'] += time.perf_counter() - start
+            if not isinstance(pd, dict):
+                raise ValueError('body')
+        request.pd = pd
+    return pd
+
+
+def action(name, *params):
+    """
+    Decorator registering a handler method (sync or async) as action `name`,
+    with the parameters it expects. Put it above the other decorators
+    """
+    compiled = schema(params)
+
+    def decorator(method):
+        method.action = (name, compiled)
+        return method
+    return decorator
+
+
+class Handler:
+    # HTTP status of the answer to an unknown action
+    UNKNOWN_ACTION_STATUS = 200
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Sync and async actions; an async one is served by ahandle in place
+        # of the sync action of the same name
+        cls.ACTIONS, cls.AACTIONS = {}, {}
+        for klass in reversed(cls.__mro__):
+            for member in vars(klass).values():
+                declared = getattr(member, 'action', None)
+                if declared is None:
+                    continue
+                name, compiled = declared
+                registry = cls.AACTIONS if inspect.iscoroutinefunction(member) else cls.ACTIONS
+                registry[name] = (member, compiled)
+
+    def allow(self, request):
+        """
+        None when the request may use this handler, otherwise the response
+        refusing it. request.user is already loaded
+        """
+        return None
+
+    def resolve(self, request, asynchronous=False):
+        """
+        (method, None) of the action of the request, or (None, error response).
+        With asynchronous, an async action is preferred to the sync one
+        """
+        try:
+            pd = parse(request)
+        except ValueError:
+            return None, JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+
+        name = pd.get('action')
+        found = None
+        if isinstance(name, str):
+            found = (asynchronous and self.AACTIONS.get(name)) or self.ACTIONS.get(name)
+        if found is None:
+            return None, JR({'ret': 2, 'msg': 'Action parameter error'}, status=self.UNKNOWN_ACTION_STATUS)
+
+        method, compiled = found
+        record = timing.current()
+        if record is not None:
+            record['view'], record['action'] = type(self).__name__, name
+        try:
+            coerce(pd, compiled)
+        except (TypeError, ValueError):
+            return None, JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+        return method, None
+
+    def handle(self, request):
+        refused = self.allow(request)
+        if refused is not None:
+            return refused
+        method, error = self.resolve(request)
+        if error is not None:
+            return error
+        record = timing.current()
+        if record is None:
+            return method(self, request)
+        start = time.perf_counter()
+        try:
+            return method(self, request)
+        finally:
+            record['run'] += time.perf_counter() - start
+
+    # ASGI entry point (settings.ASYNC_READS): the async actions run on the
+    # event loop with the async ORM, the others in a thread
+    async def ahandle(self, request):
+        await auser(request)
+        refused = self.allow(request)
+        if refused is not None:
+            return refused
+        method, error = self.resolve(request, asynchronous=True)
+        if error is not None:
+            return error
+        record = timing.current()
+        start = time.perf_counter()
+        try:
+            if inspect.iscoroutinefunction(method):
+                return await method(self, request)
+            return await sync_to_async(method)(self, request)
+        finally:
+            if record is not None:
+                record['run'] += time.perf_counter() - start
+
@@ -0,0 +1,201 @@
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+# Full-text index for the 'keywords' search of content listings.
+#
+# content__contains is a LIKE '%x%' scan over the whole TextField. Here each
+# registered model gets an index that is kept in sync by the model's
+# addone/modifyone/deleteone, and search() narrows a queryset through it.
+#
+#   sqlite: an FTS5 shadow table "<db_table>_fts" (trigram tokenizer, so it
+#           keeps the substring semantics of contains and works for CJK text)
+#   mysql:  a FULLTEXT index with the ngram parser on the content column,
+#           maintained by InnoDB itself
+#   other:  plain LIKE, same as before
+#
+# The backend is chosen by connection vendor, or forced with
+# settings.FULLTEXT_BACKEND (a dotted path to a backend class).
+
+# db_table -> (model, indexed field)
+registry = {}
+
+
+def register(model, field='content'):
+    registry[model._meta.db_table] = (model, field)
+
+
+class LikeBackend:
+    """
+    Fallback: AND together content__contains, no index to maintain
+    """
+    def setup(self, conn, model, field):
+        pass
+
+    def index(self, conn, model, field, rowid, text):
+        pass
+
+    def unindex(self, conn, model, rowids):
+        pass
+
+    def rebuild(self, conn, model, field):
+        pass
+
+    def search(self, qs, field, terms):
+        query = Q()
+        for one in terms:
+            query &= Q(**{f'{field}__contains': one})
+        return qs.filter(query)
+
+
+class SqliteFTS5Backend(LikeBackend):
+    # trigram tokens are 3 characters, shorter terms cannot be matched by the index
+    MIN_TERM_LEN = 3
+
+    @staticmethod
+    def shadow(model):
+        return f'{model._meta.db_table}_fts'
+
+    def setup(self, conn, model, field):
+        fts = self.shadow(model)
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=%s", [fts])
+            if cursor.fetchone():
+                return
+            cursor.execute(f'CREATE VIRTUAL TABLE "{fts}" USING fts5({field}, tokenize=\'trigram\')')
+        # Existing rows are indexed once when the shadow table is first created
+        self.rebuild(conn, model, field)
+
+    def index(self, conn, model, field, rowid, text):
+        fts = self.shadow(model)
+        with conn.cursor() as cursor:
+            cursor.execute(f'DELETE FROM "{fts}" WHERE rowid = %s', [rowid])
+            cursor.execute(f'INSERT INTO "{fts}" (rowid, {field}) VALUES (%s, %s)', [rowid, text])
+
+    def unindex(self, conn, model, rowids):
+        fts = self.shadow(model)
+        with conn.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM "{fts}" WHERE rowid = %s', [[one] for one in rowids])
+
+    def rebuild(self, conn, model, field):
+        fts = self.shadow(model)
+        table = model._meta.db_table
+        with conn.cursor() as cursor:
+            cursor.execute(f'DELETE FROM "{fts}"')
+            cursor.execute(f'INSERT INTO "{fts}" (rowid, {field}) SELECT id, {field} FROM "{table}"')
+
+    def search(self, qs, field, terms):
+        long_terms = [one for one in terms if len(one) >= self.MIN_TERM_LEN]
+        short_terms = [one for one in terms if len(one) < self.MIN_TERM_LEN]
+
+        if long_terms:
+            fts = self.shadow(qs.model)
+            # Each term is a quoted phrase, space between phrases means AND
+            expr = ' '.join('"%s"' % one.replace('"', '""') for one in long_terms)
+            qs = qs.filter(id__in=RawSQL(f'SELECT rowid FROM "{fts}" WHERE "{fts}" MATCH %s', [expr]))
+
+        # Short terms only filter rows the index has already narrowed down
+        return super().search(qs, field, short_terms)
+
+
+class MySQLFulltextBackend(LikeBackend):
+    # Default ngram_token_size
+    MIN_TERM_LEN = 2
+
+    @staticmethod
+    def indexname(model):
+        return f'{model._meta.db_table}_ft'
+
+    def setup(self, conn, model, field):
+        table = model._meta.db_table
+        name = self.indexname(model)
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM information_schema.statistics "
+                "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s",
+                [table, name])
+            if cursor.fetchone():
+                return
+            cursor.execute(f'ALTER TABLE `{table}` ADD FULLTEXT INDEX `{name}` (`{field}`) WITH PARSER ngram')
+
+    def search(self, qs, field, terms):
+        long_terms = [one for one in terms if len(one) >= self.MIN_TERM_LEN]
+        short_terms = [one for one in terms if len(one) < self.MIN_TERM_LEN]
+
+        if long_terms:
+            table = qs.model._meta.db_table
+            # Every term required, each one a phrase
+            expr = ' '.join('+"%s"' % one.replace('"', '') for one in long_terms)
+            qs = qs.extra(where=[f'MATCH(`{table}`.`{field}`) AGAINST (%s IN BOOLEAN MODE)'], params=[expr])
+
+        return super().search(qs, field, short_terms)
+
+
+VENDOR_BACKENDS = {
+    'sqlite': SqliteFTS5Backend,
+    'mysql': MySQLFulltextBackend,
+}
+
+_backends = {}
+
+
+def backend(conn):
+    """
+    Backend instance for a database connection
+    """
+    if conn.alias not in _backends:
+        path = getattr(settings, 'FULLTEXT_BACKEND', None)
+        cls = import_string(path) if path else VENDOR_BACKENDS.get(conn.vendor, LikeBackend)
+        _backends[conn.alias] = cls()
+    return _backends[conn.alias]
+
+
+def _writeconn(model):
+    return connections[router.db_for_write(model)]
+
+
+def index(model, rowid, text):
+    """
+    (Re)index one row. Call inside the transaction that wrote the row
+    """
+    _, field = registry[model._meta.db_table]
+    conn = _writeconn(model)
+    backend(conn).index(conn, model, field, rowid, text)
+
+
+def unindex(model, rowids):
+    """
+    Drop rows from the index. Call inside the transaction that deleted them
+    """
+    conn = _writeconn(model)
+    backend(conn).unindex(conn, model, list(rowids))
+
+
+def search(qs, keywords):
+    """
+    Narrow `qs` to rows whose indexed field contains every space separated keyword
+    """
+    terms = [one for one in keywords.split(' ') if one]
+    if not terms:
+        return qs
+    _, field = registry[qs.model._meta.db_table]
+    return backend(connections[qs.db]).search(qs, field, terms)
+
+
+def rebuild(using='default'):
+    conn = connections[using]
+    for model, field in registry.values():
+        backend(conn).setup(conn, model, field)
+        backend(conn).rebuild(conn, model, field)
+
+
+def setup(sender, using='default', **kwargs):
+    """
+    post_migrate receiver: create the index structures that Django does not manage
+    """
+    conn = connections[using]
+    for model, field in registry.values():
+        if router.allow_migrate_model(using, model):
+            backend(conn).setup(conn, model, field)
@@ -0,0 +1,53 @@
+import hashlib
+import math
+
+# HyperLogLog distinct counting.
+#
+# A sketch is 2 ** PRECISION one-byte registers (4 KB), whatever the number of
+# distinct values added, with a standard error of about 1.04 / sqrt(2 ** PRECISION)
+# (1.6%). Sketches merge by taking the register-wise maximum, so partial
+# sketches built in different workers can be combined in any order.
+
+PRECISION = 12
+REGISTERS = 1 << PRECISION
+_ALPHA = 0.7213 / (1 + 1.079 / REGISTERS)
+
+
+def empty():
+    return bytearray(REGISTERS)
+
+
+def add(sketch, value):
+    """
+    Add a value (anything with a stable str()) to a bytearray sketch
+    """
+    h = int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'big')
+    index = h >> (64 - PRECISION)
+    rest = h & ((1 << (64 - PRECISION)) - 1)
+    # Position of the leftmost 1 bit in the remaining 64 - PRECISION bits
+    rank = (64 - PRECISION) - rest.bit_length() + 1
+    if rank > sketch[index]:
+        sketch[index] = rank
+
+
+def merge(sketch, other):
+    """
+    Register-wise maximum of two sketches, as a new bytearray
+    """
+    if not sketch:
+        return bytearray(other)
+    if not other:
+        return bytearray(sketch)
+    return bytearray(map(max, sketch, other))
+
+
+def estimate(sketch):
+    if not sketch:
+        return 0
+    total = math.fsum(2.0 ** -one for one in sketch)
+    raw = _ALPHA * REGISTERS * REGISTERS / total
+    zeros = sketch.count(0)
+    # Small range: linear counting is more accurate while registers are empty
+    if raw <= 2.5 * REGISTERS and zeros:
+        return round(REGISTERS * math.log(REGISTERS / zeros))
+    return round(raw)
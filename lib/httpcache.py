@@ -0,0 +1,131 @@
+import functools
+import hashlib
+import inspect
+import json
+import time
+
+from django.http import HttpResponseNotModified
+from django.utils.http import http_date, parse_http_date_safe, parse_etags, quote_etag
+from django.utils.cache import patch_vary_headers
+
+from lib import readcache
+
+# HTTP conditional requests (ETag / Last-Modified / 304) for read actions.
+#
+# Validators come from the per-table change version kept by lib.readcache, so
+# answering a matching If-None-Match / If-Modified-Since costs a couple of
+# cache lookups and no query or serialization at all.
+#
+# Read actions are safe whatever the HTTP method, so POST requests carrying
+# the headers are answered the same way as GET.
+#
+# The versions are only trusted when every worker sees the same ones
+# (readcache.enabled()); otherwise the actions run as if undecorated.
+
+
+def _params(request):
+    pd = request.pd
+    if hasattr(pd, 'lists'):
+        pd = dict(pd.lists())
+    return json.dumps(pd, sort_keys=True, default=str)
+
+
+def validators(request, tables):
+    """
+    (etag, last modified unix time) of a read action over `tables` for this
+    request. The ETag covers the table versions, the request parameters and
+    the user, since some responses depend on who asks
+    """
+    versions = [readcache.version(one) for one in tables]
+    changed = [readcache.changed(one) for one in tables]
+    return _validators(request, versions, changed)
+
+
+async def avalidators(request, tables):
+    """
+    validators() for async actions
+    """
+    versions = [await readcache.aversion(one) for one in tables]
+    changed = [await readcache.achanged(one) for one in tables]
+    return _validators(request, versions, changed)
+
+
+def _validators(request, versions, changed):
+    raw = f'{request.path}|{_params(request)}|{request.user.pk}|{versions}'
+    etag = 'W/' + quote_etag(hashlib.md5(raw.encode('utf-8')).hexdigest())
+    return etag, max(changed)
+
+
+def notmodified(request, etag, lastmodified):
+    inm = request.META.get('HTTP_IF_NONE_MATCH')
+    if inm is not None:
+        # If-None-Match takes precedence, If-Modified-Since is then ignored
+        tags = parse_etags(inm)
+        # Weak comparison
+        return '*' in tags or etag.removeprefix('W/') in [one.removeprefix('W/') for one in tags]
+
+    ims = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return ims is not None and int(lastmodified) <= ims
+
+
+def conditional(*tables):
+    """
+    Decorator for handler read actions (sync or async): answer 304 when the
+    client's validators still match, otherwise run the action and add
+    ETag / Last-Modified. A table name may hold '{user}', the id of the
+    user asking, for versions kept per user
+    """
+    def decorator(method):
+        def resolve(request):
+            return [one.format(user=request.user.pk) for one in tables]
+
+        def before(request, etag, lastmodified):
+            # Last-Modified has a one second resolution. A second change within
+            # the same second would keep the same date, so it is only sent once
+            # the last change is at least a second old.
+            lmheader = http_date(lastmodified) if time.time() - lastmodified >= 1 else None
+            return etag, lmheader, notmodified(request, etag, lastmodified)
+
+        def after(response, etag, lmheader):
+            response['ETag'] = etag
+            if lmheader:
+                response['Last-Modified'] = lmheader
+            response['Cache-Control'] = 'private, no-cache'
+            patch_vary_headers(response, ('Cookie',))
+            return response
+
+        def succeeded(response):
+            return response.status_code == 200 and getattr(response, 'ret', 0) == 0
+
+        # A replica read may predate the change the ETag stands for, so the
+        # validators are only sent with settled tables
+        if inspect.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def awrapper(self, request):
+                if not readcache.enabled():
+                    return await method(self, request)
+                names = resolve(request)
+                etag, lmheader, fresh = before(request, *await avalidators(request, names))
+                if fresh:
+                    return after(HttpResponseNotModified(), etag, lmheader)
+                response = await method(self, request)
+                if succeeded(response) and all([await readcache.asettled(one) for one in names]):
+                    return after(response, etag, lmheader)
+                return response
+            return awrapper
+
+        @functools.wraps(method)
+        def wrapper(self, request):
+            if not readcache.enabled():
+                return method(self, request)
+            names = resolve(request)
+            etag, lmheader, fresh = before(request, *validators(request, names))
+            if fresh:
+                return after(HttpResponseNotModified(), etag, lmheader)
+            response = method(self, request)
+            if succeeded(response) and all(readcache.settled(one) for one in names):
+                return after(response, etag, lmheader)
+            return response
+
+        return wrapper
+    return decorator
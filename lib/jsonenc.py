@@ -0,0 +1,60 @@
+import json
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON encoding of API responses (lib.share.JR).
+#
+# JSON_BACKEND picks the encoder: 'orjson', native and used by 'auto' when the
+# package is installed, or 'stdlib'. Both encode values the way
+# DjangoJSONEncoder does (datetimes as ISO 8601 strings truncated to
+# milliseconds, Decimal and UUID as strings, ...) and return compact UTF-8
+# bytes with non-ASCII characters kept as they are.
+#
+# orjson has no millisecond datetime format, so datetimes still cost one call
+# to DjangoJSONEncoder.default each; the rest of the document is encoded
+# natively. Converting the datetime columns beforehand measures no faster
+# (benchjson), the Python work per datetime is the same.
+
+_encoder = DjangoJSONEncoder()
+
+
+def stdlib(data):
+    return json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False,
+                      separators=(',', ':')).encode('utf-8')
+
+
+def native(data):
+    try:
+        return orjson.dumps(data, default=_encoder.default,
+                            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+    except orjson.JSONEncodeError:
+        # Integers over 64 bits and other values only json takes
+        return stdlib(data)
+
+
+BACKENDS = {'stdlib': stdlib}
+if orjson is not None:
+    BACKENDS['orjson'] = native
+
+
+def backend():
+    name = getattr(settings, 'JSON_BACKEND', 'auto')
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'stdlib'
+    if name not in BACKENDS:
+        raise ImproperlyConfigured(f'JSON_BACKEND {name!r} is not available')
+    return BACKENDS[name]
+
+
+def dumps(data):
+    """
+    data as JSON bytes, with the configured backend
+    """
+    return backend()(data)
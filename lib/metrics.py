@@ -0,0 +1,252 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from lib import timing
+
+logger = logging.getLogger(__name__)
+
+# Latency, error and query metrics of the API, per (endpoint, action).
+#
+# Each thread counts into its own table, so recording a request takes no lock:
+# a latency histogram with fixed BUCKETS boundaries, the error count (ret != 0
+# or an HTTP error status), the number of queries and the latency sum.
+# Every METRICS_FLUSH_INTERVAL seconds a worker writes the sum of its tables
+# to its own file in METRICS_DIR; /api/metrics adds up the files of all the
+# workers and renders them in the Prometheus text format.
+
+# Upper bounds (seconds) of the latency buckets, +Inf comes after them
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Row layout: BUCKETS + 1 bucket counts, then errors, queries, latency sum
+_ERRORS = len(BUCKETS) + 1
+_QUERIES = _ERRORS + 1
+_SUM = _QUERIES + 1
+
+_local = threading.local()
+# Tables of every thread of this process
+_tables = []
+_tableslock = threading.Lock()
+# Held by the thread writing this worker's file, the others do not wait
+_flushlock = threading.Lock()
+# [monotonic time of the last flush, file name of this process]
+_state = [time.monotonic(), None]
+
+
+def _newrow():
+    return [0] * (len(BUCKETS) + 1) + [0, 0, 0.0]
+
+
+def _table():
+    table = getattr(_local, 'table', None)
+    if table is None:
+        table = _local.table = {}
+        with _tableslock:
+            _tables.append(table)
+    return table
+
+
+def observe(endpoint, action, seconds, error, queries):
+    """
+    Count one request
+    """
+    table = _table()
+    row = table.get((endpoint, action))
+    if row is None:
+        row = table[(endpoint, action)] = _newrow()
+    row[bisect.bisect_left(BUCKETS, seconds)] += 1
+    if error:
+        row[_ERRORS] += 1
+    row[_QUERIES] += queries
+    row[_SUM] += seconds
+
+    if time.monotonic() - _state[0] >= getattr(settings, 'METRICS_FLUSH_INTERVAL', 10):
+        tryflush()
+
+
+def _add(total, key, row):
+    mine = total.get(key)
+    if mine is None:
+        total[key] = list(row)
+    else:
+        for i, value in enumerate(row):
+            mine[i] += value
+
+
+def snapshot():
+    """
+    (endpoint, action) -> row, summed over the threads of this process
+    """
+    with _tableslock:
+        tables = list(_tables)
+    total = {}
+    for table in tables:
+        # list() of a dict is taken at once, while its thread may add keys
+        for key, row in list(table.items()):
+            _add(total, key, row)
+    return total
+
+
+def directory():
+    # Files of another deployment in the same directory would be added up too,
+    # so there is no shared default such as the temp directory
+    path = getattr(settings, 'METRICS_DIR', None)
+    if not path:
+        raise ImproperlyConfigured('METRICS_DIR is not set')
+    return path
+
+
+def flush():
+    """
+    Write this process's counters to its file in METRICS_DIR
+    """
+    if not _flushlock.acquire(blocking=False):
+        return
+    try:
+        _state[0] = time.monotonic()
+        if _state[1] is None:
+            # The start time tells a restarted worker from an old one with the same pid
+            _state[1] = f'{os.getpid()}-{int(time.time() * 1000)}.json'
+        path = directory()
+        os.makedirs(path, exist_ok=True)
+        data = {'buckets': BUCKETS, 'rows': [[key[0], key[1], row] for key, row in snapshot().items()]}
+        target = os.path.join(path, _state[1])
+        with open(target + '.tmp', 'w') as f:
+            json.dump(data, f)
+        os.replace(target + '.tmp', target)
+    finally:
+        _flushlock.release()
+
+
+def tryflush():
+    try:
+        flush()
+    except:
+        # Counted anyway, the next flush writes them
+        logger.exception('Writing the metrics file failed')
+
+
+def aggregate():
+    """
+    (endpoint, action) -> row, summed over the files of all the workers.
+    Files untouched for METRICS_RETENTION seconds (workers gone long ago) are
+    removed
+    """
+    flush()
+    path = directory()
+    os.makedirs(path, exist_ok=True)
+    retention = getattr(settings, 'METRICS_RETENTION', 86400)
+    total = {}
+    for name in os.listdir(path):
+        if not name.endswith('.json'):
+            continue
+        one = os.path.join(path, name)
+        try:
+            if time.time() - os.path.getmtime(one) > retention:
+                os.remove(one)
+                continue
+            with open(one) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            # Removed or replaced meanwhile
+            continue
+        if tuple(data['buckets']) != BUCKETS:
+            continue
+        for endpoint, action, row in data['rows']:
+            _add(total, (endpoint, action), row)
+    return total
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render(rows):
+    """
+    Prometheus text exposition of aggregated rows
+    """
+    duration, errors, queries = [], [], []
+    for (endpoint, action), row in sorted(rows.items()):
+        labels = f'endpoint="{_label(endpoint)}",action="{_label(action)}"'
+        count = 0
+        for le, n in zip(BUCKETS + ('+Inf',), row[:len(BUCKETS) + 1]):
+            count += n
+            duration.append(f'cimp_request_duration_seconds_bucket{{{labels},le="{le}"}} {count}')
+        duration.append(f'cimp_request_duration_seconds_sum{{{labels}}} {row[_SUM]}')
+        duration.append(f'cimp_request_duration_seconds_count{{{labels}}} {count}')
+        errors.append(f'cimp_request_errors_total{{{labels}}} {row[_ERRORS]}')
+        queries.append(f'cimp_db_queries_total{{{labels}}} {row[_QUERIES]}')
+
+    lines = ['# HELP cimp_request_duration_seconds Latency of API requests',
+             '# TYPE cimp_request_duration_seconds histogram', *duration,
+             '# HELP cimp_request_errors_total API requests answered with ret != 0 or an HTTP error',
+             '# TYPE cimp_request_errors_total counter', *errors,
+             '# HELP cimp_db_queries_total Database queries made by API requests',
+             '# TYPE cimp_db_queries_total counter', *queries]
+    return '\n'.join(lines) + '\n'
+
+
+def _reset():
+    # A forked worker starts with counters and a file of its own
+    _local.__dict__.clear()
+    _tables.clear()
+    _state[:] = [time.monotonic(), None]
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        self.prefix = getattr(settings, 'METRICS_PREFIX', '/api/')
+        self.enabled = getattr(settings, 'METRICS', True)
+
+    def observe(self, request, response, record, seconds):
+        match = request.resolver_match
+        if match is None:
+            # Unknown paths, not worth a label each
+            return
+        ret = getattr(response, 'ret', None)
+        error = response.status_code >= 400 or ret not in (None, 0)
+        # Unknown actions share the empty label, so clients cannot add series
+        observe('/' + match.route, record['action'] or '', seconds, error, record['queries'])
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled or not request.path.startswith(self.prefix):
+            return self.get_response(request)
+        token, record = timing.begin()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            timing.end(token)
+        self.observe(request, response, record, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled or not request.path.startswith(self.prefix):
+            return await self.get_response(request)
+        token, record = timing.begin()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            timing.end(token)
+        self.observe(request, response, record, time.perf_counter() - start)
+        return response
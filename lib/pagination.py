@@ -0,0 +1,189 @@
+import base64
+import json
+from django.core.paginator import Paginator, EmptyPage
+from django.utils.functional import cached_property
+
+# Keyset (cursor) pagination helpers.
+# Unlike Paginator's LIMIT/OFFSET, a page is located with "id < last id of the
+# previous page", which is a primary key range seek. Page 1000 costs the same
+# as page 1, and no COUNT(*) is needed.
+
+
+def encode_cursor(**kwargs):
+    """
+    Pack cursor fields into an opaque, url-safe string
+    """
+    raw = json.dumps(kwargs, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Reverse of encode_cursor. Raises ValueError on a malformed cursor
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise ValueError(f'Invalid cursor {cursor!r}')
+    if not isinstance(data, dict):
+        raise ValueError(f'Invalid cursor {cursor!r}')
+    return data
+
+
+def _keysetquery(qs, pagesize, after_id, before_id):
+    if before_id is not None:
+        # Walk backwards in ascending order, then flip to keep '-id' order
+        return qs.filter(id__gt=before_id).order_by('id')[:pagesize + 1]
+    if after_id is not None:
+        qs = qs.filter(id__lt=after_id)
+    return qs.order_by('-id')[:pagesize + 1]
+
+
+def _keysetresult(rows, pagesize, after_id, before_id):
+    hasmore = len(rows) > pagesize
+    rows = rows[:pagesize]
+    if before_id is not None:
+        rows.reverse()
+        hasnext = True
+        hasprev = hasmore
+    else:
+        hasnext = hasmore
+        hasprev = after_id is not None
+
+    nextcursor = encode_cursor(after_id=rows[-1]['id']) if rows and hasnext else None
+    prevcursor = encode_cursor(before_id=rows[0]['id']) if rows and hasprev else None
+
+    return {'items': rows, 'next': nextcursor, 'prev': prevcursor}
+
+
+def keysetpage(qs, pagesize, after_id=None, before_id=None):
+    """
+    Return one page of `qs` (a values() queryset) in '-id' order.
+
+    after_id:  rows that come after this id in list order (older, id < after_id)
+    before_id: rows that come before this id in list order (newer, id > before_id)
+    Neither:   the first page
+
+    The result carries opaque 'next'/'prev' cursors, or None when there is
+    nothing more in that direction.
+    """
+    rows = list(_keysetquery(qs, pagesize, after_id, before_id))
+    return _keysetresult(rows, pagesize, after_id, before_id)
+
+
+async def akeysetpage(qs, pagesize, after_id=None, before_id=None):
+    """
+    keysetpage for async views, with the async ORM
+    """
+    rows = [one async for one in _keysetquery(qs, pagesize, after_id, before_id)]
+    return _keysetresult(rows, pagesize, after_id, before_id)
+
+
+def pageparams(pd):
+    """
+    Read paging parameters from request data.
+
+    Returns (pagenum, after_id, before_id).
+    pagenum is None in cursor mode, which is used when the client sends
+    'cursor', 'after_id' or 'before_id', or leaves out 'pagenum' altogether.
+    An opaque 'cursor' takes precedence over explicit after_id/before_id.
+    Raises ValueError on malformed values, and when both after_id and
+    before_id are given: a page is walked from one end only.
+    """
+    cursor = pd.get('cursor')
+    if cursor:
+        data = decode_cursor(cursor)
+        after_id, before_id = data.get('after_id'), data.get('before_id')
+    else:
+        after_id, before_id = pd.get('after_id'), pd.get('before_id')
+
+    after_id = int(after_id) if after_id not in (None, '') else None
+    before_id = int(before_id) if before_id not in (None, '') else None
+    if after_id is not None and before_id is not None:
+        raise ValueError('after_id and before_id')
+
+    pagenum = pd.get('pagenum')
+    if cursor or after_id is not None or before_id is not None or pagenum in (None, ''):
+        return None, after_id, before_id
+
+    return int(pagenum), None, None
+
+
+# Cap of the bounded count used for withtotal='approx'
+APPROX_TOTAL_CAP = 1000
+
+
+class CountedPaginator(Paginator):
+    """
+    Paginator that takes its total from the caller instead of COUNT(*).
+
+    total:
+      int      a known count, e.g. a maintained RowCounter total
+      None     COUNT(*) as usual
+      'approx' COUNT over at most APPROX_TOTAL_CAP rows
+      False    no count at all; pages are not range checked and count is None
+    """
+    def __init__(self, object_list, per_page, total=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.total = total
+
+    @cached_property
+    def count(self):
+        if self.total is None:
+            return Paginator.count.func(self)
+        if self.total is False:
+            return None
+        if self.total == 'approx':
+            return self.object_list[:APPROX_TOTAL_CAP].count()
+        return self.total
+
+    def page(self, number):
+        if self.total is not False:
+            return super().page(number)
+        number = int(number)
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        bottom = (number - 1) * self.per_page
+        return self._get_page(self.object_list[bottom:bottom + self.per_page], number, self)
+
+
+def totalparam(pd):
+    """
+    'withtotal' request parameter: True (default), False, or 'approx'
+    """
+    value = pd.get('withtotal', True)
+    if isinstance(value, str):
+        value = value.lower()
+        if value == 'approx':
+            return 'approx'
+        return value not in ('false', '0', 'no', '')
+    return bool(value)
+
+
+async def acountedpage(qs, pagenum, pagesize, total=None):
+    """
+    (rows, count) of page pagenum of an ordered queryset, with the async ORM.
+    total has the meaning of CountedPaginator's, and out of range pages raise
+    EmptyPage as Paginator.page does
+    """
+    pagenum = int(pagenum)
+    if pagenum < 1:
+        raise EmptyPage('That page number is less than 1')
+
+    if total is None:
+        count = await qs.acount()
+    elif total is False:
+        count = None
+    elif total == 'approx':
+        count = await qs[:APPROX_TOTAL_CAP].acount()
+    else:
+        count = total
+
+    # Page 1 of an empty list is an empty page, not an error
+    if count is not None and pagenum > 1 and (pagenum - 1) * pagesize >= count:
+        raise EmptyPage('That page contains no results')
+
+    bottom = (pagenum - 1) * pagesize
+    rows = [one async for one in qs[bottom:bottom + pagesize]]
+    return rows, count
@@ -0,0 +1,232 @@
+import functools
+import hashlib
+import inspect
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+from lib import dbrouter
+
+# Versioned read cache for model read methods (getone, first list pages).
+#
+# Every cached table has a version number kept in the cache itself, and the
+# version is part of every entry key. Write methods call touch() and the
+# version is bumped when their transaction commits, so entries written under
+# the old version are simply never looked up again and expire on their own.
+#
+# With several worker processes CACHES must point to a shared backend
+# (Redis/Memcached): a per-process LocMemCache only invalidates its own worker,
+# whose neighbours would serve stale entries and 304s. With such a backend the
+# read cache and the validators of lib.httpcache are off (enabled()), unless
+# READCACHE_LOCAL says the site runs as a single process.
+
+# name of cached method -> {'hit': n, 'miss': n}, per process
+_stats = {}
+
+
+def _cache():
+    return caches[getattr(settings, 'READCACHE_ALIAS', 'default')]
+
+
+def enabled():
+    """
+    Whether table versions and cached reads may be used: a cache shared by
+    the workers, or any cache with READCACHE_LOCAL
+    """
+    if getattr(settings, 'READCACHE_LOCAL', False):
+        return True
+    return not isinstance(_cache(), (LocMemCache, DummyCache))
+
+
+def _table(one):
+    return one if isinstance(one, str) else one._meta.db_table
+
+
+def _versionkey(table):
+    return f'cimp:ver:{table}'
+
+
+def _changedkey(table):
+    return f'cimp:changed:{table}'
+
+
+def version(table):
+    """
+    Current version of a table.
+    A missing version (first use, or evicted) starts from the clock rather than
+    from 1, so it can never come back to a number that older entries used.
+    """
+    cache = _cache()
+    table = _table(table)
+    value = cache.get(_versionkey(table))
+    if value is None:
+        cache.add(_versionkey(table), time.time_ns(), None)
+        value = cache.get(_versionkey(table))
+    return value
+
+
+def changed(table):
+    """
+    Unix time of the last change of a table, as far as this cache knows
+    """
+    cache = _cache()
+    table = _table(table)
+    value = cache.get(_changedkey(table))
+    if value is None:
+        cache.add(_changedkey(table), time.time(), None)
+        value = cache.get(_changedkey(table))
+    return value
+
+
+async def aversion(table):
+    """
+    version() for async code
+    """
+    cache = _cache()
+    table = _table(table)
+    value = await cache.aget(_versionkey(table))
+    if value is None:
+        await cache.aadd(_versionkey(table), time.time_ns(), None)
+        value = await cache.aget(_versionkey(table))
+    return value
+
+
+async def achanged(table):
+    """
+    changed() for async code
+    """
+    cache = _cache()
+    table = _table(table)
+    value = await cache.aget(_changedkey(table))
+    if value is None:
+        await cache.aadd(_changedkey(table), time.time(), None)
+        value = await cache.aget(_changedkey(table))
+    return value
+
+
+def bump(*tables):
+    cache = _cache()
+    now = time.time()
+    for table in tables:
+        table = _table(table)
+        key = _versionkey(table)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+        cache.set(_changedkey(table), now, None)
+
+
+def touch(*tables):
+    """
+    Invalidate cached reads of these tables (models or db_table names) once the
+    current transaction commits. Bumping earlier would let a concurrent reader
+    cache pre-commit rows under the new version.
+    """
+    transaction.on_commit(functools.partial(bump, *tables))
+
+
+def settled(table):
+    """
+    Whether what is read from `table` now may be cached under its current
+    version. A replica may not have the last change yet, so its reads are
+    only cached once that change is DATABASE_REPLICA_LAG seconds old
+    """
+    if not dbrouter.onreplica():
+        return True
+    return time.time() - changed(table) >= getattr(settings, 'DATABASE_REPLICA_LAG', 1)
+
+
+async def asettled(table):
+    if not dbrouter.onreplica():
+        return True
+    return time.time() - await achanged(table) >= getattr(settings, 'DATABASE_REPLICA_LAG', 1)
+
+
+def firstpages(pagenum=None, after_id=None, before_id=None, **kwargs):
+    """
+    Cache predicate for list methods: only the first READCACHE_PAGES pages,
+    by page number or the first page of cursor mode
+    """
+    if after_id is not None or before_id is not None:
+        return False
+    return (pagenum or 1) <= getattr(settings, 'READCACHE_PAGES', 3)
+
+
+def cached(table, cacheable=None):
+    """
+    Cache a successful ({'ret': 0}) result of a static model method, keyed by
+    its arguments and the current version of `table`.
+    cacheable(**arguments) can turn caching off for some calls.
+    Works on async methods too, with the async cache API
+    """
+    def decorator(func):
+        name = f'{func.__module__}.{func.__qualname__}'
+        signature = inspect.signature(func)
+        counters = _stats.setdefault(name, {'hit': 0, 'miss': 0})
+
+        def digest(args, kwargs):
+            # Digest of the call's arguments, None when the call is not cacheable
+            if not enabled():
+                return None
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = bound.arguments
+            if cacheable is not None and not cacheable(**arguments):
+                return None
+            return hashlib.md5(repr(sorted(arguments.items())).encode('utf-8')).hexdigest()
+
+        def keyof(ver, hexdigest):
+            return f'cimp:rc:{table}:{ver}:{name}:{hexdigest}'
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def awrapper(*args, **kwargs):
+                hexdigest = digest(args, kwargs)
+                if hexdigest is None:
+                    return await func(*args, **kwargs)
+                key = keyof(await aversion(table), hexdigest)
+                ret = await _cache().aget(key)
+                if ret is not None:
+                    counters['hit'] += 1
+                    return ret
+                ret = await func(*args, **kwargs)
+                counters['miss'] += 1
+                if ret.get('ret') == 0 and await asettled(table):
+                    await _cache().aset(key, ret, getattr(settings, 'READCACHE_TIMEOUT', 300))
+                return ret
+            return awrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            hexdigest = digest(args, kwargs)
+            if hexdigest is None:
+                return func(*args, **kwargs)
+            key = keyof(version(table), hexdigest)
+            ret = _cache().get(key)
+            if ret is not None:
+                counters['hit'] += 1
+                return ret
+            ret = func(*args, **kwargs)
+            counters['miss'] += 1
+            if ret.get('ret') == 0 and settled(table):
+                _cache().set(key, ret, getattr(settings, 'READCACHE_TIMEOUT', 300))
+            return ret
+
+        return wrapper
+    return decorator
+
+
+def stats():
+    """
+    Hit/miss counters of this process, with the hit ratio of each method
+    """
+    ret = {}
+    for name, counters in _stats.items():
+        total = counters['hit'] + counters['miss']
+        ret[name] = dict(counters, ratio=round(counters['hit'] / total, 4) if total else None)
+    return ret
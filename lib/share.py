@@ -1,8 +1,41 @@
-from django.http import JsonResponse
+import html
+import time
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.utils.html import strip_tags
+
+from lib import jsonenc, timing
 
 # 运用可变参数
 # 当 ensure_ascii 参数设置为 False 时，生成的 JSON 字符串将保留非 ASCII 字符，
 # 而不会进行转义。这在需要包含非 ASCII 字符的情况下是非常有用的，
 # 比如需要保留特殊字符、表情符号等
+# The body is encoded by lib.jsonenc (orjson when installed), which always
+# keeps non-ASCII characters; json_dumps_params is accepted and ignored
 def JR(data, **karg):
-    return JsonResponse(data, json_dumps_params={'ensure_ascii':False}, safe=False, **karg)
\ No newline at end of file
+    karg.pop('json_dumps_params', None)
+    record = timing.current()
+    start = time.perf_counter()
+    body = jsonenc.dumps(data)
+    if record is not None:
+        record['serialize'] += time.perf_counter() - start
+    response = HttpResponse(body, content_type='application/json', **karg)
+    # Keep the business return code for middleware and decorators
+    response.ret = data.get('ret') if isinstance(data, dict) else None
+    return response
+
+# request.user for async views (Django 4.2 has no request.auser).
+# Resolving the lazy user reads the session and the user row, so that runs in
+# a thread once; afterwards request.user is a plain object
+async def auser(request):
+    await sync_to_async(lambda: request.user.is_authenticated)()
+    return request.user
+
+# Length of the stored plain text excerpt of rich text content
+EXCERPT_LEN = 200
+
+# Rich text (HTML) -> (excerpt, plain text length)
+# List views return the excerpt instead of the full content
+def makeexcerpt(content, length=EXCERPT_LEN):
+    text = ' '.join(html.unescape(strip_tags(content or '')).split())
+    return text[:length], len(text)
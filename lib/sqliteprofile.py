@@ -0,0 +1,26 @@
+from django.conf import settings
+
+# Connection settings for running CIMP on SQLite with concurrent writers,
+# applied to every new SQLite connection (connection_created receiver).
+#
+#   journal_mode=WAL      readers no longer block the writer or each other
+#   busy_timeout          a writer waits for the lock instead of failing with
+#                         "database is locked"
+#   synchronous=NORMAL    in WAL mode, fsync at checkpoints only. A power loss
+#                         can lose the last commits but not corrupt the file
+#   mmap_size             reads through a memory map instead of read() calls
+#
+# Writers also need TRANSACTION_MODE 'IMMEDIATE' in the database settings
+# (lib/dbpool/sqlite3), so that atomic blocks queue on busy_timeout.
+
+
+def apply(sender, connection, **kwargs):
+    profile = getattr(settings, 'SQLITE_PROFILE', None)
+    if not profile or connection.vendor != 'sqlite':
+        return
+    # A pooled connection handed out again already has them
+    if getattr(connection, 'reused', False) or connection.is_in_memory_db():
+        return
+    with connection.cursor() as cursor:
+        for name, value in profile.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
@@ -0,0 +1,138 @@
+import contextvars
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+
+# Per-request performance breakdown of /api/ calls.
+#
+# While a request is recorded, a dict in a context variable collects its
+# numbers: queries and SQL time (from an execute wrapper installed on every
+# database connection), body parse time (lib/dispatch.py), action time
+# (lib.dispatch.Handler) and JSON encoding time (lib.share.JR), plus the
+# handler class and action that served it. The context variable follows the
+# request into sync_to_async threads, so async views are covered too.
+#
+# ServerTimingMiddleware sends them as a Server-Timing header, which browser
+# devtools show in the request's Timing tab. It is on for every request with
+# SERVER_TIMING = True, otherwise for staff users who ask for it with an
+# 'X-Server-Timing: 1' header or a 'cimp_timing=1' cookie.
+
+FLAG_HEADER = 'HTTP_X_SERVER_TIMING'
+FLAG_COOKIE = 'cimp_timing'
+
+_record = contextvars.ContextVar('cimp_timing', default=None)
+
+
+def begin():
+    """
+    Start recording the current request: (token for end, record). A request
+    already recorded (lib/metrics.py records them all) keeps its record
+    """
+    record = _record.get()
+    if record is not None:
+        return None, record
+    record = {'view': None, 'action': None, 'queries': 0, 'sql': 0.0, 'parse': 0.0, 'run': 0.0, 'serialize': 0.0}
+    return _record.set(record), record
+
+
+def end(token):
+    if token is not None:
+        _record.reset(token)
+
+
+def current():
+    """
+    Record of the current request, None when it is not recorded
+    """
+    return _record.get()
+
+
+def querytimer(execute, sql, params, many, context):
+    record = _record.get()
+    if record is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record['queries'] += 1
+        record['sql'] += time.perf_counter() - start
+
+
+def install(sender, connection, **kwargs):
+    """
+    connection_created receiver adding querytimer to the connection's
+    execute wrappers. The wrapper list outlives the database connection, so
+    it is only added once
+    """
+    if querytimer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(querytimer)
+
+
+def header(record, total):
+    """
+    Server-Timing value of a record, every metric described with the
+    handler class and action
+    """
+    tag = f"{record['view']}.{record['action']}" if record['view'] else 'unrouted'
+    return ', '.join((
+        f'total;dur={total * 1000:.2f};desc="{tag}"',
+        f"parse;dur={record['parse'] * 1000:.2f};desc=\"{tag} parse\"",
+        f"db;dur={record['sql'] * 1000:.2f};desc=\"{tag} {record['queries']} queries\"",
+        f"handler;dur={record['run'] * 1000:.2f};desc=\"{tag} handler\"",
+        f"serialize;dur={record['serialize'] * 1000:.2f};desc=\"{tag} serialize\"",
+    ))
+
+
+class ServerTimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        self.prefix = getattr(settings, 'SERVER_TIMING_PREFIX', '/api/')
+        self.always = getattr(settings, 'SERVER_TIMING', False)
+
+    def wanted(self, request):
+        if not request.path.startswith(self.prefix):
+            return False
+        return self.always or request.META.get(FLAG_HEADER) == '1' or request.COOKIES.get(FLAG_COOKIE) == '1'
+
+    def annotate(self, response, record, total):
+        response['Server-Timing'] = header(record, total)
+        if record['view']:
+            response['X-Handler'] = f"{record['view']}.{record['action']}"
+        response['X-DB-Queries'] = str(record['queries'])
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.wanted(request):
+            return self.get_response(request)
+        token, record = begin()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            end(token)
+        if self.always or request.user.is_staff:
+            self.annotate(response, record, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        if not self.wanted(request):
+            return await self.get_response(request)
+        token, record = begin()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            end(token)
+        total = time.perf_counter() - start
+        if self.always or await sync_to_async(lambda: request.user.is_staff)():
+            self.annotate(response, record, total)
+        return response
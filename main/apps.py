@@ -1,6 +1,20 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
 
 
 class MainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main'
+
+    def ready(self):
+        from lib import fulltext, sqliteprofile, timing
+        from .models import RowCounter
+        # Full-text shadow tables / indexes are not Django models, create them after migrate
+        post_migrate.connect(fulltext.setup, sender=self)
+        # Seed row counters for tables that have none yet
+        post_migrate.connect(RowCounter.setup, sender=self)
+        # WAL, busy timeout, ... on every new SQLite connection
+        connection_created.connect(sqliteprofile.apply)
+        # Query count and SQL time of recorded requests, see lib/timing.py
+        connection_created.connect(timing.install)
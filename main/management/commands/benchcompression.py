@@ -0,0 +1,57 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from lib.compression import CODINGS, compress
+from lib.share import JR
+from main.models import Notice
+
+
+class Command(BaseCommand):
+    help = 'Compression size vs CPU time of a list page payload at each gzip/deflate level'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pagesize', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--levels', default='1,3,6,9')
+        parser.add_argument('--synthetic', action='store_true',
+                            help='Use generated rich text rows instead of the notices in the database')
+
+    def payload(self, pagesize, synthetic):
+        if not synthetic:
+            ret = Notice.listbypage(1, pagesize, '', False)
+            if ret['ret'] == 0 and ret['items']:
+                return JR(ret).content
+
+        # Rows of varied rich text, repeated verbatim text would compress unrealistically well
+        rnd = random.Random(0)
+        words = ('graduate design committee schedule review students report deadline supervisor '
+                 'slot campus library notice seminar paper thesis defense topic approval 毕业设计 中期 检查').split()
+
+        def richtext():
+            return ''.join('<p>' + ' '.join(rnd.choice(words) for _ in range(rnd.randint(30, 80))) + '.</p>'
+                           for _ in range(rnd.randint(5, 15)))
+
+        items = [{'id': n, 'pubdate': '2025-11-01T08:00:00Z', 'author': 1, 'author_realname': 'Admin',
+                  'title': f'Notice {n}', 'content': richtext(), 'status': 1}
+                 for n in range(pagesize)]
+        return JR({'ret': 0, 'items': items, 'total': pagesize, 'next': None, 'prev': None}).content
+
+    def handle(self, *args, **options):
+        data = self.payload(options['pagesize'], options['synthetic'])
+        repeat = options['repeat']
+        self.stdout.write(f'payload: {len(data)} bytes, {repeat} runs per level')
+        self.stdout.write(f"{'coding':<8} {'level':>5} {'bytes':>10} {'ratio':>7} {'ms':>8} {'MB/s':>8}")
+
+        for coding in CODINGS:
+            for level in [int(one) for one in options['levels'].split(',')]:
+                times = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    body = compress(data, coding, level)
+                    times.append(time.perf_counter() - start)
+                median = statistics.median(times)
+                self.stdout.write(f'{coding:<8} {level:>5} {len(body):>10} {len(body) / len(data):>7.3f} '
+                                  f'{median * 1000:>8.2f} {len(data) / median / 1e6:>8.1f}')
@@ -0,0 +1,181 @@
+import asyncio
+import io
+import json
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from django.urls import path
+
+from lib.share import makeexcerpt
+from main import views
+from main.models import User, Paper, RowCounter
+
+# URLconf of one run, /api/paper served by handle (threads) or ahandle (async)
+urlpatterns = []
+
+
+class SlowInput(io.RawIOBase):
+    # wsgi.input of a client that takes `delay` seconds to send its body
+    def __init__(self, body, delay):
+        self.body = body
+        self.delay = delay
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        if self.delay:
+            time.sleep(self.delay)
+            self.delay = 0
+        data, self.body = (self.body, b'') if size is None or size < 0 else (self.body[:size], self.body[size:])
+        return data
+
+
+def ok(success, content):
+    return success and json.loads(content).get('ret') == 0
+
+
+class Command(BaseCommand):
+    help = ('Requests per second and latency of /api/paper listbypage with many slow clients: '
+            'sync handlers on a thread pool (WSGI) vs async handlers on one event loop (ASGI)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=500)
+        parser.add_argument('--delay', type=float, default=0.5,
+                            help='Seconds each client takes to send its request body')
+        parser.add_argument('--threads', type=int, default=40,
+                            help='Worker threads of the WSGI run, like a gthread worker')
+        parser.add_argument('--pagesize', type=int, default=20)
+        parser.add_argument('--pagenum', type=int, default=4,
+                            help='Pages past READCACHE_PAGES are read from the database')
+        parser.add_argument('--rows', type=int, default=1000, help='Papers in the benchmark database')
+
+    def seed(self, rows):
+        author = User.objects.create(username='bench', usertype=2000, realname='Bench')
+        content = '<p>' + 'paper text ' * 100 + '</p>'
+        excerpt, plaintext_len = makeexcerpt(content)
+        Paper.objects.bulk_create(
+            Paper(author=author, author_realname='Bench', title=f'Paper {n}', content=content,
+                  excerpt=excerpt, plaintext_len=plaintext_len, status=1)
+            for n in range(rows))
+        RowCounter.recount(Paper)
+
+    def body(self, options):
+        return json.dumps({'action': 'listbypage', 'pagenum': options['pagenum'],
+                           'pagesize': options['pagesize'], 'withoutcontent': True}).encode('utf-8')
+
+    def route(self, view):
+        global urlpatterns
+        urlpatterns = [path('api/paper', view)]
+
+    def peakthreads(self, done):
+        peak = [threading.active_count()]
+
+        def sample():
+            while not done.is_set():
+                peak[0] = max(peak[0], threading.active_count())
+                time.sleep(0.01)
+        threading.Thread(target=sample, daemon=True).start()
+        return peak
+
+    def runthreads(self, options):
+        self.route(views.PaperHandler().handle)
+        handler = WSGIHandler()
+        body = self.body(options)
+
+        def one(_):
+            environ = {
+                'REQUEST_METHOD': 'POST', 'PATH_INFO': '/api/paper', 'SCRIPT_NAME': '', 'QUERY_STRING': '',
+                'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(body)),
+                'wsgi.input': SlowInput(body, options['delay']), 'wsgi.errors': sys.stderr,
+                'wsgi.url_scheme': 'http', 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+                'wsgi.run_once': False, 'wsgi.version': (1, 0),
+            }
+            status = []
+            response = handler(environ, lambda code, headers, exc_info=None: status.append(code))
+            content = b''.join(response)
+            response.close()
+            return ok(status[0].startswith('200'), content), time.perf_counter() - start
+
+        # Every client connects at once, queueing for a thread counts in its latency
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+            return list(pool.map(one, range(options['clients'])))
+
+    def runasync(self, options):
+        self.route(views.PaperHandler().ahandle)
+        handler = ASGIHandler()
+        body = self.body(options)
+
+        async def one():
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST',
+                'scheme': 'http', 'path': '/api/paper', 'raw_path': b'/api/paper', 'root_path': '',
+                'query_string': b'', 'server': ('testserver', 80), 'client': ('127.0.0.1', 0),
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+            }
+            received = []
+            status = []
+            content = []
+
+            async def receive():
+                if received:
+                    # Nothing more from this client until the response is sent
+                    await asyncio.Event().wait()
+                received.append(True)
+                await asyncio.sleep(options['delay'])
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+                else:
+                    content.append(message.get('body', b''))
+
+            start = time.perf_counter()
+            await handler(scope, receive, send)
+            return ok(status[0] == 200, b''.join(content)), time.perf_counter() - start
+
+        async def run():
+            return await asyncio.gather(*(one() for _ in range(options['clients'])))
+
+        return asyncio.run(run())
+
+    def handle(self, *args, **options):
+        # A throwaway database (in memory for SQLite), left as it was afterwards
+        name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.seed(options['rows'])
+            self.bench(options)
+        finally:
+            connection.creation.destroy_test_db(name, verbosity=0)
+
+    def bench(self, options):
+        self.stdout.write(f"{options['clients']} clients, {options['delay']}s to send each request, "
+                          f"{options['threads']} threads for the sync run")
+        self.stdout.write(f"{'mode':<8} {'seconds':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'threads':>8} {'errors':>7}")
+
+        for mode, run in (('threads', self.runthreads), ('async', self.runasync)):
+            done = threading.Event()
+            with override_settings(ROOT_URLCONF=__name__):
+                peak = self.peakthreads(done)
+                start = time.perf_counter()
+                results = run(options)
+                elapsed = time.perf_counter() - start
+                done.set()
+
+            latencies = sorted(one[1] for one in results)
+            errors = sum(1 for one in results if not one[0])
+            p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+            self.stdout.write(f'{mode:<8} {elapsed:>8.2f} {len(results) / elapsed:>8.1f} '
+                              f'{statistics.median(latencies) * 1000:>8.0f} {p95 * 1000:>8.0f} '
+                              f'{peak[0]:>8} {errors:>7}')
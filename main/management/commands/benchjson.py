@@ -0,0 +1,63 @@
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+
+from lib import jsonenc
+from main.models import Paper
+
+
+def django(data):
+    # What JR did before lib/jsonenc.py: JsonResponse with DjangoJSONEncoder
+    return json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False).encode('utf-8')
+
+
+class Command(BaseCommand):
+    help = 'Serialization time of list pages (values() rows with datetimes) per JSON backend of lib.share.JR'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pagesize', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def page(self, pagesize):
+        # A paper list page as Paper.listbypage returns it, without content
+        rnd = random.Random(0)
+        words = 'graduate design thesis review defense topic supervisor report 毕业设计 中期 检查'.split()
+        start = datetime(2025, 9, 1, tzinfo=timezone.utc)
+        items = [{'id': n, 'pubdate': start + timedelta(seconds=rnd.randint(0, 10**7), microseconds=rnd.randint(0, 999999)),
+                  'author': rnd.randint(1, 500), 'author_realname': f'Student {n % 500}',
+                  'title': ' '.join(rnd.choice(words) for _ in range(6)),
+                  'excerpt': ' '.join(rnd.choice(words) for _ in range(40)),
+                  'plaintext_len': rnd.randint(500, 20000), 'thumbupcount': rnd.randint(0, 300), 'status': 1}
+                 for n in range(pagesize)]
+        assert set(items[0]) == set(Paper.LIST_FIELDS)
+        return {'ret': 0, 'items': items, 'total': pagesize, 'next': None, 'prev': None}
+
+    def handle(self, *args, **options):
+        data = self.page(options['pagesize'])
+        encoders = [('django', django), ('stdlib', jsonenc.stdlib)]
+        if 'orjson' in jsonenc.BACKENDS:
+            encoders.append(('orjson', jsonenc.BACKENDS['orjson']))
+
+        expected = json.loads(django(data))
+        self.stdout.write(f"{options['pagesize']} rows per page, {options['repeat']} runs, "
+                          f"JSON_BACKEND resolves to {jsonenc.backend().__name__}")
+        self.stdout.write(f"{'encoder':<8} {'bytes':>9} {'ms':>8} {'rows/s':>10} {'speedup':>8}")
+        base = None
+        for name, encode in encoders:
+            body = encode(data)
+            if json.loads(body) != expected:
+                self.stderr.write(f'{name}: output differs from DjangoJSONEncoder')
+            times = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                encode(data)
+                times.append(time.perf_counter() - start)
+            median = statistics.median(times)
+            base = base or median
+            self.stdout.write(f"{name:<8} {len(body):>9} {median * 1000:>8.2f} "
+                              f"{options['pagesize'] / median:>10.0f} {base / median:>7.1f}x")
@@ -0,0 +1,136 @@
+import json
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.test.utils import override_settings
+
+from lib import dbpool
+from main.models import User
+
+# Requests each worker process cycles through, all of them writes
+WORKLOAD = ('paper_addone', 'paper_modifyone', 'wf_create_topic')
+
+
+def request(kind, n, paper_ids):
+    if kind == 'paper_addone':
+        return '/api/paper', {'action': 'addone', 'data': {'title': f'Bench {n}', 'content': '<p>bench paper</p>'}}
+    if kind == 'paper_modifyone' and paper_ids:
+        return '/api/paper', {'action': 'modifyone', 'id': paper_ids[n % len(paper_ids)],
+                              'newdata': {'title': f'Bench {n} v2'}}
+    return '/api/wf_graduatedesign', {
+        'action': 'stepaction', 'key': 'create_topic', 'wf_id': -1,
+        'submitdata': [{'name': 'Graduate Design Title', 'value': f'Topic {n}'},
+                       {'name': 'Topic Description', 'value': 'A topic description for the benchmark'}],
+    }
+
+
+def worker(args):
+    """
+    One process: POST writes for `seconds`, returns (latencies, errors, locked)
+    """
+    session, seconds = args
+    client = Client()
+    client.cookies[settings.SESSION_COOKIE_NAME] = session
+    latencies = []
+    errors = locked = 0
+    paper_ids = []
+    n = 0
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        kind = WORKLOAD[n % len(WORKLOAD)]
+        url, data = request(kind, n, paper_ids)
+        start = time.perf_counter()
+        try:
+            ret = client.post(url, json.dumps(data), content_type='application/json').json()
+        except Exception as e:
+            ret = {'ret': 2, 'msg': repr(e)}
+        latencies.append(time.perf_counter() - start)
+        if ret.get('ret') != 0:
+            errors += 1
+            if 'locked' in str(ret.get('msg', '')):
+                locked += 1
+        elif kind == 'paper_addone':
+            paper_ids.append(ret['id'])
+        n += 1
+    connections.close_all()
+    return latencies, errors, locked
+
+
+class Command(BaseCommand):
+    help = ('Write throughput and latency of concurrent /api/paper and /api/wf_graduatedesign writers on a '
+            'fresh SQLite file: Django defaults vs the SQLITE_PROFILE / immediate transaction profile')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=8)
+        parser.add_argument('--seconds', type=float, default=10)
+        parser.add_argument('--profile', choices=('both', 'default', 'tuned'), default='both')
+
+    def database(self, path, tuned):
+        # Point 'default' at a new file, with or without the profile
+        connections.close_all()
+        dbpool.reset()
+        db = connections.settings['default']
+        db['NAME'] = path
+        db['TRANSACTION_MODE'] = 'IMMEDIATE' if tuned else None
+
+    def seed(self, processes):
+        call_command('migrate', run_syncdb=True, verbosity=0)
+        sessions = []
+        for n in range(processes):
+            user = User.objects.create(username=f'bench{n}', usertype=2000, realname=f'Bench {n}')
+            client = Client()
+            client.force_login(user)
+            sessions.append(client.cookies[settings.SESSION_COOKIE_NAME].value)
+        return sessions
+
+    def run(self, tuned, options, tmp):
+        path = os.path.join(tmp, f"bench-{'tuned' if tuned else 'default'}.sqlite3")
+        with override_settings(SQLITE_PROFILE=settings.SQLITE_PROFILE if tuned else None):
+            self.database(path, tuned)
+            sessions = self.seed(options['processes'])
+            # The children must not inherit open connections
+            connections.close_all()
+            dbpool.reset()
+            start = time.perf_counter()
+            with multiprocessing.get_context('fork').Pool(options['processes']) as pool:
+                results = pool.map(worker, [(one, options['seconds']) for one in sessions])
+            elapsed = time.perf_counter() - start
+        return results, elapsed
+
+    def handle(self, *args, **options):
+        if connections['default'].vendor != 'sqlite':
+            raise CommandError('The default database is not SQLite')
+        modes = {'both': (False, True), 'default': (False,), 'tuned': (True,)}[options['profile']]
+
+        original = dict(connections.settings['default'])
+        self.stdout.write(f"{options['processes']} processes writing for {options['seconds']}s each")
+        self.stdout.write(f"{'profile':<8} {'requests':>8} {'req/s':>8} {'errors':>7} {'locked':>7} "
+                          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                for tuned in modes:
+                    results, elapsed = self.run(tuned, options, tmp)
+                    latencies = sorted(one for result in results for one in result[0])
+                    errors = sum(result[1] for result in results)
+                    locked = sum(result[2] for result in results)
+
+                    def pct(p):
+                        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+                    self.stdout.write(f"{'tuned' if tuned else 'default':<8} {len(latencies):>8} "
+                                      f"{len(latencies) / elapsed:>8.1f} {errors:>7} {locked:>7} "
+                                      f"{statistics.median(latencies) * 1000:>8.1f} {pct(0.95):>8.1f} "
+                                      f"{pct(0.99):>8.1f} {latencies[-1] * 1000:>8.1f}")
+                    connections.close_all()
+                    dbpool.reset()
+        finally:
+            connections.settings['default'].clear()
+            connections.settings['default'].update(original)
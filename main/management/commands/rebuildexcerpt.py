@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from lib.share import makeexcerpt
+from main.models import Notice, News, Paper
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored excerpt/plaintext_len of notices, news and papers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        for model in (Notice, News, Paper):
+            done = 0
+            last_id = 0
+            while True:
+                # Walk by id so each chunk is a primary key range read
+                rows = list(model.objects.filter(id__gt=last_id).order_by('id').only('id', 'content')[:chunk_size])
+                if not rows:
+                    break
+                for one in rows:
+                    one.excerpt, one.plaintext_len = makeexcerpt(one.content)
+                with transaction.atomic():
+                    model.objects.bulk_update(rows, ['excerpt', 'plaintext_len'])
+                done += len(rows)
+                last_id = rows[-1].id
+            self.stdout.write(f'{model._meta.db_table}: {done} rows')
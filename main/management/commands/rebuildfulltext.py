@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from lib import fulltext
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text index of notices, news and papers from the content tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        # Importing the models registers them with the index
+        import main.models  # noqa: F401
+
+        using = options['database']
+        with transaction.atomic(using=using):
+            fulltext.rebuild(using)
+
+        names = ', '.join(sorted(fulltext.registry))
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt full-text index for {names}'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from main.models import RowCounter
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the maintained row counters used for list totals'
+
+    def handle(self, *args, **options):
+        for table, (model, _, _) in RowCounter.COUNTED.items():
+            RowCounter.recount(model)
+            self.stdout.write(f'{table}: {RowCounter.total(model)} rows')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from main.models import Thumbup
+
+
+class Command(BaseCommand):
+    help = 'Recompute Paper.thumbupcount from the thumbup rows'
+
+    def handle(self, *args, **options):
+        updated = Thumbup.recount()
+        self.stdout.write(f'cimp_paper: {updated} rows')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from main.models import Paper
+
+
+class Command(BaseCommand):
+    help = 'Move the trending epoch to now and recompute paper trending scores (run periodically, e.g. hourly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        scored = Paper.refreshtrending(options['chunk_size'])
+        self.stdout.write(f'cimp_paper: {scored} papers with a trending score')
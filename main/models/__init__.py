@@ -1,3 +1,9 @@
+from .counter import RowCounter
+
+from .generation import Generation
+
+from .readers import ReadSketch
+
 from .user import User, Profile
 
 from .content import Notice, News
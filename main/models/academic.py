@@ -1,9 +1,23 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, OuterRef, Subquery, Count
+from django.db.models.functions import Coalesce
+from django.conf import settings
+from django.core.cache import caches
+import atexit
+import functools
+import threading
+import time
+from datetime import timedelta
 import traceback
-from django.db.models import Q
-from django.core.paginator import Paginator, EmptyPage
+from django.core.paginator import EmptyPage
 from django.utils import timezone
+from lib.pagination import keysetpage, akeysetpage, acountedpage, CountedPaginator
+from lib import fulltext, readcache
+from lib.share import makeexcerpt, EXCERPT_LEN
 from .user import User
+from .counter import RowCounter
+from .generation import Generation
+from . import moderation
 
 # Paper Management: List, Add, Delete, Ban, Publish, Withdraw papers
 class Paper(models.Model):
@@ -13,41 +27,86 @@ class Paper(models.Model):
     author_realname = models.CharField(max_length=30, db_index=True)
     title = models.CharField(max_length=1000)
     content = models.TextField()
+    # Plain text head of content and its plain text length, maintained on write
+    excerpt = models.CharField(max_length=EXCERPT_LEN, default='', blank=True)
+    plaintext_len = models.PositiveIntegerField(default=0)
     # Thumb up count
     thumbupcount = models.PositiveBigIntegerField(default=0)
+    # Trending score: sum over thumb-ups of 2 ** ((thumbup time - epoch) / half life),
+    # see Paper.trendweight. Kept in step with thumbupcount
+    hotscore = models.FloatField(default=0)
+    # Epoch hotscore is relative to, 0 for a paper never scored (hotscore 0)
+    hotepoch = models.BigIntegerField(default=0)
     # Status: 1: Published, 2: Withdrawn, 3: Banned
     status = models.PositiveIntegerField()
 
     class Meta:
         db_table = "cimp_paper"
         app_label = "main"
+        indexes = [
+            # listbypage: status=1 ORDER BY id DESC
+            models.Index(fields=['status', '-id'], name='cimp_paper_status_id'),
+            # listminebypage: author=? ORDER BY id DESC
+            models.Index(fields=['author', '-id'], name='cimp_paper_author_id'),
+            # timeline: status=1 ORDER BY pubdate DESC, id DESC
+            models.Index(fields=['status', '-pubdate', '-id'], name='cimp_paper_status_pubdate'),
+            # trending: status=1 ORDER BY hotscore DESC, id DESC
+            models.Index(fields=['status', '-hotscore', '-id'], name='cimp_paper_status_hotscore'),
+        ]
+        
+    # Columns returned by list actions
+    LIST_FIELDS = ("id", "pubdate", "author", "author_realname", "title", "excerpt", "plaintext_len", "thumbupcount", "status")
+    
+    # Columns returned by getone
+    ONE_FIELDS = ("id", "pubdate", "author", "author_realname", "title", "content", "status")
+    
+    # Columns the author may change with modifyone. Status, counters, scores
+    # and authorship are kept by the server, other keys are ignored
+    EDIT_FIELDS = ("title", "content")
+    
+    @staticmethod
+    def listfields(withoutcontent):
+        # Leave 'content' out of the SELECT, not just out of the response
+        return Paper.LIST_FIELDS if withoutcontent else Paper.LIST_FIELDS + ("content",)
+
+    @staticmethod
+    def exportquery(status, keywords, withoutcontent):
+        # Rows of a full export (lib/export.py), every status unless one is given
+        qs = Paper.objects.values(*Paper.listfields(withoutcontent))
+        if status is not None:
+            qs = qs.filter(status=status)
+        if keywords:
+            qs = fulltext.search(qs, keywords)
+        return qs
          
     @staticmethod
     def addone(data, author):
         try:
-            Paper.objects.create(
-                                pubdate = data['pubdate'],
-                                author = author,
-                                author_realname = data['author_realname'],
-                                title = data['title'],
-                                content = data['content'],
-                                status = data['status'])
-            return {'ret': 0, 'id': author.id}
+            excerpt, plaintext_len = makeexcerpt(data['content'])
+            with transaction.atomic():
+                paper = Paper.objects.create(
+                                    pubdate = data['pubdate'],
+                                    author = author,
+                                    author_realname = data['author_realname'],
+                                    title = data['title'],
+                                    content = data['content'],
+                                    excerpt = excerpt,
+                                    plaintext_len = plaintext_len,
+                                    status = data['status'])
+                RowCounter.bump(Paper, paper.status, paper.author_id, 1)
+                readcache.touch(Paper)
+                Generation.touch(Paper, [paper.id])
+                fulltext.index(Paper, paper.id, paper.content)
+            return {'ret': 0, 'id': paper.id}
         except:
-            err = traceback.format_exc
+            err = traceback.format_exc()
             return {'ret': 2, 'msg': err}
         
     @staticmethod
+    @readcache.cached('cimp_paper')
     def getone(paper_id):
         try:
-            qs = Paper.objects.values("id",
-                                        "pubdate",
-                                        "author",
-                                        "author_realname",
-                                        "title",
-                                        "content",
-                                        "status"
-            )
+            qs = Paper.objects.values(*Paper.ONE_FIELDS)
             
             qs = qs.filter(id=paper_id).first()
             
@@ -59,136 +118,158 @@ class Paper(models.Model):
             err = traceback.format_exc()
             return {'ret': 2, 'msg': err}
         
+    @staticmethod
+    @readcache.cached('cimp_paper')
+    async def agetone(paper_id):
+        # getone for async views
+        try:
+            rec = await Paper.objects.values(*Paper.ONE_FIELDS).filter(id=paper_id).afirst()
+            
+            return {'ret': 0, 'rec': rec}
+            
+        except:
+            err = traceback.format_exc()
+            return {'ret': 2, 'msg': err}
     
     @staticmethod
-    def listbypage(pagesize, pagenum, keywords, withoutcontent):
+    @readcache.cached('cimp_paper', readcache.firstpages)
+    def listbypage(pagesize, pagenum, keywords, withoutcontent, after_id=None, before_id=None, withtotal=True):
         try:
-            qs = Paper.objects.values("id",
-                                      "pubdate",
-                                      "author",
-                                      "author_realname",
-                                      "title",
-                                      "content",
-                                      "thumbupcount",
-                                      "status"
-                                      )
+            qs = Paper.objects.values(*Paper.listfields(withoutcontent))
             
             qs = qs.filter(status=1)
             
             if keywords:
-                conditions = [Q(content__contains=one) for one in keywords.split(" ") if one]
-                query = Q()
-                
-                for condition in conditions:
-                    query &= condition
-                
-                qs = qs.filter(query)
+                qs = fulltext.search(qs, keywords)
+            
+            # pagenum is None: cursor mode, seek by id instead of OFFSET
+            if pagenum is None:
+                page = keysetpage(qs, pagesize, after_id, before_id)
+                retlist = page['items']
+                return {'ret': 0, 'items': retlist, 'next': page['next'], 'prev': page['prev'], 'keywords': ""}
             
             qs = qs.order_by('-id')
-            pgnt = Paginator(qs, pagesize)
+            pgnt = CountedPaginator(qs, pagesize, RowCounter.pagetotal(withtotal, keywords, Paper, status=1))
             page = pgnt.page(pagenum)
             
             retlist = list(page)
             
-            if withoutcontent:
-                return {'ret': 0, 'items': [], 'total': pgnt.count, 'keywords': ""}
-                
             return {'ret': 0, 'items': retlist, 'total': pgnt.count, 'keywords': ""}
         except EmptyPage:
             return {'ret': 0, 'items': [], 'total': 0, 'keywords': ""}
         except:
-            err = traceback.format_exc
+            err = traceback.format_exc()
             return {'ret': 2, 'msg': err}
 
     @staticmethod
-    def listbypage_allstate(pagesize, pagenum, keywords, withoutcontent):
+    @readcache.cached('cimp_paper', readcache.firstpages)
+    async def alistbypage(pagesize, pagenum, keywords, withoutcontent, after_id=None, before_id=None, withtotal=True):
+        # listbypage for async views, with the async ORM
         try:
-            qs = Paper.objects.values("id",
-                                      "pubdate",
-                                      "author",
-                                      "author_realname",
-                                      "title",
-                                      "content",
-                                      "thumbupcount",
-                                      "status"
-                                      )
+            qs = Paper.objects.values(*Paper.listfields(withoutcontent))
+            
+            qs = qs.filter(status=1)
             
             if keywords:
-                conditions = [Q(content__contains=one) for one in keywords.split(" ") if one]
-                query = Q()
-                
-                for condition in conditions:
-                    query &= condition
-                
-                qs = qs.filter(query)
+                qs = fulltext.search(qs, keywords)
+            
+            if pagenum is None:
+                page = await akeysetpage(qs, pagesize, after_id, before_id)
+                retlist = page['items']
+                return {"ret": 0, "items": retlist, "next": page['next'], "prev": page['prev'], 'keywords': ""}
+            
+            qs = qs.order_by('-id')
+            total = await RowCounter.apagetotal(withtotal, keywords, Paper, status=1)
+            retlist, count = await acountedpage(qs, pagenum, pagesize, total)
+            
+            return {"ret": 0, "items": retlist, "total": count, 'keywords': ""}
+           
+        except EmptyPage:
+            return {'ret': 0, 'items': [], 'total': 0, 'keywords': ""}
+        
+        except:
+            err = traceback.format_exc()
+            return {'ret': 2, 'msg': err}
+        
+    @staticmethod
+    def listbypage_allstate(pagesize, pagenum, keywords, withoutcontent, after_id=None, before_id=None, withtotal=True):
+        try:
+            qs = Paper.objects.values(*Paper.listfields(withoutcontent))
+            
+            if keywords:
+                qs = fulltext.search(qs, keywords)
+            
+            # pagenum is None: cursor mode, seek by id instead of OFFSET
+            if pagenum is None:
+                page = keysetpage(qs, pagesize, after_id, before_id)
+                retlist = page['items']
+                return {'ret': 0, 'items': retlist, 'next': page['next'], 'prev': page['prev'], 'keywords': ""}
             
             qs = qs.order_by('-id')
-            pgnt = Paginator(qs, pagesize)
+            pgnt = CountedPaginator(qs, pagesize, RowCounter.pagetotal(withtotal, keywords, Paper))
             page = pgnt.page(pagenum)
             
             retlist = list(page)
             
-            if withoutcontent:
-                return {'ret': 0, 'items': [], 'total': pgnt.count, 'keywords': ""}
-                
             return {'ret': 0, 'items': retlist, 'total': pgnt.count, 'keywords': ""}
         except EmptyPage:
             return {'ret': 0, 'items': [], 'total': 0, 'keywords': ""}
         except:
-            err = traceback.format_exc
+            err = traceback.format_exc()
             return {'ret': 2, 'msg': err}    
     
     @staticmethod
-    def listminebypage(current_user, pagesize, pagenum, keywords, withoutcontent):
+    def listminebypage(current_user, pagesize, pagenum, keywords, withoutcontent, after_id=None, before_id=None, withtotal=True):
         try:
-            qs = Paper.objects.values("id",
-                                      "pubdate",
-                                      "author",
-                                      "author_realname",
-                                      "title",
-                                      "content",
-                                      "thumbupcount",
-                                      "status"
-                                      )
+            qs = Paper.objects.values(*Paper.listfields(withoutcontent))
             qs = qs.filter(author=current_user)
             if keywords:
-                conditions = [Q(content__contains=one) for one in keywords.split(" ") if one]
-                query = Q()
-                
-                for condition in conditions:
-                    query &= condition
-                
-                qs = qs.filter(query)
+                qs = fulltext.search(qs, keywords)
+            
+            # pagenum is None: cursor mode, seek by id instead of OFFSET
+            if pagenum is None:
+                page = keysetpage(qs, pagesize, after_id, before_id)
+                retlist = page['items']
+                return {'ret': 0, 'items': retlist, 'next': page['next'], 'prev': page['prev'], 'keywords': ""}
             
             qs = qs.order_by('-id')
-            pgnt = Paginator(qs, pagesize)
+            pgnt = CountedPaginator(qs, pagesize, RowCounter.pagetotal(withtotal, keywords, Paper, author=current_user.id))
             page = pgnt.page(pagenum)
             
             retlist = list(page)
             
-            if withoutcontent:
-                return {'ret': 0, 'items': [], 'total': pgnt.count, 'keywords': ""}
-                
             return {'ret': 0, 'items': retlist, 'total': pgnt.count, 'keywords': ""}
         except EmptyPage:
             return {'ret': 0, 'items': [], 'total': 0, 'keywords': ""}
         except:
-            err = traceback.format_exc
+            err = traceback.format_exc()
             return {'ret': 2, 'msg': err}       
     
     
     @staticmethod
     def modifyone(paper_id, newdata, current_user):
         try:
-            paper = Paper.objects.get(id=paper_id)
-            
-            if paper.author != current_user:
-                return {'ret': 2, 'msg': 'Only the author can modify the paper'}
-            
-            for field, value in newdata:
-                setattr(paper, field, value)
-            
-            paper.save()
+            with transaction.atomic():
+                paper = Paper.objects.get(id=paper_id)
+                
+                if paper.author != current_user:
+                    return {'ret': 2, 'msg': 'Only the author can modify the paper'}
+                old = (paper.status, paper.author_id)
+                
+                for field, value in newdata.items():
+                    if field in Paper.EDIT_FIELDS:
+                        setattr(paper, field, value)
+                
+                if 'content' in newdata:
+                    paper.excerpt, paper.plaintext_len = makeexcerpt(paper.content)
+                
+                paper.save()
+                RowCounter.move(Paper, old, (paper.status, paper.author_id))
+                readcache.touch(Paper)
+                Generation.touch(Paper, [paper.id])
+                
+                if 'content' in newdata:
+                    fulltext.index(Paper, paper.id, paper.content)
             
             return {'ret': 0}
     
@@ -201,14 +282,19 @@ class Paper(models.Model):
     @staticmethod
     def holdone(paper_id, current_user):
         try:
-            paper = Paper.objects.get(id=paper_id)
-            
-            if paper.author != current_user:
-                return {'ret': 2, 'msg': 'Only the author can withdraw the paper'}
-            
-            paper.status = 2
-            
-            paper.save()
+            with transaction.atomic():
+                paper = Paper.objects.get(id=paper_id)
+                old = paper.status
+                
+                if paper.author != current_user:
+                    return {'ret': 2, 'msg': 'Only the author can withdraw the paper'}
+                
+                paper.status = 2
+                
+                paper.save()
+                RowCounter.move(Paper, (old, paper.author_id), (paper.status, paper.author_id))
+                readcache.touch(Paper)
+                Generation.touch(Paper, [paper.id])
             
             return {'ret': 0, 'status': 2}
     
@@ -221,11 +307,16 @@ class Paper(models.Model):
     @staticmethod
     def banone(paper_id):
         try:
-            paper = Paper.objects.get(id=paper_id)
-            
-            paper.status = 3
-            
-            paper.save()
+            with transaction.atomic():
+                paper = Paper.objects.get(id=paper_id)
+                old = paper.status
+                
+                paper.status = 3
+                
+                paper.save()
+                RowCounter.move(Paper, (old, paper.author_id), (paper.status, paper.author_id))
+                readcache.touch(Paper)
+                Generation.touch(Paper, [paper.id])
             
             return {'ret': 0, 'status': 3}
     
@@ -238,14 +329,19 @@ class Paper(models.Model):
     @staticmethod
     def publishone(paper_id, current_user):
         try:
-            paper = Paper.objects.get(id=paper_id)
-            
-            if paper.author != current_user and current_user.is_staff == False:
-                return {'ret': 2, 'msg': 'Only Admin and Author can publish the paper'}
-            
-            paper.status = 1
-            
-            paper.save()
+            with transaction.atomic():
+                paper = Paper.objects.get(id=paper_id)
+                old = paper.status
+                
+                if paper.author != current_user and current_user.is_staff == False:
+                    return {'ret': 2, 'msg': 'Only Admin and Author can publish the paper'}
+                
+                paper.status = 1
+                
+                paper.save()
+                RowCounter.move(Paper, (old, paper.author_id), (paper.status, paper.author_id))
+                readcache.touch(Paper)
+                Generation.touch(Paper, [paper.id])
             
             return {'ret': 0, 'status': 1}
     
@@ -258,12 +354,17 @@ class Paper(models.Model):
     @staticmethod
     def deleteone(paper_id, current_user):
         try:
-            paper = Paper.objects.get(id=paper_id)
-            
-            if paper.author != current_user and current_user.is_staff == False:
-                return {'ret': 2, 'msg': 'Only Admin and Author can delete the paper'}
-            
-            paper.delete()
+            with transaction.atomic():
+                paper = Paper.objects.get(id=paper_id)
+                
+                if paper.author != current_user and current_user.is_staff == False:
+                    return {'ret': 2, 'msg': 'Only Admin and Author can delete the paper'}
+                
+                fulltext.unindex(Paper, [paper.id])
+                RowCounter.bump(Paper, paper.status, paper.author_id, -1)
+                readcache.touch(Paper)
+                Generation.touch(Paper, [paper.id])
+                paper.delete()
             
             return {'ret': 0}
     
@@ -273,37 +374,360 @@ class Paper(models.Model):
             err = traceback.format_exc()
             return {'ret': 2, 'msg': err}
         
+    # Trending papers.
+    #
+    # A thumb-up at time t adds 2 ** ((t - epoch) / TRENDING_HALF_LIFE) to
+    # hotscore and cancelling it takes the same weight off again. All scores
+    # decay at the same rate, so ordering by the stored sums is ordering by the
+    # decayed scores, and a toggle is one F() addition. The refreshtrending
+    # command moves the epoch forward (keeping the numbers small) and
+    # recomputes every score from the thumbup rows.
+    #
+    # Toggles read the epoch without a lock. Each paper row records the epoch
+    # of its hotscore (hotepoch), and a weight is only added to a row on the
+    # same epoch (addweight). A toggle or flush that finds the row on another
+    # epoch, since a refresh ran meanwhile, recomputes that one paper from its
+    # thumbup rows instead (rescore). Only refreshtrending locks the
+    # 'trending' generation row, so that two refreshes do not interleave.
+    
+    @staticmethod
+    def trendepoch():
+        """
+        Unix time the stored scores are relative to, set on first use
+        """
+        epoch = Generation.current('trending')
+        if not epoch:
+            Generation.objects.get_or_create(name='trending', defaults={'value': int(time.time())})
+            epoch = Generation.current('trending')
+        return epoch
+    
+    @staticmethod
+    def trendweight(when, epoch):
+        halflife = getattr(settings, 'TRENDING_HALF_LIFE', 3 * 86400)
+        return 2.0 ** ((when.timestamp() - epoch) / halflife)
+    
+    @staticmethod
+    def trendsince(now):
+        # Thumb-ups older than TRENDING_HORIZON half lives add under 2 ** -horizon
+        halflife = getattr(settings, 'TRENDING_HALF_LIFE', 3 * 86400)
+        return now - timedelta(seconds=halflife * getattr(settings, 'TRENDING_HORIZON', 20))
+    
+    @staticmethod
+    def addweight(paper_id, weight, epoch, delta=0):
+        """
+        Add a weight computed on epoch to the paper's score, and delta to its
+        thumbupcount. A paper whose score is on another epoch is rescored
+        """
+        added = Paper.objects.filter(id=paper_id, hotepoch__in=(0, epoch)).update(
+            thumbupcount=F('thumbupcount') + delta, hotscore=F('hotscore') + weight, hotepoch=epoch)
+        if added:
+            return
+        if delta:
+            Paper.objects.filter(id=paper_id).update(thumbupcount=F('thumbupcount') + delta)
+        Paper.rescore(paper_id)
+    
+    @staticmethod
+    def rescore(paper_id):
+        """
+        Recompute one paper's score from its thumbup rows, on the current epoch
+        """
+        epoch = Paper.trendepoch()
+        now = timezone.now()
+        created = Thumbup.objects.filter(paper_id=paper_id, created__gte=Paper.trendsince(now)).values_list('created', flat=True)
+        score = sum(Paper.trendweight(one, epoch) for one in created)
+        Paper.objects.filter(id=paper_id).update(hotscore=score, hotepoch=epoch if score else 0)
+    
+    @staticmethod
+    def trending(pagesize):
+        """
+        Top pagesize published papers by trending score, read in index order
+        """
+        try:
+            epoch = Paper.trendepoch()
+            # Stored sums are relative to the epoch, scores as of now are sums / scale
+            scale = Paper.trendweight(timezone.now(), epoch)
+            # Above float rounding left behind by cancelled thumb-ups
+            qs = Paper.objects.filter(status=1, hotscore__gt=1e-9 * scale).order_by('-hotscore', '-id')
+            retlist = list(qs.values(*Paper.LIST_FIELDS, 'hotscore')[:pagesize])
+            for one in retlist:
+                one['hotscore'] = round(one['hotscore'] / scale, 4)
+            return {'ret': 0, 'items': retlist}
+        except:
+            err = traceback.format_exc()
+            return {'ret': 2, 'msg': err}
+    
+    @staticmethod
+    def refreshtrending(chunk_size=1000):
+        """
+        Move the epoch to now and recompute every score from the thumbup rows.
+        Thumb-ups older than TRENDING_HORIZON half lives are left out, so this
+        reads only the recent rows. Papers toggled while it ran, and any left
+        on an older epoch, are then reconciled one by one
+        """
+        with transaction.atomic():
+            Paper.trendepoch()
+            previous = Generation.objects.select_for_update().filter(name='trending').values_list('value', flat=True).first()
+            now = timezone.now()
+            # A new value even within the second, addweight tells the scales apart by it
+            epoch = max(int(now.timestamp()), previous + 1)
+            scores = {}
+            recent = Thumbup.objects.filter(created__gte=Paper.trendsince(now))
+            for paper_id, created in recent.values_list('paper_id', 'created').iterator(chunk_size=chunk_size):
+                scores[paper_id] = scores.get(paper_id, 0.0) + Paper.trendweight(created, epoch)
+            
+            Generation.objects.filter(name='trending').update(value=epoch)
+            Paper.objects.exclude(hotscore=0, hotepoch=0).exclude(id__in=list(scores)).update(hotscore=0, hotepoch=0)
+            ids = sorted(scores)
+            for start in range(0, len(ids), chunk_size):
+                rows = [Paper(id=one, hotscore=scores[one], hotepoch=epoch) for one in ids[start:start + chunk_size]]
+                Paper.objects.bulk_update(rows, ['hotscore', 'hotepoch'])
+            readcache.touch(Paper)
+        
+        stale = set(Paper.objects.exclude(hotepoch__in=(0, epoch)).values_list('id', flat=True))
+        stale.update(Thumbup.objects.filter(created__gte=now).values_list('paper_id', flat=True))
+        for one in sorted(stale):
+            with transaction.atomic():
+                Paper.rescore(one)
+        if stale:
+            readcache.touch(Paper)
+        return len(scores)
+    
+    # Moderation of many ids in one call, see moderation.py.
+    # Permissions are checked per id, as in the *one methods
+    @staticmethod
+    def holdmany(ids, current_user):
+        def check(row):
+            if row['author'] != current_user.id:
+                return 'Only the author can withdraw the paper'
+        return moderation.setstatus(Paper, ids, 2, check)
+    
+    @staticmethod
+    def banmany(ids):
+        return moderation.setstatus(Paper, ids, 3)
+    
+    @staticmethod
+    def publishmany(ids, current_user):
+        def check(row):
+            if row['author'] != current_user.id and not current_user.is_staff:
+                return 'Only Admin and Author can publish the paper'
+        return moderation.setstatus(Paper, ids, 1, check)
+    
+    @staticmethod
+    def deletemany(ids, current_user):
+        def check(row):
+            if row['author'] != current_user.id and not current_user.is_staff:
+                return 'Only Admin and Author can delete the paper'
+        return moderation.delete(Paper, ids, check)
+
 
+fulltext.register(Paper)
+RowCounter.register(Paper)
 
+
+# A row is one user's thumb-up of one paper, cancelling deletes it.
+# Paper.thumbupcount is derived from these rows (see the recountthumbups command)
 class Thumbup(models.Model):
     paper_id = models.ForeignKey(Paper, on_delete=models.CASCADE, related_name = 'thumbup')
     thumbuper = models.ForeignKey(User, on_delete=models.CASCADE, related_name = 'thumbuper')
-    thumbup = models.BooleanField(default=False)
+    # When the thumb-up was given, its trending weight depends on it
+    created = models.DateTimeField(default=timezone.now, db_index=True)
 
     class Meta:
         db_table = "cimp_thumbup"
         app_label = "main"
+        constraints = [
+            models.UniqueConstraint(fields=['paper_id', 'thumbuper'], name='cimp_thumbup_paper_user'),
+        ]
+    
+    # Write-behind mode (THUMBUP_WRITE_BEHIND): paper id -> count delta and
+    # (paper id, epoch) -> hotscore delta not yet written, shared by the threads
+    # of this worker
+    PENDING = {}
+    PENDING_SCORE = {}
+    PENDING_LOCK = threading.Lock()
+    # [toggles buffered, monotonic time of the last flush]
+    PENDING_STATE = [0, time.monotonic()]
+    
+    # A toggle changes the liked flags of one user and the count of one paper.
+    # It bumps that user's version of cimp_thumbup (the paper list ETags name
+    # LIKED_TABLE) and the generations showing the paper, but not the version
+    # of cimp_paper, which would drop every cached paper page and ETag on each
+    # click. Counts in cached pages catch up at the next write to cimp_paper
+    # or write-behind flush, or when the entries expire (READCACHE_TIMEOUT)
+    LIKED_TABLE = 'cimp_thumbup:{user}'
            
     @staticmethod
     def thumbuporcancel(paper_id, current_user):
+        """
+        Thumb up the paper, or cancel the thumb-up when there already is one.
+        The thumbup row is inserted or deleted and the count moved with F()
+        in one transaction, so concurrent toggles never lose an update
+        """
         try:
-            thumbup = Thumbup.objects.get(id=paper_id, thumbuper=current_user)
-            paper = Paper.objects.get(id=paper_id)
-            if thumbup.thumbup == True:
-                thumbup.thumbup = False
-                paper.thumbupcount -= 1
-            else:
-                thumbup.thumbup = True
-                paper.thumbupcount += 1               
-            
-            thumbup.save()
-            paper.save()
+            if not Paper.objects.filter(id=paper_id).exists():
+                return {'ret': 1, 'msg': f'Paper with id {paper_id} does not exist'}
+            
+            writebehind = getattr(settings, 'THUMBUP_WRITE_BEHIND', False)
+            epoch = Paper.trendepoch()
+            with transaction.atomic():
+                existing = Thumbup.objects.filter(paper_id=paper_id, thumbuper=current_user).values_list('id', 'created').first()
+                deleted = existing and Thumbup.objects.filter(id=existing[0]).delete()[0]
+                if deleted:
+                    thumbup, delta = False, -1
+                    weight = -Paper.trendweight(existing[1], epoch)
+                else:
+                    try:
+                        with transaction.atomic():
+                            one = Thumbup.objects.create(paper_id_id=paper_id, thumbuper=current_user)
+                        thumbup, delta = True, 1
+                        weight = Paper.trendweight(one.created, epoch)
+                    except IntegrityError:
+                        # The same user's concurrent request got there first
+                        thumbup, delta, weight = True, 0, 0
+                
+                if delta and not writebehind:
+                    Paper.addweight(paper_id, weight, epoch, delta)
+                    # Only what shows this paper (the homepage snapshot), not
+                    # every cached page of cimp_paper: see LIKED_TABLE
+                    Generation.touch(Paper, [int(paper_id)])
+                if delta:
+                    # This user's liked flags of list pages
+                    readcache.touch(Thumbup.likedtable(current_user.id))
+                    transaction.on_commit(functools.partial(Thumbup.forgetliked, current_user.id))
+            
+            if delta and writebehind:
+                transaction.on_commit(functools.partial(Thumbup.buffer, int(paper_id), delta, weight, epoch))
+            
+            thumbupcount = Paper.objects.filter(id=paper_id).values_list('thumbupcount', flat=True).first() or 0
+            if writebehind:
+                with Thumbup.PENDING_LOCK:
+                    thumbupcount += Thumbup.PENDING.get(int(paper_id), 0)
         
-            return {"ret": 0, "thumbupcount": paper.thumbupcount}
-        except Paper.DoesNotExist:
-            return {'ret': 1, 'msg': f'Paper with id {paper_id} does not exist'}
+            return {"ret": 0, "thumbup": thumbup, "thumbupcount": thumbupcount}
         except:
             err = traceback.format_exc()
             return {'ret': 2, 'msg': err}
+    
+    @staticmethod
+    def likedtable(user_id):
+        # Read cache version of one user's thumb-ups, see LIKED_TABLE
+        return Thumbup.LIKED_TABLE.format(user=user_id)
+    
+    @staticmethod
+    def _likedcache():
+        return caches[getattr(settings, 'READCACHE_ALIAS', 'default')]
+    
+    @staticmethod
+    def _likedkey(user_id):
+        return f'cimp:liked:{user_id}'
+    
+    @staticmethod
+    def forgetliked(user_id):
+        Thumbup._likedcache().delete(Thumbup._likedkey(user_id))
+    
+    @staticmethod
+    def likedset(user, paper_ids):
+        """
+        The paper_ids this user has thumbed up: one IN lookup, or with
+        THUMBUP_LIKED_CACHE a cached set of all the user's thumbed up papers
+        """
+        if not paper_ids or not user.is_authenticated:
+            return set()
+        if not getattr(settings, 'THUMBUP_LIKED_CACHE', False) or not readcache.enabled():
+            return set(Thumbup.objects.filter(thumbuper=user, paper_id__in=paper_ids).values_list('paper_id', flat=True))
+        
+        cache = Thumbup._likedcache()
+        key = Thumbup._likedkey(user.id)
+        liked = cache.get(key)
+        if liked is None:
+            liked = set(Thumbup.objects.filter(thumbuper=user).values_list('paper_id', flat=True))
+            cache.set(key, liked, getattr(settings, 'READCACHE_TIMEOUT', 300))
+        return liked.intersection(paper_ids)
+    
+    @staticmethod
+    def markliked(ret, user):
+        """
+        Add a 'liked' flag to every row of a list result
+        """
+        if ret.get('ret') != 0 or not ret.get('items'):
+            return ret
+        liked = Thumbup.likedset(user, [one['id'] for one in ret['items']])
+        return dict(ret, items=[dict(one, liked=one['id'] in liked) for one in ret['items']])
+    
+    @staticmethod
+    def buffer(paper_id, delta, weight=0, epoch=0):
+        """
+        Add count and score deltas to the write-behind buffer, and flush it once
+        it holds THUMBUP_FLUSH_SIZE toggles or THUMBUP_FLUSH_INTERVAL seconds passed.
+        weight is on the scale of epoch
+        """
+        with Thumbup.PENDING_LOCK:
+            Thumbup.PENDING[paper_id] = Thumbup.PENDING.get(paper_id, 0) + delta
+            key = (paper_id, epoch)
+            Thumbup.PENDING_SCORE[key] = Thumbup.PENDING_SCORE.get(key, 0) + weight
+            Thumbup.PENDING_STATE[0] += 1
+            due = (Thumbup.PENDING_STATE[0] >= getattr(settings, 'THUMBUP_FLUSH_SIZE', 100)
+                   or time.monotonic() - Thumbup.PENDING_STATE[1] >= getattr(settings, 'THUMBUP_FLUSH_INTERVAL', 5))
+        if due:
+            Thumbup.flush()
+    
+    @staticmethod
+    def flush():
+        """
+        Write the buffered deltas, one UPDATE per paper in one transaction.
+        Papers are updated in id order so concurrent flushes lock rows in the
+        same order. Score deltas go through Paper.addweight with the epoch
+        they were computed on
+        """
+        with Thumbup.PENDING_LOCK:
+            pending = {one: delta for one, delta in Thumbup.PENDING.items() if delta}
+            buffered = {key: weight for key, weight in Thumbup.PENDING_SCORE.items() if weight}
+            Thumbup.PENDING.clear()
+            Thumbup.PENDING_SCORE.clear()
+            Thumbup.PENDING_STATE[:] = [0, time.monotonic()]
+        if not pending and not buffered:
+            return 0
         
+        try:
+            with transaction.atomic():
+                epochs = {}
+                for one, epoch in sorted(buffered):
+                    epochs.setdefault(one, []).append(epoch)
+                for one in sorted(set(pending) | set(epochs)):
+                    delta = pending.get(one, 0)
+                    if one not in epochs:
+                        Paper.objects.filter(id=one).update(thumbupcount=F('thumbupcount') + delta)
+                    for epoch in epochs.get(one, ()):
+                        # The count delta goes with the first epoch
+                        Paper.addweight(one, buffered[(one, epoch)], epoch, delta)
+                        delta = 0
+                readcache.touch(Paper)
+                Generation.touch(Paper, sorted(set(pending) | set(epochs)))
+        except:
+            # Put the deltas back for the next flush
+            with Thumbup.PENDING_LOCK:
+                for one, delta in pending.items():
+                    Thumbup.PENDING[one] = Thumbup.PENDING.get(one, 0) + delta
+                for key, weight in buffered.items():
+                    Thumbup.PENDING_SCORE[key] = Thumbup.PENDING_SCORE.get(key, 0) + weight
+            raise
+        return len(set(pending) | {key[0] for key in buffered})
+    
+    @staticmethod
+    def recount(paper_ids=None):
+        """
+        Set thumbupcount from the thumbup rows, e.g. after a worker died with
+        buffered deltas
+        """
+        counts = Thumbup.objects.filter(paper_id=OuterRef('id')).order_by().values('paper_id').annotate(n=Count('id')).values('n')
+        qs = Paper.objects.all()
+        if paper_ids is not None:
+            qs = qs.filter(id__in=paper_ids)
+        with transaction.atomic():
+            updated = qs.update(thumbupcount=Coalesce(Subquery(counts), 0))
+            readcache.touch(Paper)
+        return updated
+
 
+# Buffered thumb-up deltas are written when the worker exits
+atexit.register(Thumbup.flush)
@@ -1,9 +1,15 @@
-from django.db import models
+from django.db import models, transaction
 import traceback
-from django.db.models import Q
-from django.core.paginator import Paginator, EmptyPage
+from django.core.paginator import EmptyPage
 from django.utils import timezone
+from lib.pagination import keysetpage, akeysetpage, acountedpage, CountedPaginator
+from lib import fulltext, readcache
+from lib.share import makeexcerpt, EXCERPT_LEN
 from .user import User
+from .counter import RowCounter
+from .generation import Generation
+from .readers import ReadSketch
+from . import moderation
 
 # Notice Management: List, Add, Delete, Ban, Publish notices
 class Notice(models.Model):
@@ -24,24 +30,66 @@ class Notice(models.Model):
     # Content. If 'withoutcontent' is true in request, this field is omitted
     content = models.TextField()
     
+    # Plain text head of content and its full plain text length, maintained on write.
+    # List views return these instead of content when 'withoutcontent' is true
+    excerpt = models.CharField(max_length=EXCERPT_LEN, default='', blank=True)
+    plaintext_len = models.PositiveIntegerField(default=0)
+    
     # Status: 1: Published, 2: Withdrawn, 3: Banned
     status = models.PositiveIntegerField() 
     
     class Meta:
         db_table = "cimp_notice"
         app_label = "main"
+        indexes = [
+            # listbypage: status=1 ORDER BY id DESC
+            models.Index(fields=['status', '-id'], name='cimp_notice_status_id'),
+            # listminebypage: author=? ORDER BY id DESC
+            models.Index(fields=['author', '-id'], name='cimp_notice_author_id'),
+            # timeline: status=1 ORDER BY pubdate DESC, id DESC
+            models.Index(fields=['status', '-pubdate', '-id'], name='cimp_notice_status_pubdate'),
+        ]
+        
+    # Columns returned by list actions
+    LIST_FIELDS = ("id", "pubdate", "author", "author_realname", "title", "excerpt", "plaintext_len", "status")
+    
+    # Columns returned by getone
+    ONE_FIELDS = ("id", "pubdate", "author", "author_realname", "title", "content", "status")
+    
+    @staticmethod
+    def listfields(withoutcontent):
+        # Leave 'content' out of the SELECT, not just out of the response
+        return Notice.LIST_FIELDS if withoutcontent else Notice.LIST_FIELDS + ("content",)
+
+    @staticmethod
+    def exportquery(status, keywords, withoutcontent):
+        # Rows of a full export (lib/export.py), every status unless one is given
+        qs = Notice.objects.values(*Notice.listfields(withoutcontent))
+        if status is not None:
+            qs = qs.filter(status=status)
+        if keywords:
+            qs = fulltext.search(qs, keywords)
+        return qs
         
     @staticmethod
     def addone(data, author):
         try:
-            notice = Notice.objects.create(
-                pubdate = data['pubdate'],
-                author = author,
-                author_realname = data['author_realname'],
-                title = data["title"],
-                content = data["content"],
-                status = data['status']
-            )
+            with transaction.atomic():
+                excerpt, plaintext_len = makeexcerpt(data["content"])
+                notice = Notice.objects.create(
+                    pubdate = data['pubdate'],
+                    author = author,
+                    author_realname = data['author_realname'],
+                    title = data["title"],
+                    content = data["content"],
+                    excerpt = excerpt,
+                    plaintext_len = plaintext_len,
+                    status = data['status']
+                )
+                RowCounter.bump(Notice, notice.status, notice.author_id, 1)
+                readcache.touch(Notice)
+                Generation.touch(Notice, [notice.id])
+                fulltext.index(Notice, notice.id, notice.content)
             
             return {'ret': 0, 'id': notice.id}
         except:
@@ -49,40 +97,33 @@ class Notice(models.Model):
             return {'ret': 2, 'msg': err}
             
     @staticmethod
-    def listbypage(pagenum, pagesize, keywords, withoutcontent):
+    @readcache.cached('cimp_notice', readcache.firstpages)
+    def listbypage(pagenum, pagesize, keywords, withoutcontent, after_id=None, before_id=None, withtotal=True):
         try:
-            qs = Notice.objects.values("id",
-                                        "pubdate",
-                                        "author",
-                                        "author_realname",
-                                        "title",
-                                        "content",
-                                        "status"
-            )
+            qs = Notice.objects.values(*Notice.listfields(withoutcontent))
             
             # Filter for published status (1)
             qs = qs.filter(status=1)
             
             if keywords:
-                conditions = [Q(content__contains=one) for one in keywords.split(' ') if one]
-                query = Q()
-                for condition in conditions:
-                    query &= condition
-                qs = qs.filter(query)
+                qs = fulltext.search(qs, keywords)
+            
+            # pagenum is None: cursor mode, seek by id instead of OFFSET
+            if pagenum is None:
+                page = keysetpage(qs, pagesize, after_id, before_id)
+                retlist = page['items']
+                return {"ret": 0, "items": retlist, "next": page['next'], "prev": page['prev'], 'keywords': keywords}
             
             # Order by ID descending
             qs = qs.order_by('-id')
 
-            pgnt = Paginator(qs, pagesize)
+            pgnt = CountedPaginator(qs, pagesize, RowCounter.pagetotal(withtotal, keywords, Notice, status=1))
             
             page = pgnt.page(pagenum)
             
             retlist = list(page)
             
-            if withoutcontent:
-                return {"ret": 0, "items": [], "total": pgnt.count, 'keywords': keywords}
-            else:
-                return {"ret": 0, "items": retlist, "total": pgnt.count, 'keywords': keywords}
+            return {"ret": 0, "items": retlist, "total": pgnt.count, 'keywords': keywords}
            
         except EmptyPage:
             return {'ret': 0, 'items': [], 'total': 0, 'keywords': ""}
@@ -92,35 +133,57 @@ class Notice(models.Model):
             return {'ret': 2, 'msg': err} 
         
     @staticmethod
-    def listbypage_allstate(pagenum, pagesize, keywords, withoutcontent):
+    @readcache.cached('cimp_notice', readcache.firstpages)
+    async def alistbypage(pagenum, pagesize, keywords, withoutcontent, after_id=None, before_id=None, withtotal=True):
+        # listbypage for async views, with the async ORM
         try:
-            qs = Notice.objects.values("id",
-                                        "pubdate",
-                                        "author",
-                                        "author_realname",
-                                        "title",
-                                        "content",
-                                        "status"
-            )
+            qs = Notice.objects.values(*Notice.listfields(withoutcontent))
+            
+            qs = qs.filter(status=1)
             
             if keywords:
-                conditions = [Q(content__contains=one) for one in keywords.split(' ') if one]
-                query = Q()
-                for condition in conditions:
-                    query &= condition
-                qs = qs.filter(query)
+                qs = fulltext.search(qs, keywords)
+            
+            if pagenum is None:
+                page = await akeysetpage(qs, pagesize, after_id, before_id)
+                retlist = page['items']
+                return {"ret": 0, "items": retlist, "next": page['next'], "prev": page['prev'], 'keywords': keywords}
+            
+            qs = qs.order_by('-id')
+            total = await RowCounter.apagetotal(withtotal, keywords, Notice, status=1)
+            retlist, count = await acountedpage(qs, pagenum, pagesize, total)
+            
+            return {"ret": 0, "items": retlist, "total": count, 'keywords': keywords}
+           
+        except EmptyPage:
+            return {'ret': 0, 'items': [], 'total': 0, 'keywords': ""}
+        
+        except:
+            err = traceback.format_exc()
+            return {'ret': 2, 'msg': err}
+        
+    @staticmethod
+    def listbypage_allstate(pagenum, pagesize, keywords, withoutcontent, after_id=None, before_id=None, withtotal=True):
+        try:
+            qs = Notice.objects.values(*Notice.listfields(withoutcontent))
+            
+            if keywords:
+                qs = fulltext.search(qs, keywords)
                 
+            # pagenum is None: cursor mode, seek by id instead of OFFSET
+            if pagenum is None:
+                page = keysetpage(qs, pagesize, after_id, before_id)
+                retlist = page['items']
+                return {"ret": 0, "items": retlist, "next": page['next'], "prev": page['prev'], 'keywords': keywords}
+            
             qs = qs.order_by('-id')
-            pgnt = Paginator(qs, pagesize)
+            pgnt = CountedPaginator(qs, pagesize, RowCounter.pagetotal(withtotal, keywords, Notice))
             
             page = pgnt.page(pagenum)
             
             retlist = list(page)
             
-            if withoutcontent:
-                return {"ret": 0, "items": [], "total": pgnt.count, 'keywords': keywords}
-            else:
-                return {"ret": 0, "items": retlist, "total": pgnt.count, 'keywords': keywords}
+            return {"ret": 0, "items": retlist, "total": pgnt.count, 'keywords': keywords}
            
         except EmptyPage:
             return {'ret': 0, 'items': [], 'total': 0, 'keywords': ""}
@@ -130,16 +193,10 @@ class Notice(models.Model):
             return {'ret': 2, 'msg': err} 
         
     @staticmethod
+    @readcache.cached('cimp_notice')
     def getone(notice_id):
         try:
-            qs = Notice.objects.values("id",
-                                        "pubdate",
-                                        "author",
-                                        "author_realname",
-                                        "title",
-                                        "content",
-                                        "status"
-            )
+            qs = Notice.objects.values(*Notice.ONE_FIELDS)
             
             qs = qs.filter(id=notice_id).first()
             
@@ -152,14 +209,38 @@ class Notice(models.Model):
             return {'ret': 2, 'msg': err}
         
     @staticmethod
-    def modifyone(notice_id, new_data):
+    @readcache.cached('cimp_notice')
+    async def agetone(notice_id):
+        # getone for async views
         try:
-            notice = Notice.objects.get(id=notice_id)
+            rec = await Notice.objects.values(*Notice.ONE_FIELDS).filter(id=notice_id).afirst()
+            
+            return {'ret': 0, 'rec': rec}
             
-            for field, value in new_data.items():
-                setattr(notice, field, value)
+        except:
+            err = traceback.format_exc()
+            return {'ret': 2, 'msg': err}
+        
+    @staticmethod
+    def modifyone(notice_id, new_data):
+        try:
+            with transaction.atomic():
+                notice = Notice.objects.get(id=notice_id)
+                old = (notice.status, notice.author_id)
                 
-            notice.save()
+                for field, value in new_data.items():
+                    setattr(notice, field, value)
+                
+                if 'content' in new_data:
+                    notice.excerpt, notice.plaintext_len = makeexcerpt(notice.content)
+                    
+                notice.save()
+                RowCounter.move(Notice, old, (notice.status, notice.author_id))
+                readcache.touch(Notice)
+                Generation.touch(Notice, [notice.id])
+                
+                if 'content' in new_data:
+                    fulltext.index(Notice, notice.id, notice.content)
             
             return {'ret': 0}
             
@@ -172,11 +253,16 @@ class Notice(models.Model):
     @staticmethod
     def banone(notice_id):
         try:
-            notice = Notice.objects.get(id=notice_id)
-            
-            notice.status = 3
+            with transaction.atomic():
+                notice = Notice.objects.get(id=notice_id)
+                old = notice.status
                 
-            notice.save()
+                notice.status = 3
+                    
+                notice.save()
+                RowCounter.move(Notice, (old, notice.author_id), (notice.status, notice.author_id))
+                readcache.touch(Notice)
+                Generation.touch(Notice, [notice.id])
             
             return {'ret': 0, 'status': 3}
             
@@ -189,12 +275,17 @@ class Notice(models.Model):
     @staticmethod
     def publishone(notice_id):
         try:
-            notice = Notice.objects.get(id=notice_id)
-            
-            if notice.status == 3:
-                notice.status = 1
+            with transaction.atomic():
+                notice = Notice.objects.get(id=notice_id)
+                old = notice.status
                 
-            notice.save()
+                if notice.status == 3:
+                    notice.status = 1
+                    
+                notice.save()
+                RowCounter.move(Notice, (old, notice.author_id), (notice.status, notice.author_id))
+                readcache.touch(Notice)
+                Generation.touch(Notice, [notice.id])
             
             return {'ret': 0, 'status': 1}
             
@@ -207,9 +298,15 @@ class Notice(models.Model):
     @staticmethod
     def deleteone(notice_id):
         try:
-            notice = Notice.objects.get(id=notice_id)
+            with transaction.atomic():
+                notice = Notice.objects.get(id=notice_id)
                 
-            notice.delete()
+                fulltext.unindex(Notice, [notice.id])
+                RowCounter.bump(Notice, notice.status, notice.author_id, -1)
+                readcache.touch(Notice)
+                Generation.touch(Notice, [notice.id])
+                ReadSketch.dropitems(Notice, [notice.id])
+                notice.delete()
             
             return {'ret': 0}
             
@@ -219,7 +316,21 @@ class Notice(models.Model):
             err = traceback.format_exc()
             return {'ret': 2, 'msg': err}
         
-               
+    # Moderation of many ids in one call, see moderation.py
+    @staticmethod
+    def banmany(ids):
+        return moderation.setstatus(Notice, ids, 3)
+    
+    @staticmethod
+    def publishmany(ids):
+        # Like publishone, only banned rows go back to published
+        return moderation.setstatus(Notice, ids, 1, fromstatus=(3,))
+    
+    @staticmethod
+    def deletemany(ids):
+        return moderation.delete(Notice, ids)
+
+
 # News Management: List, Add, Delete, Ban, Publish news
 class News(models.Model):
     id = models.BigAutoField(primary_key=True)
@@ -228,23 +339,62 @@ class News(models.Model):
     author_realname = models.CharField(max_length=30, db_index=True)
     title = models.CharField(max_length=1000)
     content = models.TextField()
+    excerpt = models.CharField(max_length=EXCERPT_LEN, default='', blank=True)
+    plaintext_len = models.PositiveIntegerField(default=0)
     status = models.PositiveIntegerField()
 
     class Meta:
         db_table = "cimp_news"
         app_label = "main"
+        indexes = [
+            # listbypage: status=1 ORDER BY id DESC
+            models.Index(fields=['status', '-id'], name='cimp_news_status_id'),
+            # listminebypage: author=? ORDER BY id DESC
+            models.Index(fields=['author', '-id'], name='cimp_news_author_id'),
+            # timeline: status=1 ORDER BY pubdate DESC, id DESC
+            models.Index(fields=['status', '-pubdate', '-id'], name='cimp_news_status_pubdate'),
+        ]
+        
+    # Columns returned by list actions
+    LIST_FIELDS = ("id", "pubdate", "author", "author_realname", "title", "excerpt", "plaintext_len", "status")
+    
+    # Columns returned by getone
+    ONE_FIELDS = ("id", "pubdate", "author", "author_realname", "title", "content", "status")
+    
+    @staticmethod
+    def listfields(withoutcontent):
+        # Leave 'content' out of the SELECT, not just out of the response
+        return News.LIST_FIELDS if withoutcontent else News.LIST_FIELDS + ("content",)
+
+    @staticmethod
+    def exportquery(status, keywords, withoutcontent):
+        # Rows of a full export (lib/export.py), every status unless one is given
+        qs = News.objects.values(*News.listfields(withoutcontent))
+        if status is not None:
+            qs = qs.filter(status=status)
+        if keywords:
+            qs = fulltext.search(qs, keywords)
+        return qs
         
     @staticmethod
     def addone(data, author):
         try:
-            notice = News.objects.create(
-                pubdate = data['pubdate'],
-                author = author,
-                author_realname = data['author_realname'],
-                title = data["title"],
-                content = data["content"],
-                status = data['status']
-            )
+            with transaction.atomic():
+                excerpt, plaintext_len = makeexcerpt(data["content"])
+                notice = News.objects.create(
+                    pubdate = data['pubdate'],
+                    author = author,
+                    author_realname = data['author_realname'],
+                    title = data["title"],
+                    content = data["content"],
+                    excerpt = excerpt,
+                    plaintext_len = plaintext_len,
+                    status = data['status']
+                )
+                RowCounter.bump(News, notice.status, notice.author_id, 1)
+                readcache.touch(News)
+                Generation.touch(News, [notice.id])
+                fulltext.index(News, notice.id, notice.content)
             
             return {'ret': 0, 'id': notice.id}
         except:
@@ -252,35 +402,28 @@ class News(models.Model):
             return {'ret': 2, 'msg': err}
             
     @staticmethod
-    def listbypage(pagenum, pagesize, keywords, withoutcontent):
+    @readcache.cached('cimp_news', readcache.firstpages)
+    def listbypage(pagenum, pagesize, keywords, withoutcontent, after_id=None, before_id=None, withtotal=True):
         try:
-            qs = News.objects.values("id",
-                                        "pubdate",
-                                        "author",
-                                        "author_realname",
-                                        "title",
-                                        "content",
-                                        "status"
-            )
+            qs = News.objects.values(*News.listfields(withoutcontent))
             
             qs = qs.filter(status=1)
             
             if keywords:
-                conditions = [Q(content__contains=one) for one in keywords.split(' ') if one]
-                query = Q()
-                for condition in conditions:
-                    query &= condition
-                qs = qs.filter(query)
+                qs = fulltext.search(qs, keywords)
+            
+            # pagenum is None: cursor mode, seek by id instead of OFFSET
+            if pagenum is None:
+                page = keysetpage(qs, pagesize, after_id, before_id)
+                retlist = page['items']
+                return {"ret": 0, "items": retlist, "next": page['next'], "prev": page['prev'], 'keywords': keywords}
             
             qs = qs.order_by('-id')
-            pgnt = Paginator(qs, pagesize)
+            pgnt = CountedPaginator(qs, pagesize, RowCounter.pagetotal(withtotal, keywords, News, status=1))
             page = pgnt.page(pagenum)
             retlist = list(page)
             
-            if withoutcontent:
-                return {"ret": 0, "items": [], "total": pgnt.count, 'keywords': keywords}
-            else:
-                return {"ret": 0, "items": retlist, "total": pgnt.count, 'keywords': keywords}
+            return {"ret": 0, "items": retlist, "total": pgnt.count, 'keywords': keywords}
            
         except EmptyPage:
             return {'ret': 0, 'items': [], 'total': 0, 'keywords': ""}
@@ -290,33 +433,55 @@ class News(models.Model):
             return {'ret': 2, 'msg': err} 
         
     @staticmethod
-    def listbypage_allstate(pagenum, pagesize, keywords, withoutcontent):
+    @readcache.cached('cimp_news', readcache.firstpages)
+    async def alistbypage(pagenum, pagesize, keywords, withoutcontent, after_id=None, before_id=None, withtotal=True):
+        # listbypage for async views, with the async ORM
         try:
-            qs = News.objects.values("id",
-                                        "pubdate",
-                                        "author",
-                                        "author_realname",
-                                        "title",
-                                        "content",
-                                        "status"
-            )
+            qs = News.objects.values(*News.listfields(withoutcontent))
+            
+            qs = qs.filter(status=1)
             
             if keywords:
-                conditions = [Q(content__contains=one) for one in keywords.split(' ') if one]
-                query = Q()
-                for condition in conditions:
-                    query &= condition
-                qs = qs.filter(query)
+                qs = fulltext.search(qs, keywords)
+            
+            if pagenum is None:
+                page = await akeysetpage(qs, pagesize, after_id, before_id)
+                retlist = page['items']
+                return {"ret": 0, "items": retlist, "next": page['next'], "prev": page['prev'], 'keywords': keywords}
             
             qs = qs.order_by('-id')
-            pgnt = Paginator(qs, pagesize)
+            total = await RowCounter.apagetotal(withtotal, keywords, News, status=1)
+            retlist, count = await acountedpage(qs, pagenum, pagesize, total)
+            
+            return {"ret": 0, "items": retlist, "total": count, 'keywords': keywords}
+           
+        except EmptyPage:
+            return {'ret': 0, 'items': [], 'total': 0, 'keywords': ""}
+        
+        except:
+            err = traceback.format_exc()
+            return {'ret': 2, 'msg': err}
+        
+    @staticmethod
+    def listbypage_allstate(pagenum, pagesize, keywords, withoutcontent, after_id=None, before_id=None, withtotal=True):
+        try:
+            qs = News.objects.values(*News.listfields(withoutcontent))
+            
+            if keywords:
+                qs = fulltext.search(qs, keywords)
+            
+            # pagenum is None: cursor mode, seek by id instead of OFFSET
+            if pagenum is None:
+                page = keysetpage(qs, pagesize, after_id, before_id)
+                retlist = page['items']
+                return {"ret": 0, "items": retlist, "next": page['next'], "prev": page['prev'], 'keywords': keywords}
+            
+            qs = qs.order_by('-id')
+            pgnt = CountedPaginator(qs, pagesize, RowCounter.pagetotal(withtotal, keywords, News))
             page = pgnt.page(pagenum)
             retlist = list(page)
             
-            if withoutcontent:
-                return {"ret": 0, "items": [], "total": pgnt.count, 'keywords': keywords}
-            else:
-                return {"ret": 0, "items": retlist, "total": pgnt.count, 'keywords': keywords}
+            return {"ret": 0, "items": retlist, "total": pgnt.count, 'keywords': keywords}
            
         except EmptyPage:
             return {'ret': 0, 'items': [], 'total': 0, 'keywords': ""}
@@ -326,16 +491,10 @@ class News(models.Model):
             return {'ret': 2, 'msg': err} 
         
     @staticmethod
+    @readcache.cached('cimp_news')
     def getone(news_id):
         try:
-            qs = News.objects.values("id",
-                                        "pubdate",
-                                        "author",
-                                        "author_realname",
-                                        "title",
-                                        "content",
-                                        "status"
-            )
+            qs = News.objects.values(*News.ONE_FIELDS)
             
             qs = qs.filter(id=news_id).first()
             
@@ -348,14 +507,38 @@ class News(models.Model):
             return {'ret': 2, 'msg': err}
         
     @staticmethod
-    def modifyone(news_id, new_data):
+    @readcache.cached('cimp_news')
+    async def agetone(news_id):
+        # getone for async views
         try:
-            news = News.objects.get(id=news_id)
+            rec = await News.objects.values(*News.ONE_FIELDS).filter(id=news_id).afirst()
             
-            for field, value in new_data.items():
-                setattr(news, field, value)
+            return {'ret': 0, 'rec': rec}
+            
+        except:
+            err = traceback.format_exc()
+            return {'ret': 2, 'msg': err}
+        
+    @staticmethod
+    def modifyone(news_id, new_data):
+        try:
+            with transaction.atomic():
+                news = News.objects.get(id=news_id)
+                old = (news.status, news.author_id)
+                
+                for field, value in new_data.items():
+                    setattr(news, field, value)
                 
-            news.save()
+                if 'content' in new_data:
+                    news.excerpt, news.plaintext_len = makeexcerpt(news.content)
+                    
+                news.save()
+                RowCounter.move(News, old, (news.status, news.author_id))
+                readcache.touch(News)
+                Generation.touch(News, [news.id])
+                
+                if 'content' in new_data:
+                    fulltext.index(News, news.id, news.content)
             
             return {'ret': 0}
             
@@ -368,11 +551,16 @@ class News(models.Model):
     @staticmethod
     def banone(news_id):
         try:
-            news = News.objects.get(id=news_id)
-            
-            news.status = 3
+            with transaction.atomic():
+                news = News.objects.get(id=news_id)
+                old = news.status
                 
-            news.save()
+                news.status = 3
+                    
+                news.save()
+                RowCounter.move(News, (old, news.author_id), (news.status, news.author_id))
+                readcache.touch(News)
+                Generation.touch(News, [news.id])
             
             return {'ret': 0, 'status': 3}
             
@@ -385,12 +573,17 @@ class News(models.Model):
     @staticmethod
     def publishone(news_id):
         try:
-            news = News.objects.get(id=news_id)
-            
-            if news.status == 3:
-                news.status = 1
+            with transaction.atomic():
+                news = News.objects.get(id=news_id)
+                old = news.status
                 
-            news.save()
+                if news.status == 3:
+                    news.status = 1
+                    
+                news.save()
+                RowCounter.move(News, (old, news.author_id), (news.status, news.author_id))
+                readcache.touch(News)
+                Generation.touch(News, [news.id])
             
             return {'ret': 0, 'status': 1}
             
@@ -403,9 +596,15 @@ class News(models.Model):
     @staticmethod
     def deleteone(news_id):
         try:
-            news = News.objects.get(id=news_id)
-            
-            news.delete()
+            with transaction.atomic():
+                news = News.objects.get(id=news_id)
+                
+                fulltext.unindex(News, [news.id])
+                RowCounter.bump(News, news.status, news.author_id, -1)
+                readcache.touch(News)
+                Generation.touch(News, [news.id])
+                ReadSketch.dropitems(News, [news.id])
+                news.delete()
             
             return {'ret': 0}
             
@@ -415,4 +614,22 @@ class News(models.Model):
             err = traceback.format_exc()
             return {'ret': 2, 'msg': err}
         
+    # Moderation of many ids in one call, see moderation.py
+    @staticmethod
+    def banmany(ids):
+        return moderation.setstatus(News, ids, 3)
+    
+    @staticmethod
+    def publishmany(ids):
+        # Like publishone, only banned rows go back to published
+        return moderation.setstatus(News, ids, 1, fromstatus=(3,))
+    
+    @staticmethod
+    def deletemany(ids):
+        return moderation.delete(News, ids)
+
 
+fulltext.register(Notice)
+fulltext.register(News)
+RowCounter.register(Notice)
+RowCounter.register(News)
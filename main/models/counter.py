@@ -0,0 +1,150 @@
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Sum, Count
+
+# Maintained row counts, so paginated lists do not run COUNT(*) per request.
+#
+# One row per (model, status, author) plus an all-authors row with author=0.
+# Writers call bump/move inside the same transaction as the row they change,
+# and list methods read unfiltered totals from here in O(1).
+class RowCounter(models.Model):
+    # db_table of the counted model
+    model = models.CharField(max_length=100)
+    # Status of the counted rows, 0 for models without a status
+    status = models.PositiveIntegerField(default=0)
+    # Author/creator id, 0 for the all-authors total
+    author = models.BigIntegerField(default=0)
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = "cimp_rowcounter"
+        app_label = "main"
+        constraints = [
+            models.UniqueConstraint(fields=['model', 'status', 'author'], name='cimp_rowcounter_key'),
+        ]
+
+    # db_table -> (model, status field, author field), None where the model has no such field
+    COUNTED = {}
+
+    @staticmethod
+    def register(model, status='status', author='author'):
+        RowCounter.COUNTED[model._meta.db_table] = (model, status, author)
+
+    @staticmethod
+    def _add(table, status, author, delta):
+        updated = RowCounter.objects.filter(model=table, status=status, author=author).update(count=F('count') + delta)
+        if updated:
+            return
+        try:
+            with transaction.atomic():
+                RowCounter.objects.create(model=table, status=status, author=author, count=delta)
+        except IntegrityError:
+            # Created concurrently by another writer
+            RowCounter.objects.filter(model=table, status=status, author=author).update(count=F('count') + delta)
+
+    @staticmethod
+    def bump(model, status, author, delta):
+        """
+        Add delta to the (status, author) count and to the all-authors total.
+        Call inside the transaction that writes the counted row
+        """
+        table = model._meta.db_table
+        status = status or 0
+        author = author or 0
+        if author:
+            RowCounter._add(table, status, author, delta)
+        RowCounter._add(table, status, 0, delta)
+
+    @staticmethod
+    def move(model, old, new):
+        """
+        A row changed from old (status, author) to new (status, author)
+        """
+        if old != new:
+            RowCounter.bump(model, old[0], old[1], -1)
+            RowCounter.bump(model, new[0], new[1], 1)
+
+    @staticmethod
+    def dropauthor(author):
+        """
+        Rows of this author are being deleted by cascade: take them out of the
+        totals and drop the author's own counters
+        """
+        qs = RowCounter.objects.filter(author=author)
+        for one in qs.values('model', 'status', 'count'):
+            RowCounter._add(one['model'], one['status'], 0, -one['count'])
+        qs.delete()
+
+    @staticmethod
+    def _totalqs(model, status, author):
+        qs = RowCounter.objects.filter(model=model._meta.db_table, author=author)
+        if status is not None:
+            qs = qs.filter(status=status)
+        return qs
+    
+    @staticmethod
+    def total(model, status=None, author=0):
+        return RowCounter._totalqs(model, status, author).aggregate(n=Sum('count'))['n'] or 0
+    
+    @staticmethod
+    async def atotal(model, status=None, author=0):
+        return (await RowCounter._totalqs(model, status, author).aaggregate(n=Sum('count')))['n'] or 0
+
+    @staticmethod
+    def pagetotal(withtotal, keywords, model, status=None, author=0):
+        """
+        The total argument for CountedPaginator:
+        False when the client asked for no total, None (exact COUNT) or 'approx'
+        when the list is keyword filtered, otherwise the maintained count
+        """
+        if withtotal is False:
+            return False
+        if keywords:
+            return 'approx' if withtotal == 'approx' else None
+        return RowCounter.total(model, status, author)
+    
+    @staticmethod
+    async def apagetotal(withtotal, keywords, model, status=None, author=0):
+        # pagetotal for async views
+        if withtotal is False:
+            return False
+        if keywords:
+            return 'approx' if withtotal == 'approx' else None
+        return await RowCounter.atotal(model, status, author)
+
+    @staticmethod
+    def recount(model):
+        """
+        Rebuild the counters of one model from its table
+        """
+        table = model._meta.db_table
+        _, statusfield, authorfield = RowCounter.COUNTED[table]
+        groupby = [one for one in (statusfield, authorfield) if one]
+
+        with transaction.atomic():
+            RowCounter.objects.filter(model=table).delete()
+            if groupby:
+                rows = model.objects.values(*groupby).annotate(n=Count('id')).order_by()
+            else:
+                rows = [{'n': model.objects.count()}]
+
+            totals = {}
+            counters = []
+            for one in rows:
+                status = one.get(statusfield, 0) if statusfield else 0
+                author = one.get(authorfield, 0) if authorfield else 0
+                if author:
+                    counters.append(RowCounter(model=table, status=status, author=author, count=one['n']))
+                totals[status] = totals.get(status, 0) + one['n']
+            for status, n in totals.items():
+                counters.append(RowCounter(model=table, status=status, author=0, count=n))
+            RowCounter.objects.bulk_create(counters)
+
+    @staticmethod
+    def setup(sender, using='default', **kwargs):
+        """
+        post_migrate receiver: seed counters of models that have none yet,
+        e.g. right after the counter table was added to an existing database
+        """
+        for table, (model, _, _) in RowCounter.COUNTED.items():
+            if not RowCounter.objects.using(using).filter(model=table).exists():
+                RowCounter.recount(model)
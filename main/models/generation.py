@@ -0,0 +1,57 @@
+import functools
+
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
+
+# Generation numbers of derived data kept in worker memory (the homepage
+# snapshot, ...). A worker compares its copy's generation with this table, one
+# primary-key lookup, and rebuilds only when some writer has bumped it.
+class Generation(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = "cimp_generation"
+        app_label = "main"
+
+    # name -> affected(table, ids): whether a change to these rows changes the derived data
+    WATCH = {}
+
+    @staticmethod
+    def watch(name, affected):
+        Generation.WATCH[name] = affected
+
+    @staticmethod
+    def current(name):
+        return Generation.objects.filter(name=name).values_list('value', flat=True).first() or 0
+
+    @staticmethod
+    async def acurrent(name):
+        return await Generation.objects.filter(name=name).values_list('value', flat=True).afirst() or 0
+
+    @staticmethod
+    def bump(name):
+        updated = Generation.objects.filter(name=name).update(value=F('value') + 1)
+        if updated:
+            return
+        try:
+            with transaction.atomic():
+                Generation.objects.create(name=name, value=1)
+        except IntegrityError:
+            # Created concurrently by another writer
+            Generation.objects.filter(name=name).update(value=F('value') + 1)
+
+    @staticmethod
+    def changed(table, ids):
+        for name, affected in Generation.WATCH.items():
+            if ids is None or affected(table, ids):
+                Generation.bump(name)
+
+    @staticmethod
+    def touch(model, ids=None):
+        """
+        Rows ids of model (or db_table name) were written, None for unknown rows.
+        Watched generations they affect are bumped once the transaction commits
+        """
+        table = model if isinstance(model, str) else model._meta.db_table
+        transaction.on_commit(functools.partial(Generation.changed, table, ids))
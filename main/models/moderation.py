@@ -0,0 +1,125 @@
+import traceback
+from collections import Counter
+
+from django.db import transaction
+
+from lib import fulltext, readcache
+from .counter import RowCounter
+from .generation import Generation
+from .readers import ReadSketch
+
+# Set-based moderation of many rows in one call (banmany, publishmany, ...).
+#
+# The rows are read once, checked one by one, and every permitted row is then
+# changed by a single UPDATE or DELETE in the same transaction. Each id gets
+# its own outcome, in the shape the matching *one method returns.
+
+# Most ids accepted by one call
+BULK_MAX = 500
+
+
+def parseids(value):
+    """
+    Distinct ids of an 'ids' parameter, in the given order.
+    Raises ValueError when it is not a non-empty list of at most BULK_MAX ids
+    """
+    if not isinstance(value, list) or not value or len(value) > BULK_MAX:
+        raise ValueError('ids')
+    ids = []
+    for one in value:
+        if isinstance(one, bool) or not isinstance(one, (int, str)):
+            raise ValueError('ids')
+        ids.append(int(one))
+    return list(dict.fromkeys(ids))
+
+
+def _load(model, ids):
+    """
+    id -> {'id', 'status', 'author'} of the rows that exist, locked for the
+    transaction where the database supports it
+    """
+    rows = model.objects.select_for_update().filter(id__in=ids).values('id', 'status', 'author')
+    return {one['id']: one for one in rows}
+
+
+def _outcomes(model, ids, rows, check):
+    """
+    Per-id outcome for the rows that cannot be changed, and the rows that can
+    """
+    name = model.__name__
+    results = {}
+    allowed = []
+    for one in ids:
+        row = rows.get(one)
+        if row is None:
+            results[one] = {'id': one, 'ret': 1, 'msg': f'{name} with id {one} does not exist'}
+            continue
+        msg = check(row) if check else None
+        if msg:
+            results[one] = {'id': one, 'ret': 2, 'msg': msg}
+            continue
+        allowed.append(row)
+    return results, allowed
+
+
+def setstatus(model, ids, status, check=None, fromstatus=None):
+    """
+    Set the status of many rows with one UPDATE.
+    check(row) returns an error message for a row the caller may not change.
+    With fromstatus, only rows currently in one of those statuses change and
+    the others are reported unchanged
+    """
+    try:
+        with transaction.atomic():
+            rows = _load(model, ids)
+            results, allowed = _outcomes(model, ids, rows, check)
+
+            changed = [one for one in allowed
+                       if one['status'] != status and (fromstatus is None or one['status'] in fromstatus)]
+            changedids = {one['id'] for one in changed}
+            for one in allowed:
+                newstatus = status if one['id'] in changedids else one['status']
+                results[one['id']] = {'id': one['id'], 'ret': 0, 'status': newstatus}
+
+            if changed:
+                model.objects.filter(id__in=changedids).update(status=status)
+                # One counter move per (old status, author) group, not per row
+                groups = Counter((one['status'], one['author']) for one in changed)
+                for (old, author), n in groups.items():
+                    RowCounter.bump(model, old, author, -n)
+                    RowCounter.bump(model, status, author, n)
+                readcache.touch(model)
+                Generation.touch(model, list(changedids))
+
+        return {'ret': 0, 'results': [results[one] for one in ids], 'changed': len(changed)}
+    except:
+        err = traceback.format_exc()
+        return {'ret': 2, 'msg': err}
+
+
+def delete(model, ids, check=None):
+    """
+    Delete many rows with one DELETE (plus the cascade of their dependants)
+    """
+    try:
+        with transaction.atomic():
+            rows = _load(model, ids)
+            results, allowed = _outcomes(model, ids, rows, check)
+            for one in allowed:
+                results[one['id']] = {'id': one['id'], 'ret': 0}
+
+            if allowed:
+                allowedids = [one['id'] for one in allowed]
+                fulltext.unindex(model, allowedids)
+                groups = Counter((one['status'], one['author']) for one in allowed)
+                for (status, author), n in groups.items():
+                    RowCounter.bump(model, status, author, -n)
+                readcache.touch(model)
+                Generation.touch(model, allowedids)
+                ReadSketch.dropitems(model, allowedids)
+                model.objects.filter(id__in=allowedids).delete()
+
+        return {'ret': 0, 'results': [results[one] for one in ids], 'changed': len(allowed)}
+    except:
+        err = traceback.format_exc()
+        return {'ret': 2, 'msg': err}
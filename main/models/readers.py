@@ -0,0 +1,137 @@
+import atexit
+import logging
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import models, transaction, IntegrityError
+
+from lib import hll, readcache
+
+logger = logging.getLogger(__name__)
+
+# Distinct readers of notices and news, estimated with one HyperLogLog sketch
+# (lib/hll.py, 4 KB) per item instead of one row per (user, item) read.
+#
+# getone adds the reader to a sketch held in worker memory. Buffered sketches
+# are merged into the stored ones every READERS_FLUSH_INTERVAL seconds or
+# READERS_FLUSH_SIZE reads, and the estimate is stored next to the sketch so
+# list pages read it without decoding anything.
+class ReadSketch(models.Model):
+    # db_table of the read model
+    model = models.CharField(max_length=100)
+    item = models.BigIntegerField()
+    sketch = models.BinaryField()
+    # Estimated distinct readers, updated on every merge
+    readers = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = "cimp_readsketch"
+        app_label = "main"
+        constraints = [
+            models.UniqueConstraint(fields=['model', 'item'], name='cimp_readsketch_key'),
+        ]
+
+    # (db_table, item id) -> sketch of reads not merged yet, in this worker
+    PENDING = {}
+    PENDING_LOCK = threading.Lock()
+    # [reads buffered, monotonic time of the last flush]
+    PENDING_STATE = [0, time.monotonic()]
+
+    @staticmethod
+    def buffer(model, item, reader):
+        """
+        Count reader (a user id) as a reader of item in this worker's buffer.
+        Returns whether the buffer is due for a flush
+        """
+        key = (model._meta.db_table, int(item))
+        with ReadSketch.PENDING_LOCK:
+            sketch = ReadSketch.PENDING.get(key)
+            if sketch is None:
+                sketch = ReadSketch.PENDING[key] = hll.empty()
+            hll.add(sketch, reader)
+            ReadSketch.PENDING_STATE[0] += 1
+            return (ReadSketch.PENDING_STATE[0] >= getattr(settings, 'READERS_FLUSH_SIZE', 1000)
+                    or time.monotonic() - ReadSketch.PENDING_STATE[1] >= getattr(settings, 'READERS_FLUSH_INTERVAL', 30))
+
+    @staticmethod
+    def tryflush():
+        try:
+            ReadSketch.flush()
+        except:
+            # The reads stay buffered, the next flush retries them
+            logger.exception('Merging buffered reader sketches failed')
+
+    @staticmethod
+    def record(model, item, reader):
+        """
+        Count reader (a user id) as a reader of item
+        """
+        if ReadSketch.buffer(model, item, reader):
+            ReadSketch.tryflush()
+
+    @staticmethod
+    async def arecord(model, item, reader):
+        # record for async views, only a due flush leaves the event loop
+        if ReadSketch.buffer(model, item, reader):
+            await sync_to_async(ReadSketch.tryflush)()
+
+    @staticmethod
+    def _merge(table, item, sketch):
+        row = ReadSketch.objects.select_for_update().filter(model=table, item=item).first()
+        if row is not None:
+            merged = hll.merge(bytes(row.sketch), sketch)
+            ReadSketch.objects.filter(id=row.id).update(sketch=bytes(merged), readers=hll.estimate(merged))
+            return
+        try:
+            with transaction.atomic():
+                ReadSketch.objects.create(model=table, item=item, sketch=bytes(sketch), readers=hll.estimate(sketch))
+        except IntegrityError:
+            # Created concurrently by another worker
+            ReadSketch._merge(table, item, sketch)
+
+    @staticmethod
+    def flush():
+        """
+        Merge the buffered sketches into the stored ones, in one transaction
+        """
+        with ReadSketch.PENDING_LOCK:
+            pending = ReadSketch.PENDING.copy()
+            ReadSketch.PENDING.clear()
+            ReadSketch.PENDING_STATE[:] = [0, time.monotonic()]
+        if not pending:
+            return 0
+
+        try:
+            with transaction.atomic():
+                for (table, item) in sorted(pending):
+                    ReadSketch._merge(table, item, pending[(table, item)])
+                readcache.touch(ReadSketch)
+        except:
+            # Merging is idempotent, so putting everything back is safe
+            with ReadSketch.PENDING_LOCK:
+                for key, sketch in pending.items():
+                    ReadSketch.PENDING[key] = hll.merge(ReadSketch.PENDING.get(key), sketch)
+            raise
+        return len(pending)
+
+    @staticmethod
+    def markreaders(ret, model):
+        """
+        Add the estimated distinct 'readers' to every row of a list result,
+        with one lookup for the page
+        """
+        if ret.get('ret') != 0 or not ret.get('items'):
+            return ret
+        ids = [one['id'] for one in ret['items']]
+        readers = dict(ReadSketch.objects.filter(model=model._meta.db_table, item__in=ids).values_list('item', 'readers'))
+        return dict(ret, items=[dict(one, readers=readers.get(one['id'], 0)) for one in ret['items']])
+
+    @staticmethod
+    def dropitems(model, ids):
+        ReadSketch.objects.filter(model=model._meta.db_table, item__in=ids).delete()
+
+
+# Buffered reads are merged when the worker exits
+atexit.register(ReadSketch.flush)
@@ -1,7 +1,15 @@
-from django.db import models
+from django.db import models, transaction
+from asgiref.sync import sync_to_async
+import time
 import traceback
+from django.conf import settings
 from django.db.models import Q
+from datetime import datetime
+import heapq
+from lib.pagination import encode_cursor, decode_cursor
+from lib import readcache, jsonenc
 from .user import User
+from .generation import Generation
 from .content import News, Notice
 from .academic import Paper
 import json
@@ -16,12 +24,45 @@ class Config(models.Model):
         db_table = "cimp_config"
         app_label = "main"
            
+    # (version, monotonic time of the last version check, {name: value}) of this worker
+    CACHE = None
+    
+    @staticmethod
+    def values(fresh=False):
+        """
+        All config values, read once per worker and reloaded when the 'config'
+        generation moves. The generation is checked at most every
+        CONFIG_CACHE_TTL seconds, which bounds how stale another worker's
+        change can look here. fresh=True checks it now
+        """
+        now = time.monotonic()
+        cache = Config.CACHE
+        if cache and not fresh and now - cache[1] < getattr(settings, 'CONFIG_CACHE_TTL', 1):
+            return cache[2]
+        
+        version = Generation.current('config')
+        if cache and cache[0] == version:
+            Config.CACHE = (version, now, cache[2])
+            return cache[2]
+        
+        # Read after the version: a change committed in between shows up as a
+        # newer version on the next check and is reloaded then
+        values = dict(Config.objects.values_list('name', 'value'))
+        Config.CACHE = (version, now, values)
+        return values
+    
     @staticmethod
     def set(data):
         try:
-            Config.objects.create(name=data['name'],
-                                value=data['value']
-            )
+            with transaction.atomic():
+                Config.objects.update_or_create(name=data['name'], defaults={'value': data['value']})
+                # Committed together with the value, so no worker can see the
+                # new version with the old value
+                Generation.bump('config')
+                readcache.touch(Config)
+                Generation.touch(Config)
+            # This worker sees its own change right away
+            Config.CACHE = None
             return {'ret': 0}
         except:
             err = traceback.format_exc()
@@ -30,16 +71,18 @@ class Config(models.Model):
     @staticmethod
     def get(name):
         try:
-            config = Config.objects.get(name=name)
-            return {'ret': 0, 'value': config.value}
+            values = Config.values()
+            if name not in values:
+                return {'ret': 1, 'msg': f'Config {name} does not exist'}
+            return {'ret': 0, 'value': values[name]}
         except:
             err = traceback.format_exc()
             return {'ret': 2, 'msg': err}
         
     def gethomepagebyconfig(self):
         try:
-            config = Config.objects.get(name='homepage')
-            value = json.loads(config.value)
+            # Fresh: a snapshot built from a stale value would outlive the change
+            value = json.loads(Config.values(fresh=True)['homepage'])
             news_ids = value.get('news', [])
             notice_ids = value.get('notice', [])
             paper_ids = value.get('paper', [])
@@ -49,18 +92,21 @@ class Config(models.Model):
                                                                             "author",
                                                                             "author_realname",
                                                                             "title",
+                                                                            "excerpt",
                                                                             "status"))
             notice_list = list(Notice.objects.filter(id__in=notice_ids, status=1).values("id",
                                                                             "pubdate",
                                                                             "author",
                                                                             "author_realname",
                                                                             "title",
+                                                                            "excerpt",
                                                                             "status"))
             paper_list = list(Paper.objects.filter(id__in=paper_ids, status=1).values("id",
                                                                             "pubdate",
                                                                             "author",
                                                                             "author_realname",
                                                                             "title",
+                                                                            "excerpt",
                                                                             "status"))
             info = {'news': self.listbyid(news_list, news_ids), 'notice': self.listbyid(notice_list, notice_ids), 'paper': self.listbyid(paper_list, paper_ids)}
                        
@@ -69,7 +115,118 @@ class Config(models.Model):
             err = traceback.format_exc()
             return {'ret': 2, 'msg': err}
         
+    # Content types merged into the timeline. The position is the tie-break
+    # rank between rows with the same pubdate
+    TIMELINE_KINDS = (('news', News), ('notice', Notice), ('paper', Paper))
+    TIMELINE_FIELDS = ("id", "pubdate", "author", "author_realname", "title", "excerpt")
+    
+    @staticmethod
+    def timeline(pagesize, cursor=None):
+        """
+        Published news, notices and papers merged into one stream, newest first.
+        
+        Each type is read with its own (status, pubdate, id) index-ordered query
+        of at most pagesize+1 rows after the cursor, and the three are k-way merged.
+        Rows are ordered by (pubdate, kind rank, id) descending.
+        """
+        try:
+            last = None
+            if cursor:
+                data = decode_cursor(cursor)
+                last = (datetime.fromisoformat(data['pubdate']), data['rank'], int(data['id']))
+            
+            streams = []
+            for rank, (kind, model) in enumerate(Config.TIMELINE_KINDS):
+                qs = model.objects.filter(status=1)
+                if last:
+                    pubdate, lastrank, lastid = last
+                    if rank < lastrank:
+                        # Same pubdate ranks below the cursor row, so it comes after it
+                        qs = qs.filter(pubdate__lte=pubdate)
+                    elif rank > lastrank:
+                        qs = qs.filter(pubdate__lt=pubdate)
+                    else:
+                        qs = qs.filter(pubdate__lte=pubdate).exclude(pubdate=pubdate, id__gte=lastid)
+                rows = qs.order_by('-pubdate', '-id').values(*Config.TIMELINE_FIELDS)[:pagesize + 1]
+                streams.append([dict(one, kind=kind, rank=rank) for one in rows])
+            
+            merged = list(heapq.merge(*streams, key=lambda one: (one['pubdate'], one['rank'], one['id']), reverse=True))
+            items = merged[:pagesize]
+            
+            nextcursor = None
+            if len(merged) > pagesize:
+                tail = items[-1]
+                nextcursor = encode_cursor(pubdate=tail['pubdate'].isoformat(), rank=tail['rank'], id=tail['id'])
+            
+            for one in items:
+                del one['rank']
+            
+            return {'ret': 0, 'items': items, 'next': nextcursor}
+        except (ValueError, KeyError, TypeError):
+            return {'ret': 2, 'msg': 'Invalid cursor'}
+        except:
+            err = traceback.format_exc()
+            return {'ret': 2, 'msg': err}
+        
     def listbyid(self, items, ids):
         dic = {one['id']: one for one in items}
         return [dic[id] for id in ids if id in dic]
+    
+    # homepage config key of each content table
+    HOMEPAGE_KINDS = {'cimp_news': 'news', 'cimp_notice': 'notice', 'cimp_paper': 'paper'}
+    
+    # (generation, serialized gethomepagebyconfig response) of this worker
+    SNAPSHOT = None
+    
+    @staticmethod
+    def homepagesnapshot():
+        """
+        The gethomepagebyconfig response as JSON bytes, kept in memory.
+        Costs one primary key lookup of the 'homepage' generation while the
+        snapshot is current, and is rebuilt once some writer bumped it
+        """
+        generation = Generation.current('homepage')
+        snapshot = Config.SNAPSHOT
+        if snapshot and snapshot[0] == generation:
+            return {'ret': 0, 'body': snapshot[1]}
+        
+        # Built from data at least as new as `generation`. A write committed
+        # meanwhile bumps it again, so a stale build is never kept as current
+        ret = Config().gethomepagebyconfig()
+        if ret['ret'] != 0:
+            return ret
+        body = jsonenc.dumps(ret)
+        Config.SNAPSHOT = (generation, body)
+        return {'ret': 0, 'body': body}
+    
+    @staticmethod
+    async def ahomepagesnapshot():
+        """
+        homepagesnapshot for async views: the generation check is awaited, a
+        rebuild (rare, many queries) runs in a thread
+        """
+        snapshot = Config.SNAPSHOT
+        if snapshot and snapshot[0] == await Generation.acurrent('homepage'):
+            return {'ret': 0, 'body': snapshot[1]}
+        return await sync_to_async(Config.homepagesnapshot)()
+    
+    @staticmethod
+    def homepageaffected(table, ids):
+        """
+        Whether a change to rows ids of table shows on the homepage
+        """
+        kind = Config.HOMEPAGE_KINDS.get(table)
+        if kind is None:
+            return table == Config._meta.db_table
+        value = Config.objects.filter(name='homepage').values_list('value', flat=True).first()
+        if value is None:
+            return False
+        try:
+            referenced = json.loads(value).get(kind, [])
+        except ValueError:
+            return True
+        return not set(ids).isdisjoint(referenced)
+
+
+Generation.watch('homepage', Config.homepageaffected)
 
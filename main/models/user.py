@@ -1,9 +1,16 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 import traceback
 from django.db.models import Q
-from django.core.paginator import Paginator, EmptyPage
+from django.core.paginator import EmptyPage
+from lib.pagination import CountedPaginator
+from lib import readcache
+from .counter import RowCounter
+from .generation import Generation
 
 # You can create a superuser via command: python manage.py createsuperuser
 # This adds a record to this User table
@@ -32,6 +39,10 @@ class User(AbstractUser):
     class Meta:
         db_table = "cimp_user"
         app_label = "main"
+        indexes = [
+            # listteachers: usertype=3000
+            models.Index(fields=['usertype'], name='cimp_user_usertype'),
+        ]
     
     
     @staticmethod 
@@ -54,7 +65,7 @@ class User(AbstractUser):
         
         
     @staticmethod 
-    def listbypage(pagenum, pagesize, keywords):
+    def listbypage(pagenum, pagesize, keywords, withtotal=True):
         try:
             qs = User.objects.values('id', 
                                      'username', 
@@ -72,8 +83,8 @@ class User(AbstractUser):
                     query &= condition
                 qs = qs.filter(query)
 
-            # Use Paginator
-            pgnt = Paginator(qs, pagesize)
+            # Use Paginator, the unfiltered total comes from the maintained counter
+            pgnt = CountedPaginator(qs, pagesize, RowCounter.pagetotal(withtotal, keywords, User))
 
             # Read specific page from database
             page = pgnt.page(pagenum)
@@ -134,6 +145,27 @@ class User(AbstractUser):
             err = traceback.format_exc()
             return {'ret': 2, 'msg': err}
 
+RowCounter.register(User, status=None, author=None)
+
+# Users are also created by createsuperuser and the admin site, not only by
+# addone, so the user count is kept on the model signals
+@receiver(post_save, sender=User)
+def countuseradded(sender, instance, created, **kwargs):
+    if created:
+        with transaction.atomic():
+            RowCounter.bump(User, None, None, 1)
+
+@receiver(post_delete, sender=User)
+def countuserdeleted(sender, instance, **kwargs):
+    with transaction.atomic():
+        # Content of this user went with it by cascade
+        RowCounter.dropauthor(instance.id)
+        RowCounter.bump(User, None, None, -1)
+        readcache.touch('cimp_notice', 'cimp_news', 'cimp_paper')
+        for table in ('cimp_notice', 'cimp_news', 'cimp_paper'):
+            Generation.touch(table)
+
+
 # Personal Profile Settings
 class Profile(models.Model):
     # Teacher set by student
@@ -216,4 +248,25 @@ class Profile(models.Model):
         except:
             err = traceback.format_exc()
             return {'ret': 2, 'msg': err}
+
+    @staticmethod
+    async def alistteachers(keywords):
+        # listteachers for async views. The count of at most 30 rows is the
+        # length of the list, so one query is enough
+        try:
+            qs = User.objects.filter(usertype=3000).values("id", "realname")
+            
+            if keywords:
+                query = Q()
+                for one in keywords.split(" "):
+                    if one:
+                        query &= Q(realname__contains=one)
+                qs = qs.filter(query)
+            retlist = [one async for one in qs[:30]]
+            
+            return {"ret": 0, "items": retlist, "total": len(retlist), "keyword": keywords}
+                
+        except:
+            err = traceback.format_exc()
+            return {'ret': 2, 'msg': err}
           
\ No newline at end of file
@@ -1,9 +1,11 @@
 from django.db import models
 import traceback
 from django.db.models import Q
-from django.core.paginator import Paginator, EmptyPage
+from django.core.paginator import EmptyPage
+from lib.pagination import CountedPaginator
 from django.utils import timezone
 from .user import User
+from .counter import RowCounter
 import json
 
 class GraduateDesign(models.Model):
@@ -128,6 +130,10 @@ class GraduateDesign(models.Model):
     class Meta:
         db_table = "cimp_graduatedesign"
         app_label = "main"
+        indexes = [
+            # listbypage for students: creator=? ORDER BY id DESC
+            models.Index(fields=['creator', '-id'], name='cimp_gd_creator_id'),
+        ]
     # =========================================================
     #               Core Logic Methods
     # =========================================================
@@ -159,7 +165,7 @@ class GraduateDesign(models.Model):
         return False
        
     @staticmethod
-    def listbypage(pagenum, pagesize, keywords, current_user):
+    def listbypage(pagenum, pagesize, keywords, current_user, withtotal=True):
         try:
             qs = GraduateDesign.objects.values("id",
                                         "creator",
@@ -170,17 +176,19 @@ class GraduateDesign(models.Model):
             ).order_by('-id')
             
             # Permission filter: Students can only see their own
+            author = 0
             if current_user.usertype == 2000:
                 qs = qs.filter(creator=current_user)
+                author = current_user.id
             
             if keywords:
-                conditions = [Q(content__contains=one) for one in keywords.split(' ') if one]
+                conditions = [Q(title__contains=one) for one in keywords.split(' ') if one]
                 query = Q()
                 for condition in conditions:
                     query &= condition
                 qs = qs.filter(query)
                 
-            pgnt = Paginator(qs, pagesize)
+            pgnt = CountedPaginator(qs, pagesize, RowCounter.pagetotal(withtotal, keywords, GraduateDesign, author=author))
             
             page = pgnt.page(pagenum)
             
@@ -277,6 +285,9 @@ class GraduateDesign(models.Model):
         return ret_actions
     
     
+RowCounter.register(GraduateDesign, status=None, author='creator')
+
+
 # Step Record Table
 class GraduateDesignStep(models.Model):
     
@@ -292,6 +303,10 @@ class GraduateDesignStep(models.Model):
     class Meta:
         db_table = "cimp_graduatedesign_step"
         app_label = "main"
+        indexes = [
+            # Step history: design_id=? ORDER BY id
+            models.Index(fields=['design', 'id'], name='cimp_gd_step_design_id'),
+        ]
 
     @staticmethod
     def getstepactiondata(step_id):
@@ -6,4 +6,4 @@ from .academic import PaperHandler
 
 from .workflow import GraduateDesignHandler
 
-from .system import ConfigHandler, UploadHandler
\ No newline at end of file
+from .system import ConfigHandler, UploadHandler, MetricsHandler
\ No newline at end of file
@@ -1,79 +1,98 @@
-import json
-from django.http import JsonResponse
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
 from lib.share import JR
-from main.models import Paper
+from lib.dispatch import Handler, action
+from lib.httpcache import conditional
+from lib.dbrouter import replica
+from lib.pagination import pageparams, totalparam
+from lib.export import FORMATS, streamexport
+from main.models.moderation import parseids
+from main.models import Paper, Thumbup
 from django.utils import timezone
 
-class PaperHandler:
-    def handle(self, request):
-        if request.method == 'GET':
-            pd = request.GET
-        else:
-            pd = json.loads(request.body)
-        
-        request.pd = pd
+class PaperHandler(Handler):
+    @action('listbypage', 'pagenum?', 'pagesize', 'withoutcontent?', 'withliked?')
+    @replica
+    @conditional('cimp_paper', Thumbup.LIKED_TABLE)
+    def listbypage(self, request):
+        try:
+            # pagenum is None when the client asks for cursor mode
+            pagenum, after_id, before_id = pageparams(request.pd)
+        except ValueError:
+            return JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+        pagesize = request.pd['pagesize']
+        keywords = str(request.pd.get('keywords', ''))
+        withoutcontent = request.pd.get('withoutcontent', False)
         
-        action = pd.get('action')
+        ret = Paper.listbypage(pagesize, pagenum, keywords, withoutcontent, after_id, before_id, totalparam(request.pd))
+        if request.pd.get('withliked', False):
+            ret = Thumbup.markliked(ret, request.user)
         
-        if action == 'listbypage':
-            return self.listbypage(request)
-        elif action == 'listbypage_allstate':
-            return self.listbypage_allstate(request)
-        elif action == 'listminebypage':
-            return self.listminebypage(request)
-        elif action == 'addone':
-            return self.addone(request)
-        elif action == 'getone':
-            return self.getone(request)
-        elif action == 'modifyone':
-            return self.modifyone(request)
-        elif action == 'holdone':
-            return self.holdone(request)
-        elif action == 'banone':
-            return self.banone(request)
-        elif action == 'publishone':
-            return self.publishone(request)
-        elif action == 'deleteone':
-            return self.deleteone(request)
-        else:
-            return JsonResponse({'ret': 2, 'msg': 'Action parameter error'})
-        
-    def listbypage(self, request):
-        pagesize = int(request.pd.get('pagesize'))
-        pagenum = int(request.pd.get('pagenum'))
-        keywords = str(request.pd.get('keywords'))
-        withoutcontent = bool(request.pd.get('withoutcontent', False))
+        return JR(ret)
+    
+    @action('listbypage', 'pagenum?', 'pagesize', 'withoutcontent?', 'withliked?')
+    @replica
+    @conditional('cimp_paper', Thumbup.LIKED_TABLE)
+    async def alistbypage(self, request):
+        try:
+            pagenum, after_id, before_id = pageparams(request.pd)
+        except ValueError:
+            return JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+        pagesize = request.pd['pagesize']
+        keywords = str(request.pd.get('keywords', ''))
+        withoutcontent = request.pd.get('withoutcontent', False)
         
-        ret = Paper.listbypage(pagesize, pagenum, keywords, withoutcontent)
+        ret = await Paper.alistbypage(pagesize, pagenum, keywords, withoutcontent, after_id, before_id, totalparam(request.pd))
+        if request.pd.get('withliked', False):
+            ret = await sync_to_async(Thumbup.markliked)(ret, request.user)
         
         return JR(ret)
     
+    @action('listbypage_allstate', 'pagenum?', 'pagesize', 'withoutcontent?', 'withliked?')
+    @replica
+    @conditional('cimp_paper', Thumbup.LIKED_TABLE)
     def listbypage_allstate(self, request):
-        pagesize = int(request.pd.get('pagesize'))
-        pagenum = int(request.pd.get('pagenum'))
-        keywords = str(request.pd.get('keywords'))
-        withoutcontent = bool(request.pd.get('withoutcontent', False))
+        try:
+            # pagenum is None when the client asks for cursor mode
+            pagenum, after_id, before_id = pageparams(request.pd)
+        except ValueError:
+            return JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+        pagesize = request.pd['pagesize']
+        keywords = str(request.pd.get('keywords', ''))
+        withoutcontent = request.pd.get('withoutcontent', False)
         
         current_user = request.user
         if current_user.is_authenticated and current_user.is_staff: 
-            ret = Paper.listbypage_allstate(pagesize, pagenum, keywords, withoutcontent)
+            ret = Paper.listbypage_allstate(pagesize, pagenum, keywords, withoutcontent, after_id, before_id, totalparam(request.pd))
         else:
-            return JsonResponse({'ret': 2, 'msg': 'Admin view only'})
+            return JR({'ret': 2, 'msg': 'Admin view only'})
+        if request.pd.get('withliked', False):
+            ret = Thumbup.markliked(ret, current_user)
         return JR(ret)
     
+    @action('listminebypage', 'pagenum?', 'pagesize', 'withoutcontent?', 'withliked?')
+    @replica
+    @conditional('cimp_paper', Thumbup.LIKED_TABLE)
     def listminebypage(self, request):
-        pagesize = int(request.pd.get('pagesize'))
-        pagenum = int(request.pd.get('pagenum'))
-        keywords = str(request.pd.get('keywords'))
-        withoutcontent = bool(request.pd.get('withoutcontent', False))
+        try:
+            # pagenum is None when the client asks for cursor mode
+            pagenum, after_id, before_id = pageparams(request.pd)
+        except ValueError:
+            return JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+        pagesize = request.pd['pagesize']
+        keywords = str(request.pd.get('keywords', ''))
+        withoutcontent = request.pd.get('withoutcontent', False)
         
         current_user = request.user
         if current_user.is_authenticated: 
-            ret = Paper.listminebypage(current_user, pagesize, pagenum, keywords, withoutcontent)
+            ret = Paper.listminebypage(current_user, pagesize, pagenum, keywords, withoutcontent, after_id, before_id, totalparam(request.pd))
         else:
-            return JsonResponse({'ret': 2, 'msg': 'Admin view only'})
+            return JR({'ret': 2, 'msg': 'Admin view only'})
+        if request.pd.get('withliked', False):
+            ret = Thumbup.markliked(ret, current_user)
         return JR(ret)
     
+    @action('addone')
     def addone(self, request):
         data = request.pd.get('data')
         current_user = request.user
@@ -86,11 +105,23 @@ class PaperHandler:
         
         return JR(ret)
     
+    @action('getone', 'id')
+    @replica
+    @conditional('cimp_paper')
     def getone(self, request):
         paper_id = request.pd.get('id')
         ret = Paper.getone(paper_id)
         return JR(ret)
     
+    @action('getone', 'id')
+    @replica
+    @conditional('cimp_paper')
+    async def agetone(self, request):
+        paper_id = request.pd.get('id')
+        ret = await Paper.agetone(paper_id)
+        return JR(ret)
+    
+    @action('modifyone', 'id')
     def modifyone(self, request):
         paper_id = request.pd.get('id')
         newdata = request.pd.get('newdata')
@@ -98,30 +129,103 @@ class PaperHandler:
         ret = Paper.modifyone(paper_id, newdata, current_user)
         return JR(ret)
     
+    @action('holdone', 'id')
     def holdone(self, request):
         paper_id = request.pd.get('id')
         current_user = request.user
         ret = Paper.holdone(paper_id, current_user)
         return JR(ret)
 
+    @action('banone', 'id')
     def banone(self, request):
         paper_id = request.pd.get('id')
         current_user = request.user
         if current_user.is_authenticated and current_user.is_staff: 
             ret = Paper.banone(paper_id)
         else:
-            return JsonResponse({'ret': 2, 'msg': 'Admin ban only'}, status=403)
+            return JR({'ret': 2, 'msg': 'Admin ban only'}, status=403)
         return JR(ret)
     
+    @action('publishone', 'id')
     def publishone(self, request):
         paper_id = request.pd.get('id')
         current_user = request.user
         ret = Paper.publishone(paper_id, current_user)
         return JR(ret)
     
+    @action('deleteone', 'id')
     def deleteone(self, request):
         paper_id = request.pd.get('id')
         current_user = request.user
         ret = Paper.deleteone(paper_id, current_user)
         return JR(ret)
-  
\ No newline at end of file
+    
+    # Hot papers panel: top pagesize published papers by time-decayed thumb-ups
+    @action('trending', 'pagesize?')
+    @replica
+    @conditional('cimp_paper')
+    def trending(self, request):
+        pagesize = min(request.pd.get('pagesize', 10), 100)
+        ret = Paper.trending(pagesize)
+        return JR(ret)
+    
+    # Moderation of many ids: {"ids": [...]}, one outcome per id in 'results'
+    @action('holdmany')
+    def holdmany(self, request):
+        try:
+            ids = parseids(request.pd.get('ids'))
+        except ValueError:
+            return JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+        ret = Paper.holdmany(ids, request.user)
+        return JR(ret)
+    
+    @action('banmany')
+    def banmany(self, request):
+        current_user = request.user
+        if not (current_user.is_authenticated and current_user.is_staff):
+            return JR({'ret': 2, 'msg': 'Admin ban only'}, status=403)
+        try:
+            ids = parseids(request.pd.get('ids'))
+        except ValueError:
+            return JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+        ret = Paper.banmany(ids)
+        return JR(ret)
+    
+    @action('publishmany')
+    def publishmany(self, request):
+        try:
+            ids = parseids(request.pd.get('ids'))
+        except ValueError:
+            return JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+        ret = Paper.publishmany(ids, request.user)
+        return JR(ret)
+    
+    @action('deletemany')
+    def deletemany(self, request):
+        try:
+            ids = parseids(request.pd.get('ids'))
+        except ValueError:
+            return JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+        ret = Paper.deletemany(ids, request.user)
+        return JR(ret)
+    
+    # Whole table as an NDJSON or CSV download, streamed in one pass
+    @action('export', 'withoutcontent?')
+    def export(self, request):
+        if not request.user.is_staff:
+            return JR({'ret': 2, 'msg': 'Admin access only'})
+        
+        fmt = request.pd.get('format', 'ndjson')
+        status = request.pd.get('status')
+        try:
+            status = None if status in (None, '') else int(status)
+        except ValueError:
+            return JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+        if fmt not in FORMATS:
+            return JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+        keywords = str(request.pd.get('keywords', ''))
+        withoutcontent = request.pd.get('withoutcontent', False)
+        
+        qs = Paper.exportquery(status, keywords, withoutcontent)
+        return streamexport(qs, Paper.listfields(withoutcontent), fmt, 'cimp_paper',
+                            asynchronous=isinstance(request, ASGIRequest))
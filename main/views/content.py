@@ -1,64 +1,91 @@
-import json
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
 from lib.share import JR
-from main.models import Notice, News
+from lib.dispatch import Handler, action
+from lib.httpcache import conditional
+from lib.dbrouter import replica
+from lib.pagination import pageparams, totalparam
+from lib.export import FORMATS, streamexport
+from main.models.moderation import parseids
+from main.models import Notice, News, ReadSketch
 from django.utils import timezone
 
-class NoticeHandler:
-    def handle(self, request):
+class NoticeHandler(Handler):
+    UNKNOWN_ACTION_STATUS = 400
+
+    def allow(self, request):
         if not request.user.is_staff:
-            return JsonResponse({'ret': 2, 'msg': 'Admin access only'})
-        
-        if request.method == 'GET':
-            pd = request.GET
-        else:
-            pd = json.loads(request.body)
-        
-        request.pd = pd
-        
-        action = pd.get('action')
-        if action == 'listbypage':
-            return self.listbypage(request)
-        elif action == 'listbypage_allstate':
-            return self.listbypage_allstate(request)
-        elif action == 'getone':
-            return self.getone(request)
-        elif action == 'addone':
-            return self.addone(request)
-        elif action == 'modifyone':
-            return self.modifyone(request)
-        elif action == 'banone':
-            return self.banone(request)
-        elif action == 'publishone':
-            return self.publishone(request)
-        elif action == 'deleteone':
-            return self.deleteone(request)
-        else:
-            return JsonResponse({'ret': 2, 'msg': 'Action parameter error'}, status=400)
+            return JR({'ret': 2, 'msg': 'Admin access only'})
         
+    @action('listbypage', 'pagenum?', 'pagesize', 'withoutcontent?')
+    @replica
+    @conditional('cimp_notice')
     def listbypage(self, request):
-        pagenum = int(request.pd.get('pagenum'))
-        pagesize = int(request.pd.get('pagesize'))
-        keywords = str(request.pd.get('keywords'))
-        withoutcontent = bool(request.pd.get('withoutcontent', False))
+        try:
+            # pagenum is None when the client asks for cursor mode
+            pagenum, after_id, before_id = pageparams(request.pd)
+        except ValueError:
+            return JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+        pagesize = request.pd['pagesize']
+        keywords = str(request.pd.get('keywords', ''))
+        withoutcontent = request.pd.get('withoutcontent', False)
+        
+        ret = Notice.listbypage(pagenum, pagesize, keywords, withoutcontent, after_id, before_id, totalparam(request.pd))
+        return JR(ret)
+    
+    @action('listbypage', 'pagenum?', 'pagesize', 'withoutcontent?')
+    @replica
+    @conditional('cimp_notice')
+    async def alistbypage(self, request):
+        try:
+            pagenum, after_id, before_id = pageparams(request.pd)
+        except ValueError:
+            return JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+        pagesize = request.pd['pagesize']
+        keywords = str(request.pd.get('keywords', ''))
+        withoutcontent = request.pd.get('withoutcontent', False)
         
-        ret = Notice.listbypage(pagenum, pagesize, keywords, withoutcontent)
+        ret = await Notice.alistbypage(pagenum, pagesize, keywords, withoutcontent, after_id, before_id, totalparam(request.pd))
         return JR(ret)
     
+    @action('listbypage_allstate', 'pagenum?', 'pagesize', 'withoutcontent?')
+    @replica
+    @conditional('cimp_notice', 'cimp_readsketch')
     def listbypage_allstate(self, request):
-        pagenum = int(request.pd.get('pagenum'))
-        pagesize = int(request.pd.get('pagesize'))
-        keywords = str(request.pd.get('keywords'))
-        withoutcontent = bool(request.pd.get('withoutcontent', False))
+        try:
+            # pagenum is None when the client asks for cursor mode
+            pagenum, after_id, before_id = pageparams(request.pd)
+        except ValueError:
+            return JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+        pagesize = request.pd['pagesize']
+        keywords = str(request.pd.get('keywords', ''))
+        withoutcontent = request.pd.get('withoutcontent', False)
         
-        ret = Notice.listbypage_allstate(pagenum, pagesize, keywords, withoutcontent)
+        ret = Notice.listbypage_allstate(pagenum, pagesize, keywords, withoutcontent, after_id, before_id, totalparam(request.pd))
+        # Estimated distinct readers, see main/models/readers.py
+        ret = ReadSketch.markreaders(ret, Notice)
         return JR(ret)
     
+    @action('getone', 'id')
+    @replica
+    @conditional('cimp_notice')
     def getone(self, request):
         notice_id = request.pd.get('id')
         ret = Notice.getone(notice_id)
+        if ret['ret'] == 0 and ret['rec']:
+            ReadSketch.record(Notice, ret['rec']['id'], request.user.id)
+        return JR(ret)
+    
+    @action('getone', 'id')
+    @replica
+    @conditional('cimp_notice')
+    async def agetone(self, request):
+        notice_id = request.pd.get('id')
+        ret = await Notice.agetone(notice_id)
+        if ret['ret'] == 0 and ret['rec']:
+            await ReadSketch.arecord(Notice, ret['rec']['id'], request.user.id)
         return JR(ret)
 
+    @action('addone')
     def addone(self, request):
         
         data = request.pd.get('data')
@@ -77,82 +104,152 @@ class NoticeHandler:
         ret = Notice.addone(data, author)
         return JR(ret)
     
+    @action('modifyone', 'id')
     def modifyone(self, request):
         notice_id = request.pd.get("id")
         new_data = request.pd.get("newdata")
         ret = Notice.modifyone(notice_id, new_data)
         return JR(ret)
     
+    @action('banone', 'id')
     def banone(self, request):
         notice_id = request.pd.get("id")
         ret = Notice.banone(notice_id)
         return JR(ret)
 
+    @action('publishone', 'id')
     def publishone(self, request):
         notice_id = request.pd.get("id")
         ret = Notice.publishone(notice_id)
         return JR(ret)
     
+    @action('deleteone', 'id')
     def deleteone(self, request):
         notice_id = request.pd.get("id")
         ret = Notice.deleteone(notice_id)
         return JR(ret)
     
-class NewsHandler:
-    def handle(self, request):
+    # Moderation of many ids: {"ids": [...]}, one outcome per id in 'results'
+    @action('banmany')
+    def banmany(self, request):
+        try:
+            ids = parseids(request.pd.get('ids'))
+        except ValueError:
+            return JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+        ret = Notice.banmany(ids)
+        return JR(ret)
+    
+    @action('publishmany')
+    def publishmany(self, request):
+        try:
+            ids = parseids(request.pd.get('ids'))
+        except ValueError:
+            return JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+        ret = Notice.publishmany(ids)
+        return JR(ret)
+    
+    @action('deletemany')
+    def deletemany(self, request):
+        try:
+            ids = parseids(request.pd.get('ids'))
+        except ValueError:
+            return JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+        ret = Notice.deletemany(ids)
+        return JR(ret)
+    
+    # Whole table as an NDJSON or CSV download, streamed in one pass
+    @action('export', 'withoutcontent?')
+    def export(self, request):
+        fmt = request.pd.get('format', 'ndjson')
+        status = request.pd.get('status')
+        try:
+            status = None if status in (None, '') else int(status)
+        except ValueError:
+            return JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+        if fmt not in FORMATS:
+            return JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+        keywords = str(request.pd.get('keywords', ''))
+        withoutcontent = request.pd.get('withoutcontent', False)
+        
+        qs = Notice.exportquery(status, keywords, withoutcontent)
+        return streamexport(qs, Notice.listfields(withoutcontent), fmt, 'cimp_notice',
+                            asynchronous=isinstance(request, ASGIRequest))
+    
+class NewsHandler(Handler):
+    def allow(self, request):
         if not request.user.is_staff:
-            return JsonResponse({'ret': 2, 'msg': 'Admin access only'})
-        
-        if request.method == 'GET':
-            pd = request.GET
-        else:
-            pd = json.loads(request.body)
-        
-        request.pd = pd
-        
-        action = pd.get('action')
-        if action == 'listbypage':
-            return self.listbypage(request)
-        elif action == 'listbypage_allstate':
-            return self.listbypage_allstate(request)
-        elif action == 'getone':
-            return self.getone(request)
-        elif action == 'addone':
-            return self.addone(request)
-        elif action == 'modifyone':
-            return self.modifyone(request)
-        elif action == 'banone':
-            return self.banone(request)
-        elif action == 'publishone':
-            return self.publishone(request)
-        elif action == 'deleteone':
-            return self.deleteone(request)
-        else:
-            return JsonResponse({'ret': 2, 'msg': 'Action parameter error'})
+            return JR({'ret': 2, 'msg': 'Admin access only'})
         
+    @action('listbypage', 'pagenum?', 'pagesize', 'withoutcontent?')
+    @replica
+    @conditional('cimp_news')
     def listbypage(self, request):
-        pagenum = int(request.pd.get('pagenum'))
-        pagesize = int(request.pd.get('pagesize'))
-        keywords = str(request.pd.get('keywords'))
-        withoutcontent = bool(request.pd.get('withoutcontent', False))
+        try:
+            # pagenum is None when the client asks for cursor mode
+            pagenum, after_id, before_id = pageparams(request.pd)
+        except ValueError:
+            return JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+        pagesize = request.pd['pagesize']
+        keywords = str(request.pd.get('keywords', ''))
+        withoutcontent = request.pd.get('withoutcontent', False)
         
-        ret = News.listbypage(pagenum, pagesize, keywords, withoutcontent)
+        ret = News.listbypage(pagenum, pagesize, keywords, withoutcontent, after_id, before_id, totalparam(request.pd))
         return JR(ret)
     
+    @action('listbypage', 'pagenum?', 'pagesize', 'withoutcontent?')
+    @replica
+    @conditional('cimp_news')
+    async def alistbypage(self, request):
+        try:
+            pagenum, after_id, before_id = pageparams(request.pd)
+        except ValueError:
+            return JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+        pagesize = request.pd['pagesize']
+        keywords = str(request.pd.get('keywords', ''))
+        withoutcontent = request.pd.get('withoutcontent', False)
+        
+        ret = await News.alistbypage(pagenum, pagesize, keywords, withoutcontent, after_id, before_id, totalparam(request.pd))
+        return JR(ret)
+    
+    @action('listbypage_allstate', 'pagenum?', 'pagesize', 'withoutcontent?')
+    @replica
+    @conditional('cimp_news', 'cimp_readsketch')
     def listbypage_allstate(self, request):
-        pagenum = int(request.pd.get('pagenum'))
-        pagesize = int(request.pd.get('pagesize'))
-        keywords = str(request.pd.get('keywords'))
-        withoutcontent = bool(request.pd.get('withoutcontent', False))
+        try:
+            # pagenum is None when the client asks for cursor mode
+            pagenum, after_id, before_id = pageparams(request.pd)
+        except ValueError:
+            return JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+        pagesize = request.pd['pagesize']
+        keywords = str(request.pd.get('keywords', ''))
+        withoutcontent = request.pd.get('withoutcontent', False)
         
-        ret = News.listbypage_allstate(pagenum, pagesize, keywords, withoutcontent)
+        ret = News.listbypage_allstate(pagenum, pagesize, keywords, withoutcontent, after_id, before_id, totalparam(request.pd))
+        # Estimated distinct readers, see main/models/readers.py
+        ret = ReadSketch.markreaders(ret, News)
         return JR(ret)
     
+    @action('getone', 'id')
+    @replica
+    @conditional('cimp_news')
     def getone(self, request):
         news_id = request.pd.get('id')
         ret = News.getone(news_id)
+        if ret['ret'] == 0 and ret['rec']:
+            ReadSketch.record(News, ret['rec']['id'], request.user.id)
+        return JR(ret)
+    
+    @action('getone', 'id')
+    @replica
+    @conditional('cimp_news')
+    async def agetone(self, request):
+        news_id = request.pd.get('id')
+        ret = await News.agetone(news_id)
+        if ret['ret'] == 0 and ret['rec']:
+            await ReadSketch.arecord(News, ret['rec']['id'], request.user.id)
         return JR(ret)
 
+    @action('addone')
     def addone(self, request):
         
         data = request.pd.get('data')
@@ -171,24 +268,73 @@ class NewsHandler:
         ret = News.addone(data, author)
         return JR(ret)
     
+    @action('modifyone', 'id')
     def modifyone(self, request):
         news_id = request.pd.get("id")
         new_data = request.pd.get("newdata")
         ret = News.modifyone(news_id, new_data)
         return JR(ret)
     
+    @action('banone', 'id')
     def banone(self, request):
         news_id = request.pd.get("id")
         ret = News.banone(news_id)
         return JR(ret)
 
+    @action('publishone', 'id')
     def publishone(self, request):
         news_id = request.pd.get("id")
         ret = News.publishone(news_id)
         return JR(ret)
     
+    @action('deleteone', 'id')
     def deleteone(self, request):
         news_id = request.pd.get("id")
         ret = News.deleteone(news_id)
         return JR(ret)
- 
\ No newline at end of file
+    
+    # Moderation of many ids: {"ids": [...]}, one outcome per id in 'results'
+    @action('banmany')
+    def banmany(self, request):
+        try:
+            ids = parseids(request.pd.get('ids'))
+        except ValueError:
+            return JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+        ret = News.banmany(ids)
+        return JR(ret)
+    
+    @action('publishmany')
+    def publishmany(self, request):
+        try:
+            ids = parseids(request.pd.get('ids'))
+        except ValueError:
+            return JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+        ret = News.publishmany(ids)
+        return JR(ret)
+    
+    @action('deletemany')
+    def deletemany(self, request):
+        try:
+            ids = parseids(request.pd.get('ids'))
+        except ValueError:
+            return JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+        ret = News.deletemany(ids)
+        return JR(ret)
+    
+    # Whole table as an NDJSON or CSV download, streamed in one pass
+    @action('export', 'withoutcontent?')
+    def export(self, request):
+        fmt = request.pd.get('format', 'ndjson')
+        status = request.pd.get('status')
+        try:
+            status = None if status in (None, '') else int(status)
+        except ValueError:
+            return JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+        if fmt not in FORMATS:
+            return JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+        keywords = str(request.pd.get('keywords', ''))
+        withoutcontent = request.pd.get('withoutcontent', False)
+        
+        qs = News.exportquery(status, keywords, withoutcontent)
+        return streamexport(qs, News.listfields(withoutcontent), fmt, 'cimp_news',
+                            asynchronous=isinstance(request, ASGIRequest))
@@ -1,42 +1,32 @@
-import json
-from django.http import JsonResponse
+from django.http import HttpResponse
 from lib.share import JR
+from lib.dispatch import Handler, action
+from lib import readcache, compression, dbpool, metrics
+from lib.httpcache import conditional
+from lib.dbrouter import replica
 from main.models import Config
 from config.settings import UPLOAD_DIR
 from datetime import datetime
 from random import randint
 
-class ConfigHandler:
-    def handle(self, request):
-        
+class ConfigHandler(Handler):
+    def allow(self, request):
         if not request.user.is_staff:
-            return JsonResponse({'ret': 2, 'msg': 'Admin access only'})
-            
-        if request.method == 'GET':
-            pd = request.GET
-        else:
-            pd = json.loads(request.body)
-            
-        request.pd = pd
-        
-        action = pd.get('action')
-        if action == 'set':
-            return self.set(request)
-        elif action == 'get':
-            return self.get(request)
-        elif action == 'gethomepagebyconfig':
-            return self.gethomepagebyconfig(request)
-        else:
-            return JsonResponse({'ret': 2, 'msg': 'Action parameter error'})
-        
+            return JR({'ret': 2, 'msg': 'Admin access only'})
+    
+    # Creates or replaces the value
+    @action('set')
     def set(self, request):
-        data = json.loads(request.body.decode('utf-8'))
+        data = request.pd
         if data.get('name') == 'homepage':
             ret = Config.set(data)
             return JR(ret)
         else:
             return JR({'ret': 2, 'msg': 'Not homepage setting'})
     
+    @action('get')
+    @replica
+    @conditional('cimp_config')
     def get(self, request):
         name = request.pd.get('name')
         if name == 'homepage':
@@ -45,11 +35,53 @@ class ConfigHandler:
         else:
             return JR({'ret': 2, 'msg': 'Not homepage setting'})
     
+    @action('gethomepagebyconfig')
+    @replica
+    @conditional('cimp_config', 'cimp_news', 'cimp_notice', 'cimp_paper')
     def gethomepagebyconfig(self, request):
-        config = Config()
-        ret = config.gethomepagebyconfig()
+        # Served from the in-memory snapshot, already serialized
+        ret = Config.homepagesnapshot()
+        if ret['ret'] != 0:
+            return JR(ret)
+        response = HttpResponse(ret['body'], content_type='application/json')
+        response.ret = 0
+        return response
+    
+    @action('gethomepagebyconfig')
+    @replica
+    @conditional('cimp_config', 'cimp_news', 'cimp_notice', 'cimp_paper')
+    async def agethomepagebyconfig(self, request):
+        ret = await Config.ahomepagesnapshot()
+        if ret['ret'] != 0:
+            return JR(ret)
+        response = HttpResponse(ret['body'], content_type='application/json')
+        response.ret = 0
+        return response
+    
+    # Published news, notices and papers merged by pubdate, cursor paginated
+    @action('timeline', 'pagesize?')
+    @replica
+    @conditional('cimp_news', 'cimp_notice', 'cimp_paper')
+    def timeline(self, request):
+        pagesize = min(request.pd.get('pagesize', 20), 100)
+        cursor = request.pd.get('cursor')
+        ret = Config.timeline(pagesize, cursor)
         return JR(ret)
     
+    # Read cache hit/miss, compression and connection pool counters of this worker process
+    @action('cachestats')
+    def cachestats(self, request):
+        return JR({'ret': 0, 'stats': readcache.stats(), 'compression': compression.stats(), 'pools': dbpool.stats()})
+    
+class MetricsHandler:
+    # Latency histograms, error and query counts per endpoint and action of
+    # all the workers, in the Prometheus text format, see lib/metrics.py
+    def handle(self, request):
+        if not request.user.is_staff:
+            return JR({'ret': 2, 'msg': 'Admin access only'}, status=403)
+        body = metrics.render(metrics.aggregate())
+        return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+    
 class UploadHandler:
     def handle(self, request):
         uploadFile = request.FILES.get('upload1')
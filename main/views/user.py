@@ -1,38 +1,22 @@
-import json
 from django.contrib.auth import authenticate, login, logout
 from django.http import JsonResponse
 from lib.share import JR
+from lib.dispatch import Handler, action
+from lib.dbrouter import replica
+from lib.pagination import totalparam
 from main.models import User, Profile, Thumbup
 
 # Create your views here.
-class SignHandler:
-    def handle(self, request):
-        # parameters data called pd, it's a dict
-        if request.method == "GET":
-            return JsonResponse({"message": "This endpoint does not support GET requests."}, status=405)
-
-        if request.method == "POST":
-            try:
-                if not request.body:
-                    return JsonResponse({"error": "Empty request body"}, status=400)
+class SignHandler(Handler):
+    UNKNOWN_ACTION_STATUS = 400
 
-                pd = json.loads(request.body)
-                # Process the data as needed
-            except json.JSONDecodeError:
-                return JsonResponse({"error": "Invalid JSON"}, status=400)
-        
-        action = pd.get('action')
-        
-        # Request is handled one by one, no user conflict, so store pd in request object
-        request.pd = pd
-        
-        if action == 'signin':
-            return self.signin(request)
-        elif action == 'signout':
-            return self.signout(request)
-        else:
-            return JsonResponse({'ret': 2, 'msg': 'Action parameter error'}, status=400)
+    def allow(self, request):
+        if request.method != "POST":
+            return JsonResponse({"message": "This endpoint does not support GET requests."}, status=405)
+        if not request.body:
+            return JsonResponse({"error": "Empty request body"}, status=400)
         
+    @action('signin')
     def signin(self, request):
         
         # Get username and password from HTTP POST request
@@ -65,40 +49,21 @@ class SignHandler:
         )
 
     # Logout handling
+    @action('signout')
     def signout(self, request):
         # Use logout method
         logout(request)
-        return JsonResponse({'ret': 0})
+        return JR({'ret': 0})
 
-class AccountHandler:
-    def handle(self, request):
-        
+class AccountHandler(Handler):
+    UNKNOWN_ACTION_STATUS = 400
+
+    def allow(self, request):
         if not request.user.is_staff:
-            return JsonResponse({'ret': 2, 'msg': 'Admin access only'}, status=403)
-        
-        if request.method == 'GET':
-            pd = request.GET
-        else:
-            pd = json.loads(request.body)
-        
-        # Request is handled one by one, no user conflict, so store pd in request object
-        request.pd = pd
-        
-        # parameters data called pd, it's a dict
-        action = pd.get('action')
-        
-        if action == 'listbypage':
-            return self.listbypage(request)
-        elif action == 'addone':
-            return self.addone(request)
-        elif action == 'modifyone':
-            return self.modifyone(request)
-        elif action == 'deleteone':
-            return self.deleteone(request)
-        else:
-            return JsonResponse({'ret': 2, 'msg': 'Action parameter error'}, status=400)
+            return JR({'ret': 2, 'msg': 'Admin access only'}, status=403)
         
     # Add user
+    @action('addone')
     def addone(self, request):
         
         data = request.pd.get('data')
@@ -108,17 +73,20 @@ class AccountHandler:
         return JR(ret)
 
     # List users
+    @action('listbypage', 'pagenum', 'pagesize')
+    @replica
     def listbypage(self, request):
         
-        pagenum = int(request.pd.get('pagenum'))
-        pagesize = int(request.pd.get('pagesize'))
-        keywords = str(request.pd.get('keywords'))
+        pagenum = request.pd['pagenum']
+        pagesize = request.pd['pagesize']
+        keywords = str(request.pd.get('keywords', ''))
         
-        ret = User.listbypage(pagenum, pagesize, keywords)
+        ret = User.listbypage(pagenum, pagesize, keywords, totalparam(request.pd))
         
         return JR(ret)
     
     # Modify user info
+    @action('modifyone', 'id')
     def modifyone(self, request):
         
         newdata = request.pd.get('newdata')
@@ -129,6 +97,7 @@ class AccountHandler:
         return JR(ret)
     
     # Delete user info
+    @action('deleteone', 'id')
     def deleteone(self, request):
         
         oid = request.pd.get('id')
@@ -137,31 +106,12 @@ class AccountHandler:
         
         return JR(ret)
 
-class ProfileHandler:
-    def handle(self, request):
-        
+class ProfileHandler(Handler):
+    def allow(self, request):
         if request.user.is_staff:
-            return JsonResponse({'ret': 2, 'msg': 'Teachers and Students only'})
-            
-        if request.method == 'GET':
-            pd = request.GET
-        else:
-            pd = json.loads(request.body)
-            
-        request.pd = pd
-        
-        action = pd.get('action')
-        if action == 'setmyprofile':
-            return self.setmyprofile(request)
-        elif action == 'getmyprofile':
-            return self.getmyprofile(request)
-        elif action == 'listteachers':
-            return self.listteachers(request)
-        elif action == 'thumbuporcancel':
-            return self.thumbuporcancel(request)
-        else:
-            return JsonResponse({'ret': 2, 'msg': 'Action parameter error'})
-        
+            return JR({'ret': 2, 'msg': 'Teachers and Students only'})
+    
+    @action('getmyprofile')
     def getmyprofile(self, request):
         current_user = request.user
         ret = Profile.setmyprofile(current_user)
@@ -169,6 +119,7 @@ class ProfileHandler:
         return JR(ret)
 
     
+    @action('setmyprofile')
     def setmyprofile(self, request):
         current_user = request.user
         data = request.pd.get('newdata')
@@ -177,19 +128,33 @@ class ProfileHandler:
         
         return JR(ret)
     
+    @action('listteachers')
+    @replica
     def listteachers(self, request):
         current_user = request.user
         if current_user.usertype != 2000:
-            return JsonResponse({'ret': 2, 'msg': 'Student operation only'})
+            return JR({'ret': 2, 'msg': 'Student operation only'})
         keywords = request.pd.get('keywords')
         
         ret = Profile.listteachers(keywords)
         return JR(ret)
     
+    @action('listteachers')
+    @replica
+    async def alistteachers(self, request):
+        current_user = request.user
+        if current_user.usertype != 2000:
+            return JR({'ret': 2, 'msg': 'Student operation only'})
+        keywords = request.pd.get('keywords')
+        
+        ret = await Profile.alistteachers(keywords)
+        return JR(ret)
+    
+    @action('thumbuporcancel')
     def thumbuporcancel(self, request):
         current_user = request.user
         if current_user.usertype != 2000 and current_user.usertype != 3000:
-            return JsonResponse({'ret': 2, 'msg': 'Teacher and Student operation only'})
-        paper_id = request.get('paperid')
-        ret = Thumbup.listteachers(paper_id, current_user)
+            return JR({'ret': 2, 'msg': 'Teacher and Student operation only'})
+        paper_id = request.pd.get('paperid')
+        ret = Thumbup.thumbuporcancel(paper_id, current_user)
         return JR(ret)
@@ -1,47 +1,32 @@
 import json
-from django.http import JsonResponse
+from django.db import transaction
 from lib.share import JR
-from main.models import GraduateDesign, GraduateDesignStep
+from lib.dispatch import Handler, action
+from lib.dbrouter import replica
+from lib.pagination import totalparam
+from main.models import GraduateDesign, GraduateDesignStep, RowCounter
 import traceback
 
-class GraduateDesignHandler:
-    def handle(self, request):
+class GraduateDesignHandler(Handler):
+    UNKNOWN_ACTION_STATUS = 400
+
+    def allow(self, request):
         # Global login check
         if not request.user.is_authenticated:
-            return JsonResponse({'ret': 1, 'msg': 'Please login first'})
-        
-        # Parse parameters
-        if request.method == 'GET':
-            pd = request.GET
-        else:
-            try:
-                pd = json.loads(request.body)
-            except:
-                pd = {}
-        
-        request.pd = pd
-        action = pd.get('action')
-        
-        if action == 'listbypage':
-            return self.listbypage(request)
-        elif action == 'getone':
-            return self.getone(request)
-        elif action == 'stepaction':
-            return self.stepaction(request)
-        elif action == 'getstepactiondata':
-            return self.getstepactiondata(request)
-        else:
-            return JsonResponse({'ret': 2, 'msg': 'Action parameter error'}, status=400)
-        
+            return JR({'ret': 1, 'msg': 'Please login first'})
         
+    @action('listbypage', 'pagenum?', 'pagesize?')
+    @replica
     def listbypage(self, request):
-        pagenum = int(request.pd.get('pagenum', 1))
-        pagesize = int(request.pd.get('pagesize', 10))
+        pagenum = request.pd.get('pagenum', 1)
+        pagesize = request.pd.get('pagesize', 10)
         keywords = str(request.pd.get('keywords', ''))
         
-        ret = GraduateDesign.listbypage(pagenum, pagesize, keywords, request.user)
+        ret = GraduateDesign.listbypage(pagenum, pagesize, keywords, request.user, totalparam(request.pd))
         return JR(ret)
     
+    @action('getone')
+    @replica
     def getone(self, request):
         try:
             wf_id = int(request.pd.get('wf_id'))
@@ -51,13 +36,15 @@ class GraduateDesignHandler:
             ret = GraduateDesign.getone(wf_id, withwhatcanido, request.user)
             return JR(ret)
         except ValueError:
-            return JsonResponse({'ret': 2, 'msg': 'Parameter format error'}, status=400)
+            return JR({'ret': 2, 'msg': 'Parameter format error'}, status=400)
     
+    @action('getstepactiondata')
     def getstepactiondata(self, request):
         step_id = request.pd.get('step_id')
         ret = GraduateDesignStep.getstepactiondata(step_id)
         return JR(ret)
 
+    @action('stepaction')
     def stepaction(self, request):
         try:
             key = request.pd.get('key')
@@ -104,12 +91,14 @@ class GraduateDesignHandler:
                         title = item['value']
                         break
                         
-                gd_obj = GraduateDesign.objects.create(
-                    creator=user,
-                    creator_realname=user.realname,
-                    title=title,
-                    currentstate=next_state
-                )
+                with transaction.atomic():
+                    gd_obj = GraduateDesign.objects.create(
+                        creator=user,
+                        creator_realname=user.realname,
+                        title=title,
+                        currentstate=next_state
+                    )
+                    RowCounter.bump(GraduateDesign, None, gd_obj.creator_id, 1)
             
             # Scenario B: Update existing workflow
             else: